@@ -0,0 +1,175 @@
+import pandas as pd
+import numpy as np
+import hashlib
+import shutil
+import threading
+import pickle
+import os
+
+
+class BroadcastHandle(object):
+    """
+    the small reference that is placed in a queue element in place of a
+    large object (e.g., the block master data frame).  The object itself is
+    published once to the shared broadcast store and servants fetch it with
+    fetch()
+    """
+
+    def __init__(self, key, name, store_dir):
+        self.key        = key
+        self.name       = name
+        self.store_dir  = store_dir
+
+    def __repr__(self):
+        return 'BroadcastHandle(%s, %s)' % (self.name, self.key[:12])
+
+
+# the objects this process has already fetched, keyed by content key
+_fetched = {}
+
+def isNumericArray(values):
+    return isinstance(values, np.ndarray) and values.dtype.kind in 'biufcmM'
+
+def publish(config, my_object, name):
+    """
+    writes a large object to the shared broadcast store once.  The store is
+    content addressed, so publishing the same data again reuses the copy
+    that is already there.  Numeric data frame columns are written as numpy
+    files that servants can memory map; everything else is pickled
+
+    Arguments In:
+        config:         the json variable that contains all configration
+                        data required for the data processing
+        my_object:      the object to be shared with the servants
+        name:           a string variable that describes the object (used in
+                        log messages)
+
+    Arguments Out:
+        handle:         a BroadcastHandle to place in the queue elements
+    """
+    store_dir = config['broadcast_store']['store_dir']
+    arrays = {}
+    if isinstance(my_object, pd.DataFrame):
+        # hash the numeric columns in place and pickle the rest
+        key_hash = hashlib.sha1()
+        for i, c in enumerate(my_object.columns):
+            values = my_object[c].values
+            if isNumericArray(values):
+                arrays[i] = np.ascontiguousarray(values)
+                key_hash.update(('%s|%s|%s' % (i, c, values.dtype)).encode())
+                key_hash.update(arrays[i].view(np.uint8))
+        other_df = my_object[[c for i, c in enumerate(my_object.columns)
+                            if i not in arrays]]
+        meta = pickle.dumps({   'kind':     'frame',
+                                'columns':  list(my_object.columns),
+                                'arrays':   sorted(arrays),
+                                'index':    my_object.index,
+                                'other':    other_df},
+                                protocol=pickle.HIGHEST_PROTOCOL)
+        key_hash.update(meta)
+    else:
+        meta = pickle.dumps({'kind': 'object', 'object': my_object},
+                            protocol=pickle.HIGHEST_PROTOCOL)
+        key_hash = hashlib.sha1(meta)
+    key = key_hash.hexdigest()
+
+    # write the object to a temporary folder and move it into place so a
+    # servant never sees a partial copy
+    if not os.path.exists(store_dir + key):
+        temp_dir = store_dir + '%s.tmp%s.%s' % (key, os.getpid(), 
+                                            threading.get_native_id())
+        os.makedirs(temp_dir, exist_ok=True)
+        for i in arrays:
+            np.save(temp_dir + '/%s.npy' % i, arrays[i])
+        with open(temp_dir + '/meta.pkl', 'wb') as my_jar:
+            my_jar.write(meta)
+        try:
+            os.rename(temp_dir, store_dir + key)
+        except OSError:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    return BroadcastHandle(key, name, store_dir)
+
+def clearStore(config):
+    """
+    empties the shared broadcast store.  Called by the master when a new run
+    starts
+
+    Arguments In:
+        config:         the json variable that contains all configration
+                        data required for the data processing
+
+    Arguments Out:
+        None
+    """
+    shutil.rmtree(config['broadcast_store']['store_dir'], ignore_errors=True)
+    os.makedirs(config['broadcast_store']['store_dir'], exist_ok=True)
+
+def fetch(config, handle):
+    """
+    returns the object behind a queue element.  The first process on a
+    servant to ask for an object copies it from the shared store into the
+    node cache (shared memory); every process then maps the numeric columns
+    from there, so the data is held in memory once per servant.  The object
+    is read only - make a copy before changing it.  Anything that is not a
+    BroadcastHandle is returned unchanged
+
+    Arguments In:
+        config:         the json variable that contains all configration
+                        data required for the data processing
+        handle:         the BroadcastHandle taken from the queue element
+
+    Arguments Out:
+        my_object:      the published object
+    """
+    if not isinstance(handle, BroadcastHandle):
+        return handle
+    if handle.key in _fetched:
+        return _fetched[handle.key]
+
+    # copy the object into the node cache once per servant
+    cache_dir = config['broadcast_store']['node_cache_dir']
+    local_dir = cache_dir + handle.key
+    if not os.path.exists(local_dir):
+        temp_dir = cache_dir + '%s.tmp%s.%s' % (handle.key, os.getpid(),
+                                            threading.get_native_id())
+        os.makedirs(cache_dir, exist_ok=True)
+        shutil.copytree(handle.store_dir + handle.key, temp_dir)
+        try:
+            os.rename(temp_dir, local_dir)
+        except OSError:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    with open(local_dir + '/meta.pkl', 'rb') as my_jar:
+        meta = pickle.load(my_jar)
+    if meta['kind'] == 'frame':
+        columns = {}
+        for i, c in enumerate(meta['columns']):
+            if i in meta['arrays']:
+                columns[i] = np.load(local_dir + '/%s.npy' % i, mmap_mode='r')
+            else:
+                columns[i] = meta['other'][c].values
+        my_object = pd.DataFrame(columns, index=meta['index'], copy=False)
+        my_object.columns = meta['columns']
+    else:
+        my_object = meta['object']
+
+    _fetched[handle.key] = my_object
+    return my_object
+
+def clearNodeCache(config):
+    """
+    empties the node cache and forgets the objects this process fetched.
+    Called by the servant when a pool of workers finishes
+
+    Arguments In:
+        config:         the json variable that contains all configration
+                        data required for the data processing
+
+    Arguments Out:
+        None
+    """
+    _fetched.clear()
+    shutil.rmtree(config['broadcast_store']['node_cache_dir'],
+                    ignore_errors=True)
+    os.makedirs(config['broadcast_store']['node_cache_dir'], exist_ok=True)
@@ -0,0 +1,380 @@
+from decimal import Decimal, ROUND_HALF_UP
+import geopandas as gpd
+import pandas as pd
+import numpy as np
+import itertools
+import shapely
+import struct
+import fiona
+
+
+# every binary COPY stream starts with the signature, a flags field and the
+# length of the (empty) header extension, and ends with a -1 field count
+COPY_HEADER     = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+COPY_TRAILER    = struct.pack('>h', -1)
+NULL_FIELD      = struct.pack('>i', -1)
+
+
+class BinaryCopyStream(object):
+    """
+    a read only file object over the chunks of a binary COPY stream.
+    psycopg2's copy_expert reads the stream a block at a time, so only one
+    chunk of rows is encoded and held in memory at once
+    """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = b''
+        self.offset = 0
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            data = self.buffer[self.offset:] + b''.join(self.chunks)
+            self.buffer, self.offset = b'', 0
+            return data
+        while len(self.buffer) - self.offset < size:
+            try:
+                chunk = next(self.chunks)
+            except StopIteration:
+                break
+            self.buffer = self.buffer[self.offset:] + chunk
+            self.offset = 0
+        data = self.buffer[self.offset:self.offset + size]
+        self.offset += len(data)
+        return data
+
+
+def promoteToMulti(geometry):
+    """
+    converts every polygon in a geometry column to a single part
+    multipolygon so all records of a table have the same geometry type
+
+    Arguments In:
+        geometry:       a GeoSeries (or array) of polygons and multipolygons
+
+    Arguments Out:
+        geometry:       a numpy array of multipolygons
+    """
+    geometry = np.asarray(geometry, dtype=object)
+    polygons = np.flatnonzero(shapely.get_type_id(geometry) == 3)
+    if len(polygons) > 0:
+        geometry = geometry.copy()
+        geometry[polygons] = shapely.multipolygons(geometry[polygons],
+                                indices=np.arange(len(polygons)))
+    return geometry
+
+def polygonalParts(geometry):
+    """
+    keeps the polygons of each geometry (e.g., of the geometry collections 
+    make_valid returns when a repair leaves stray lines or points) as one
+    multipolygon per geometry
+
+    Arguments In:
+        geometry:       a numpy array of geometries
+
+    Arguments Out:
+        geometry:       a numpy array of multipolygons.  A geometry without
+                        any polygon becomes an empty multipolygon
+    """
+    # two levels of parts: a collection can hold multipolygons
+    parts, index = shapely.get_parts(geometry, return_index=True)
+    parts, sub_index = shapely.get_parts(parts, return_index=True)
+    index = index[sub_index]
+    keep = shapely.get_type_id(parts) == 3
+    result = np.empty(len(geometry), dtype=object)
+    result[:] = shapely.from_wkt('MULTIPOLYGON EMPTY')
+    rows = np.unique(index[keep])
+    if len(rows) > 0:
+        result[rows] = shapely.multipolygons(parts[keep], 
+                            indices=np.searchsorted(rows, index[keep]))
+    return result
+
+def normalizeGeometry(geometry):
+    """
+    normalizes the geometry of a shape file as it is loaded, an array at a
+    time: invalid geometries are repaired once (make_valid, keeping only the
+    polygons) and every polygon is promoted to a multipolygon.  The validity
+    flag lets the overlay statements skip the defensive ST_BUFFER(..., 0) 
+    for geometries that are known to be valid
+
+    Arguments In:
+        geometry:       a GeoSeries (or array) of polygons and multipolygons
+
+    Arguments Out:
+        geometry:       a numpy array of multipolygons
+        valid:          a numpy array of booleans that indicates if each
+                        geometry is valid after the repair
+    """
+    geometry = np.asarray(geometry, dtype=object)
+    valid = shapely.is_valid(geometry)
+    invalid = np.flatnonzero(~valid)
+    if len(invalid) > 0:
+        geometry = geometry.copy()
+        geometry[invalid] = polygonalParts(shapely.make_valid(geometry[invalid]))
+        valid[invalid] = shapely.is_valid(geometry[invalid])
+    return promoteToMulti(geometry), valid
+
+def tableColumns(table_columns, srid=None, id_column='"GID"', 
+                geometry_column='"GEOMETRY"', valid_column='"GEOMETRY_VALID"'):
+    """
+    declares the typed table a shape file is loaded into: the row number
+    column, the declared columns, a multipolygon geometry column and the 
+    validity flag of the geometry (see normalizeGeometry)
+
+    Arguments In:
+        table_columns:      a list of [column name, postgres type, source]
+                            entries (e.g., config['block_table_columns']).
+                            The source is the shape file attribute the 
+                            column is loaded from (the column name if it is
+                            left out) or a list of [attribute, digits] pairs
+                            for a FIPS code built from several attributes
+        srid:               the spatial reference id of the geometry.  An
+                            empty string or None leaves the SRID unset
+        id_column:          the quoted name of the row number column
+        geometry_column:    the quoted name of the geometry column
+        valid_column:       the quoted name of the validity flag column
+
+    Arguments Out:
+        columns:            a list of (quoted column name, postgres type,
+                            source) tuples.  The source is None for the row
+                            number, the geometry and the validity flag
+    """
+    columns = [(id_column, 'bigint', None)]
+    for entry in table_columns:
+        source = entry[2] if len(entry) > 2 else entry[0]
+        columns.append(('"%s"' % entry[0], entry[1], source))
+    if srid in (None, ''):
+        columns.append((geometry_column, 'geometry(MULTIPOLYGON)', None))
+    else:
+        columns.append((geometry_column, 'geometry(MULTIPOLYGON, %s)' % srid,
+                        None))
+    columns.append((valid_column, 'boolean', None))
+    return columns
+
+def isGenerated(pg_type):
+    """
+    Arguments In:
+        pg_type:        the postgres type of a declared column
+
+    Arguments Out:
+        generated:      True for a column the database computes from the 
+                        other columns (GENERATED ALWAYS AS ... STORED), which
+                        is left out of the COPY
+    """
+    return ' GENERATED ' in ' %s ' % pg_type.upper()
+
+def sourceValues(shape_df, source):
+    """
+    Arguments In:
+        shape_df:       the geodataframe read from the shape file
+        source:         an attribute name, or a list of [attribute, digits]
+                        pairs that are zero padded and joined into a FIPS
+                        code (e.g., the state and county FIPS)
+
+    Arguments Out:
+        values:         the values of the column
+    """
+    if isinstance(source, list):
+        values = None
+        for attribute, digits in source:
+            part = shape_df[attribute].astype(str).str.zfill(digits)
+            values = part if values is None else values + part
+        return values.values
+    return shape_df[source].values
+
+def createTableSQL(schema, table_name, columns, partition_column=None):
+    """
+    Arguments In:
+        schema:             the database schema of the table
+        table_name:         the name of the table
+        columns:            the columns declared by tableColumns
+        partition_column:   the quoted name of the column the table is list
+                            partitioned by.  None for a plain table
+
+    Arguments Out:
+        sql_string:         the statement that creates the table
+    """
+    sql_string = 'CREATE TABLE %s.%s (%s)' % (schema, table_name,
+                ', '.join('%s %s' % (c[0], c[1]) for c in columns))
+    if partition_column is not None:
+        sql_string += ' PARTITION BY LIST (%s)' % partition_column
+    return sql_string + ';'
+
+def encodeFields(values, pg_type, srid=None):
+    """
+    encodes a column as the length prefixed fields of a binary COPY stream
+
+    Arguments In:
+        values:         the values of the column (a pandas series or array)
+        pg_type:        the postgres type of the column
+        srid:           the spatial reference id written into the EWKB of a
+                        geometry column.  An empty string or None omits it
+
+    Arguments Out:
+        fields:         a list with the encoded bytes of each value
+    """
+    if pg_type == 'bigint' or pg_type == 'double precision':
+        # fixed width values are encoded for the whole column at once
+        if pg_type == 'bigint':
+            record = np.dtype([('length', '>i4'), ('value', '>i8')])
+        else:
+            record = np.dtype([('length', '>i4'), ('value', '>f8')])
+        values = np.asarray(values)
+        encoded = np.empty(len(values), dtype=record)
+        encoded['length'] = record['value'].itemsize
+        encoded['value'] = values
+        raw = encoded.tobytes()
+        size = record.itemsize
+        fields = [raw[i:i + size] for i in range(0, len(raw), size)]
+        if pg_type == 'double precision':
+            for i in np.flatnonzero(np.isnan(values)):
+                fields[i] = NULL_FIELD
+        return fields
+
+    if pg_type.startswith('numeric'):
+        scale = int(pg_type.rstrip(')').split(',')[1]) if ',' in pg_type else 0
+        return [NULL_FIELD if pd.isna(v) else encodeNumeric(v, scale)
+                for v in values]
+
+    if pg_type == 'boolean':
+        return [NULL_FIELD if v is None else
+                struct.pack('>i?', 1, bool(v)) for v in values]
+
+    if pg_type.startswith('geometry'):
+        geometry = np.asarray(values, dtype=object)
+        if srid not in (None, ''):
+            geometry = shapely.set_srid(geometry, int(srid))
+        encoded = shapely.to_wkb(geometry, include_srid=srid not in (None, ''))
+    else:
+        encoded = [None if pd.isna(v) else str(v).encode('utf-8')
+                    for v in values]
+    return [NULL_FIELD if v is None else struct.pack('>i', len(v)) + v
+            for v in encoded]
+
+def encodeNumeric(value, scale):
+    """
+    encodes a value as a binary COPY numeric field: the number of base 10000
+    digits, the weight of the first digit, the sign, the display scale and
+    the digits
+
+    Arguments In:
+        value:          the value (a number or its text, e.g. '+38.1234567')
+        scale:          the number of decimal places of the column
+
+    Arguments Out:
+        field:          the length prefixed bytes of the value
+    """
+    value = Decimal(str(value).strip()).quantize(Decimal(1).scaleb(-scale),
+                                                rounding=ROUND_HALF_UP)
+    sign = 0x4000 if value < 0 else 0x0000
+    # the digits after the decimal point are padded to a multiple of four so
+    # the base 10000 digits line up with the decimal point
+    fraction_groups = (scale + 3) // 4
+    number = int(abs(value).scaleb(4 * fraction_groups))
+    digits = []
+    while number > 0:
+        digits.insert(0, number % 10000)
+        number //= 10000
+    weight = len(digits) - 1 - fraction_groups
+    while len(digits) > 0 and digits[-1] == 0:
+        digits.pop()
+    if len(digits) == 0:
+        weight = 0
+        sign = 0x0000
+    data = struct.pack('>hhHH', len(digits), weight, sign, scale) + \
+            struct.pack('>%sh' % len(digits), *digits)
+    return struct.pack('>i', len(data)) + data
+
+def shapeChunks(file_name, chunk_rows=50000):
+    """
+    reads a shape file a chunk of rows at a time, so only one chunk of the
+    file is held in memory while it is loaded.  The file is opened once and
+    read front to back, so a file inside a zip archive is decompressed once
+
+    Arguments In:
+        file_name:      the path to the shape file (a /vsizip/ path reads it
+                        straight out of its archive)
+        chunk_rows:     the number of rows read at a time
+
+    Arguments Out:
+        chunks:         a generator of geodataframes of at most chunk_rows
+                        rows
+    """
+    with fiona.open(file_name) as source:
+        columns = list(source.schema['properties']) + ['geometry']
+        features = iter(source)
+        while True:
+            batch = list(itertools.islice(features, chunk_rows))
+            if len(batch) == 0:
+                break
+            yield gpd.GeoDataFrame.from_features(batch, crs=source.crs, 
+                                                columns=columns)
+
+def copyRows(chunks, columns, srid=None, first_id=0):
+    """
+    generates the binary COPY stream of a series of geodataframes
+
+    Arguments In:
+        chunks:         an iterable of the geodataframes to be loaded (see
+                        shapeChunks)
+        columns:        the columns declared by tableColumns
+        srid:           the spatial reference id of the geometry
+        first_id:       the row number of the first row
+
+    Arguments Out:
+        chunks:         a generator of the bytes of the stream
+    """
+    yield COPY_HEADER
+    row_header = struct.pack('>h', len(columns))
+    start = first_id
+    for chunk in chunks:
+        geometry, valid = normalizeGeometry(chunk.geometry.values)
+        fields = []
+        for name, pg_type, source in columns:
+            if pg_type.startswith('geometry'):
+                values = geometry
+            elif pg_type == 'boolean' and source is None:
+                values = valid
+            elif source is None:
+                values = np.arange(start, start + len(chunk))
+            else:
+                values = sourceValues(chunk, source)
+            fields.append(encodeFields(values, pg_type, srid))
+        start += len(chunk)
+        yield b''.join(b''.join((row_header,) + row) for row in zip(*fields))
+    yield COPY_TRAILER
+
+def copyShapeFile(my_cursor, schema, table_name, file_name, columns,
+                    srid=None, chunk_rows=50000):
+    """
+    streams a shape file into a typed table with COPY ... FROM STDIN in the
+    binary format.  The file is read and encoded a chunk of rows at a time 
+    and the geometry is sent as (E)WKB, so neither the whole file nor its 
+    text is ever held in memory and no row by row INSERT is done by the 
+    client or the database.  Generated columns are computed by the database
+    as the rows arrive
+
+    Arguments In:
+        my_cursor:      a psycopg2 cursor
+        schema:         the database schema of the table
+        table_name:     the name of the table
+        file_name:      the path to the shape file
+        columns:        the columns declared by tableColumns
+        srid:           the spatial reference id of the geometry
+        chunk_rows:     the number of rows read and encoded at a time
+
+    Arguments Out:
+        row_count:      the number of rows loaded
+    """
+    row_count = [0]
+    def countedChunks():
+        for chunk in shapeChunks(file_name, chunk_rows):
+            row_count[0] += len(chunk)
+            yield chunk
+
+    columns = [c for c in columns if not isGenerated(c[1])]
+    sql_string = 'COPY %s.%s (%s) FROM STDIN WITH (FORMAT binary)' % \
+                (schema, table_name, ', '.join(c[0] for c in columns))
+    my_cursor.copy_expert(sql_string, BinaryCopyStream(copyRows(
+                            countedChunks(), columns, srid)), size=1 << 20)
+    return row_count[0]
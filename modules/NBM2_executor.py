@@ -0,0 +1,131 @@
+import NBM2_servant_main as nbsm
+import NBM2_task_ledger as nbtl
+import NBM2_functions as nbmf
+import threading
+import traceback
+import socket
+import queue
+import os
+
+
+def startExecutor(config, db_config):
+    """
+    connects the master to the executor that runs the distributed tasks.  In
+    the distributed mode the queues are served by the queue manager and the
+    tasks run on the servant servers.  In the local mode the task ledger and
+    the queues live in the master's process and the same servant routines
+    run in a pool of threads next to the master, so a single workstation can
+    run a slice of the data (e.g., one state) end to end without the queue
+    manager or any servants
+
+    Arguments In:
+        config:         the json variable that contains all configration
+                        data required for the data processing
+        db_config:      a dictionary that contains the configuration
+                        information for the database and queue
+
+    Arguments Out:
+        continue_run:   a boolean variable that indicates if the routine
+                        successfully completed and whether the next steps
+                        should be exectuted
+        input_queue:    the task ledger.  All information to be processed
+                        is loaded into the queue
+        output_queue:   the queue all results from the workers are loaded
+                        into
+        message_queue:  the queue that is used to communicate between the
+                        master and the servants
+    """
+    if config['executor']['mode'] == 'local':
+        return startLocalExecutor(config, db_config)
+    return nbmf.startMultiProcessingQueue(db_config)
+
+def startLocalExecutor(config, db_config):
+    """
+    creates the task ledger and the queues in the master's process and starts
+    the local servant.  The local servant is the only servant, so the master
+    sends every task (and the final None) to it once
+
+    Arguments In:
+        config:         the json variable that contains all configration
+                        data required for the data processing
+        db_config:      a dictionary that contains the configuration
+                        information for the database and queue
+
+    Arguments Out:
+        continue_run:   a boolean variable that indicates if the routine
+                        successfully completed and whether the next steps
+                        should be exectuted
+        input_queue:    the task ledger
+        output_queue:   the queue all results from the workers are loaded
+                        into
+        message_queue:  the queue that is used to communicate between the
+                        master and the local servant
+    """
+    config['number_servers'] = 1
+
+    # the workers share the master's process, so a lease can only be lost if
+    # the whole run stops - the leases never expire and are not renewed
+    speculation = dict(config['task_ledger']['speculation'], 
+                        lease_seconds=float('inf'))
+    ledger_config = dict(config['task_ledger'], lease_seconds=float('inf'),
+                        speculation=speculation)
+    output_queue = queue.Queue()
+    message_queue = queue.Queue()
+    input_queue = nbtl.TaskLedger(ledger_config, output_queue,
+                                config['telemetry']['telemetry_dir'])
+
+    servant = threading.Thread(target=nbsm.myMain, args=(input_queue,
+                output_queue, message_queue, config, db_config,
+                localPoolProcessor), daemon=True)
+    servant.start()
+
+    return True, input_queue, output_queue, message_queue
+
+def localPoolProcessor(worker_name, task_name, input_queue, output_queue,
+                        config, db_config):
+    """
+    runs the workers of a servant task as threads of the master's process.
+    Each thread leases tasks from the ledger exactly like a worker process on
+    a servant does; the pool is a fixed size (config['executor']) since the
+    threads share the memory of the master.  Each stage that is open at the
+    same time gets a pool of this size
+
+    Arguments In:
+        worker_name:    the servant routine to be run (e.g.,
+                        servant_step0.parseFBD)
+        task_name:      the name of the servant task (e.g., 'parse_fbd')
+        input_queue:    the task ledger
+        output_queue:   the queue all results from the workers are loaded
+                        into
+        config:         the json variable that contains all configration
+                        data required for the data processing
+        db_config:      a dictionary that contains the configuration
+                        information for the database and queue
+
+    Arguments Out:
+        None
+    """
+    my_ip_address = socket.gethostbyname(socket.gethostname())
+    pool_size = config['executor']['local_workers']
+    if pool_size is None:
+        pool_size = len(os.sched_getaffinity(0))
+
+    def runWorker():
+        # each thread is tracked by the ledger (and drawn in the trace) as a
+        # worker of its own
+        worker_id = nbtl.workerID(my_ip_address, threading.get_native_id())
+        try:
+            nbsm.leasedWorker(worker_name, task_name, input_queue,
+                output_queue, config, db_config, worker_id=worker_id,
+                heartbeats=False)
+        except:
+            print(traceback.format_exc())
+
+    workers = [threading.Thread(target=runWorker, daemon=True)
+                for _ in range(pool_size)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+
+    return
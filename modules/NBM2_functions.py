@@ -1,10 +1,12 @@
-from shapely.geometry.multipolygon import MultiPolygon
 from multiprocessing.managers import BaseManager
+from concurrent.futures import ThreadPoolExecutor
+import NBM2_task_ledger as nbtl
 import sqlalchemy as sal
 import geopandas as gpd 
-from shapely import wkt
+import threading
 import traceback
 import zipfile
+import json
 import time
 import glob 
 import os
@@ -51,50 +53,142 @@ def startMultiProcessingQueue(db_config):
 
     return True, input_queue, output_queue, message_queue
 
-def silentDelete(file_name):
-    try:
-        os.remove(file_name)
-    except:
-        pass
+def startServants(config, input_queue, message_queue, task_name,
+                    resumable=False):
+    """
+    Starts a distributed task on every servant server.  The task ledger 
+    behind the input queue is told which stage the following tasks belong to
+    before the servants are asked to start their worker pools.  The stages 
+    of steps that run at the same time are open together and the servants
+    run their pools side by side
+
+    Arguments In:
+        config:         the json variable that contains all configration
+                        data required for the data processing
+        input_queue:    a multiprocessing queue that can be shared across
+                        multiple servers and cores.  All information to be
+                        processed is loaded into the queue
+        message_queue:  a multiprocessing queue variable that is used to
+                        communicate between the master and servants
+        task_name:      a string variable that contains the name of the
+                        servant routine to run (see NBM2_servant_main)
+        resumable:      a boolean variable that indicates if tasks completed
+                        by a previous run can be skipped when the run is
+                        resumed.  Only true for stages whose tasks are not
+                        undone by the master routine that loads the queue
+
+    Arguments Out:
+        None
+    """
+    input_queue.beginStage(task_name, resumable and
+                            config['task_ledger']['resume_run'])
+    for _ in range(config['number_servers']):
+        message_queue.put(task_name)
+
+    return
 
-def wkb_hexer(line):
+def closeStage(config, input_queue, start_time):
     """
-    Function to generate WKB hex - converts geometry to a hex string so we
-    can load it into db.  SQLAlchemy and psycopg2 have an issue uploading
-    geometry data types into postgis, so we convert the geometry data elements
-    from the shape file into a text string
-    
+    Ends a distributed task.  The stage is closed so every worker stops as 
+    soon as it asks for another task, the routine waits (without polling) 
+    for the tasks still being worked to finish, and anything left in the
+    queues is discarded so it cannot leak into the next task
+
     Arguments In:
-        line:           object variable that holds the geometry associated 
-                        with the shape file record being loaded
-    
+        config:         the json variable that contains all configration
+                        data required for the data processing
+        input_queue:    a multiprocessing queue that can be shared across
+                        multiple servers and cores.  All information to be
+                        processed is loaded into the queue
+        start_time:     a time structure variable that indicates when the 
+                        current step started
+
     Arguments Out:
-        line.wkb_hex:   a string of the hex encoded input value that can be 
-                        inserted into a database
+        None
     """
-    return line.wkb_hex
+    temp_time = time.localtime()
+    input_queue.closeStage()
+    if not input_queue.drainStage(config['queue_timeouts']['drain_seconds']):
+        my_message = """
+            WARNING - MAIN (MASTER): WORKERS WERE STILL RUNNING %s SECONDS 
+            AFTER THE STAGE WAS CLOSED - THEIR RESULTS WILL BE IGNORED
+            """ % config['queue_timeouts']['drain_seconds']
+        print(logMessage(' '.join(my_message.split()), temp_time, 
+            time.localtime(), time.mktime(time.localtime())-\
+            time.mktime(start_time)))
 
-def convertPolyToMulti(line):
+    return
+
+def orderByCost(input_queue, tasks, estimates=None):
     """
-    Function to covert polygons to multipolygons so we can load the shape
-    file into the db with all records consistent.  Multipoly is what we 
-    want.  This function assumes that all geomtries in the shape files of 
-    interest can be converted into a multiPolygon (i.e., all shapes are 
-    either polygons or multipolygons)
+    orders the tasks of the current stage longest first, so the biggest
+    counties start right away instead of leaving one worker running long
+    after the others are idle.  A task's cost is its run time the last time
+    it completed.  Tasks that have not run before are costed from their
+    estimate (e.g., block count or file size), scaled to seconds using the
+    tasks that have both
 
     Arguments In:
-        line:   a geometry variable that contains the description of the 
-                shape being loaded
+        input_queue:    the task ledger served by the queue manager.  The
+                        stage must already have been started
+        tasks:          a list of the elements to be placed in the queue
+        estimates:      a list with a number proportional to the expected
+                        run time of each task, or None where it is unknown
 
     Arguments Out:
-        line:   a geometry variable that contains a multipolygon
+        tasks:          the list of elements sorted by decreasing cost
     """
-    if "MULTI" not in line.wkt:
-        p = wkt.loads(line.wkt)
-        m = MultiPolygon([p])
-        return m
+    if estimates is None:
+        estimates = [None] * len(tasks)
+    costs = input_queue.taskCosts(input_queue.currentStage())
+    keys = [nbtl.taskKey(t) for t in tasks]
+
+    # convert the estimates to seconds using the tasks that have both
+    measured = [(costs[k], e) for k, e in zip(keys, estimates) 
+                if k in costs and e]
+    if len(measured) > 0 and sum(m[1] for m in measured) > 0:
+        scale = sum(m[0] for m in measured) / sum(m[1] for m in measured)
     else:
-        return line
+        scale = 1.
+    known = [costs[k] if k in costs else e * scale
+            for k, e in zip(keys, estimates) if k in costs or e is not None]
+    default_cost = sum(known) / len(known) if len(known) > 0 else 0.
+
+    task_costs = []
+    for k, e in zip(keys, estimates):
+        if k in costs:
+            task_costs.append(costs[k])
+        elif e is not None:
+            task_costs.append(e * scale)
+        else:
+            task_costs.append(default_cost)
+
+    # sorted is stable, so tasks of equal cost keep their original order
+    order = sorted(range(len(tasks)), key=lambda i: -task_costs[i])
+    return [tasks[i] for i in order]
+
+def atomicName(file_name):
+    """
+    returns the temporary name an output file is written under before it is
+    moved into place with os.replace.  A reader, or a speculative copy of the
+    same task on another servant, never sees a partially written file
+
+    Arguments In:
+        file_name:      the full path of the output file
+
+    Arguments Out:
+        temp_name:      the full path of the temporary file (same directory
+                        and extension, unique to the process and thread)
+    """
+    root, extension = os.path.splitext(file_name)
+    return '%s.tmp%s.%s%s' % (root, os.getpid(), threading.get_native_id(), 
+                            extension)
+
+def silentDelete(file_name):
+    try:
+        os.remove(file_name)
+    except:
+        pass
 
 def logMessage(my_message, begin_time, end_time, running_time):
     """
@@ -174,31 +268,123 @@ def processWork(output_queue, start_time1, pool_size):
 
     return
 
-def unzip_archives(dir_name, extension):
+def archiveMembers(zip_name, extension):
+    """
+    Arguments In:
+        zip_name:       the path to a zip archive
+        extension:      the extension of the members to list (e.g., '.shp')
+
+    Arguments Out:
+        members:        a list of the names of the members of the archive
+                        with the extension
+    """
+    with zipfile.ZipFile(zip_name) as zip_ref:
+        return [m for m in zip_ref.namelist() if m.lower().endswith(extension)]
+
+def shapeFilePaths(dir_name, read_from_zip=True):
+    """
+    lists the shape files in a directory.  A shape file that is only in a 
+    zip archive is listed as a GDAL virtual path (/vsizip/<archive>/<member>)
+    so it can be read straight out of the archive without extracting it
+
+    Arguments In:
+        dir_name:       the directory with the shape files and/or archives
+        read_from_zip:  a boolean variable that indicates if the shape files
+                        in the archives are listed
+
+    Arguments Out:
+        shape_files:    a sorted list of paths gpd.read_file can open
+    """
+    shape_files = glob.glob(os.path.join(dir_name, '*.shp'))
+    extracted = set(os.path.basename(f) for f in shape_files)
+    if read_from_zip:
+        for zip_name in glob.glob(os.path.join(dir_name, '*.zip')):
+            for member in archiveMembers(zip_name, '.shp'):
+                if os.path.basename(member) not in extracted:
+                    shape_files.append('/vsizip/%s/%s' % 
+                                    (os.path.abspath(zip_name), member))
+    return sorted(shape_files)
+
+def extractArchives(zip_files, threads=8):
+    """
+    extracts zip archives next to themselves, several at a time.  What was
+    extracted is recorded in a manifest (unzip_manifest.json) in each 
+    directory, so an archive is only extracted again if it changed (size or
+    modification time) or one of its members is missing
+
+    Arguments In:
+        zip_files:      a list of paths to zip archives
+        threads:        the number of archives extracted at the same time
+
+    Arguments Out:
+        extracted:      a list of the archives that were extracted
+    """
+    manifests = {}
+    for z in zip_files:
+        dir_name = os.path.dirname(os.path.abspath(z))
+        if dir_name not in manifests:
+            try:
+                with open(os.path.join(dir_name, 'unzip_manifest.json')) as f:
+                    manifests[dir_name] = json.load(f)
+            except:
+                manifests[dir_name] = {}
+
+    def archiveState(z):
+        status = os.stat(z)
+        return {'size': status.st_size, 'mtime': status.st_mtime}
+
+    def isCurrent(z):
+        dir_name = os.path.dirname(os.path.abspath(z))
+        entry = manifests[dir_name].get(os.path.basename(z))
+        state = archiveState(z)
+        return entry is not None and \
+            entry['size'] == state['size'] and \
+            entry['mtime'] == state['mtime'] and \
+            all(os.path.exists(os.path.join(dir_name, m)) 
+                for m in entry['members'])
+
+    def extract(z):
+        my_message = """
+            INFO - STEP 0 (MASTER): UNZIPPING {0}
+            """.format(os.path.basename(z))
+        print(' '.join(my_message.split()))
+        dir_name = os.path.dirname(os.path.abspath(z))
+        with zipfile.ZipFile(z) as zip_ref:
+            zip_ref.extractall(dir_name)
+            members = [m for m in zip_ref.namelist() if not m.endswith('/')]
+        return dir_name, os.path.basename(z), dict(archiveState(z), 
+                                                    members=members)
+
+    extracted = [z for z in zip_files if not isCurrent(z)]
+    with ThreadPoolExecutor(max(1, threads)) as pool:
+        for dir_name, zip_name, entry in pool.map(extract, extracted):
+            manifests[dir_name][zip_name] = entry
+
+    for dir_name in manifests:
+        with open(os.path.join(dir_name, 'unzip_manifest.json'), 'w') as f:
+            json.dump(manifests[dir_name], f, indent=1, sort_keys=True)
+
+    return extracted
+
+def unzip_archives(dir_name, extension, threads=8):
     """
     Function unzips an archive (zipfile) so it can be processed by the code
     This is used by the block and place shape file processes.  It will
     more than likely be used by all of the shape files in the near future
-    since all of them are zipped.  
+    since all of them are zipped.  The archives are extracted in parallel 
+    and archives that are already extracted are skipped (see 
+    extractArchives)
 
     Arguments In:
     	dir_name:	the directory in which the zipped files are located
     	extension:	the extension associated with the archive to be unzipped
+        threads:    the number of archives extracted at the same time
 
     Arguments Out:
     	None
     """
-    os.chdir(dir_name) # change directory from working dir to dir with files
-    for item in os.listdir(dir_name): # loop through items in dir
-        my_message = """
-            INFO - STEP 0 (MASTER): UNZIPPING {0}
-            """.format(item)
-        print(' '.join(my_message.split()) )
-        if item.endswith(extension):                # check for ".zip" extension
-            file_name = os.path.abspath(item)       # get full path of files
-            zip_ref = zipfile.ZipFile(file_name)    # create zipfile object
-            zip_ref.extractall(dir_name)            # extract file to dir
-            zip_ref.close()                         # close file
+    extractArchives(glob.glob(os.path.join(dir_name, '*' + extension)), 
+                    threads)
 
     return
 
@@ -0,0 +1,123 @@
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import os
+
+
+def fileHash(file_name, chunk_bytes=1 << 22):
+    """
+    Arguments In:
+        file_name:      the path to the file
+        chunk_bytes:    the number of bytes read (and hashed) at a time
+
+    Arguments Out:
+        file_hash:      the sha256 of the file as a hex string
+    """
+    my_hash = hashlib.sha256()
+    with open(file_name, 'rb') as my_file:
+        for chunk in iter(lambda: my_file.read(chunk_bytes), b''):
+            my_hash.update(chunk)
+    return my_hash.hexdigest()
+
+def fileState(file_name):
+    """
+    Arguments In:
+        file_name:      the path to the file
+
+    Arguments Out:
+        state:          a dictionary with the size and modification time of
+                        the file
+    """
+    status = os.stat(file_name)
+    return {'size': status.st_size, 'mtime': status.st_mtime}
+
+def readManifest(manifest_file):
+    """
+    Arguments In:
+        manifest_file:  the path to the manifest
+
+    Arguments Out:
+        manifest:       a dictionary of {path: {'size', 'mtime', 'sha256'}}.
+                        An empty dictionary if there is no manifest yet
+    """
+    try:
+        with open(manifest_file, 'r') as my_file:
+            return json.load(my_file)
+    except:
+        return {}
+
+def writeManifest(manifest_file, manifest):
+    """
+    writes the manifest next to its final name and then moves it into place,
+    so a reader never sees a partly written manifest
+
+    Arguments In:
+        manifest_file:  the path to the manifest
+        manifest:       a dictionary of {path: {'size', 'mtime', 'sha256'}}
+
+    Arguments Out:
+        None
+    """
+    temp_name = '%s.%s.tmp' % (manifest_file, os.getpid())
+    with open(temp_name, 'w') as my_file:
+        json.dump(manifest, my_file, indent=1, sort_keys=True)
+    os.replace(temp_name, manifest_file)
+
+def buildManifest(file_names, previous=None, threads=8):
+    """
+    records the size, modification time and hash of the input files.  A
+    file with the same size and modification time as in the previous
+    manifest keeps its hash; the others are hashed, several at a time
+
+    Arguments In:
+        file_names:     a list of the paths to the input files.  Files that
+                        do not exist are left out
+        previous:       the manifest of the previous run (see readManifest)
+        threads:        the number of files hashed at the same time
+
+    Arguments Out:
+        manifest:       a dictionary of {path: {'size', 'mtime', 'sha256'}}
+        hashed:         a list of the files that were hashed
+    """
+    previous = {} if previous is None else previous
+    manifest = {}
+    hashed = []
+    for f in sorted(set(file_names)):
+        if not os.path.isfile(f):
+            continue
+        state = fileState(f)
+        entry = previous.get(f)
+        if entry is not None and entry['size'] == state['size'] and \
+                entry['mtime'] == state['mtime']:
+            manifest[f] = entry
+        else:
+            manifest[f] = state
+            hashed.append(f)
+
+    with ThreadPoolExecutor(max(1, threads)) as pool:
+        for f, file_hash in zip(hashed, pool.map(fileHash, hashed)):
+            manifest[f]['sha256'] = file_hash
+
+    return manifest, hashed
+
+def changedFiles(manifest, file_names):
+    """
+    checks the input files against a manifest without reading them, e.g., to
+    confirm the inputs of a step are the ones step 0 validated
+
+    Arguments In:
+        manifest:       a dictionary of {path: {'size', 'mtime', 'sha256'}}
+        file_names:     a list of the paths to the input files
+
+    Arguments Out:
+        changed:        a list of the files that are missing, not in the
+                        manifest, or have a different size or modification
+                        time
+    """
+    changed = []
+    for f in file_names:
+        entry = manifest.get(f)
+        if entry is None or not os.path.isfile(f) or \
+                fileState(f) != {'size': entry['size'], 'mtime': entry['mtime']}:
+            changed.append(f)
+    return changed
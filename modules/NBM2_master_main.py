@@ -8,17 +8,22 @@ import step6_main_create_speed_mbtiles  as s6
 from NBM2_process_config import config
 from NBM2_db_config import db_config
 import NBM2_functions as nbmf
+import NBM2_scheduler as nbms
+import NBM2_executor as nbex
+import NBM2_broadcast as nbbs
 import socket
 import json
 import time
 import os
 import gc 
 
-# connect to the queue
+# connect to the queue (or, in the local mode, start the queues and the local
+# servant in this process)
 while True:
     try:
-        continue_run, input_queue, output_queue, message_queue = nbmf.startMultiProcessingQueue(db_config)
-        print("INFO - MAIN (MASTER): CONNECTED TO DISTRIBUTED QUEUE")
+        continue_run, input_queue, output_queue, message_queue = nbex.startExecutor(config, db_config)
+        print("INFO - MAIN (MASTER): CONNECTED TO %s QUEUE" % 
+                config['executor']['mode'].upper())
         break
     except:
         print('INFO - MAIN (MASTER): NO QUEUE DETECTED - ENSURE IT IS RUNNING')
@@ -34,6 +39,15 @@ try:
             except:
                 pass
     print('INFO - MAIN (MASTER): CONFIRMED QUEUES ARE EMPTY')
+
+    # unless the run is being resumed, forget the tasks and steps completed by
+    # a previous run
+    resume_run = config['task_ledger']['resume_run']
+    if resume_run:
+        print('INFO - MAIN (MASTER): RESUMING THE PREVIOUS RUN FROM THE TASK LEDGER')
+    else:
+        input_queue.reset()
+        nbbs.clearStore(config)
 except:
     continue_run = False 
     my_message = """
@@ -42,24 +56,12 @@ except:
         """
     print(' '.join(my_message.split()))    
 
-# iterate through the 7 steps
+# run the 7 steps.  Each step starts as soon as the steps it depends on have
+# finished, so independent steps run at the same time
 os.system("sudo sh -c 'echo 1 >/proc/sys/vm/drop_caches'")
 if continue_run:
-    for i in range(7):
-        try:
-            if config['steps']['step%s' % i]:
-                print("INFO - MAIN (MASTER): PREPARING TO RUN STEP %s" % i)
-                current_main = eval("s%s.myMain" % i)
-                continue_run = current_main(config, db_config, input_queue, output_queue, message_queue)
-                gc.collect()
-                if not continue_run:
-                    print("ERROR - STEP %s (MASTER): THERE WAS AN ERROR IN RUNNING THE STEP MODULE - CHECK THE LOGS" % i)
-                    break
-                else:
-                    print("INFO - MAIN (MASTER): COMPLETED STEP %s OF 6 STEPS" % i)
-                    os.system("sudo sh -c 'echo 1 >/proc/sys/vm/drop_caches'")
-            else:
-                print("WARNING - MAIN (MASTER): SKIPPING STEP %s" % i) 
-        except: 
-            pass
-            
\ No newline at end of file
+    step_mains = [('step%s' % i, eval("s%s.myMain" % i)) for i in range(7)]
+    continue_run = nbms.runStepGraph(config, db_config, input_queue, 
+                    output_queue, message_queue, step_mains, resume_run)
+    if continue_run:
+        print("INFO - MAIN (MASTER): COMPLETED ALL STEPS")
@@ -0,0 +1,150 @@
+import signal
+import json
+import os
+
+
+def availableMemoryMB():
+    """
+    reads the memory the node can hand to new processes without swapping
+
+    Arguments In:
+        None
+
+    Arguments Out:
+        available_mb:   the available memory on the node in MB
+    """
+    with open('/proc/meminfo', 'r') as my_file:
+        for line in my_file:
+            if line.startswith('MemAvailable:'):
+                return int(line.split()[1]) / 1024.
+    return 0.
+
+def childProcessMap():
+    """
+    builds a map of every running process to its children
+
+    Arguments In:
+        None
+
+    Arguments Out:
+        children:       a dictionary keyed by process id that contains the
+                        list of child process ids
+    """
+    children = {}
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        try:
+            with open('/proc/%s/stat' % pid, 'r') as my_file:
+                # the process name is in parentheses and may contain spaces
+                ppid = int(my_file.read().rsplit(')', 1)[1].split()[1])
+            children.setdefault(ppid, []).append(int(pid))
+        except:
+            pass
+    return children
+
+def processTree(pid, children=None):
+    """
+    lists a process and all of its descendants (e.g., the tippecanoe and
+    ogr2ogr commands a worker runs)
+
+    Arguments In:
+        pid:            the process id of the worker
+        children:       the map returned by childProcessMap.  Built if not
+                        given
+
+    Arguments Out:
+        pids:           a list of the process ids in the tree
+    """
+    if children is None:
+        children = childProcessMap()
+    pids = [pid]
+    i = 0
+    while i < len(pids):
+        pids.extend(children.get(pids[i], []))
+        i += 1
+    return pids
+
+def processTreeRSS(pid, children=None):
+    """
+    measures the resident memory of a worker and all of its descendants
+
+    Arguments In:
+        pid:            the process id of the worker
+        children:       the map returned by childProcessMap.  Built if not
+                        given
+
+    Arguments Out:
+        rss_mb:         the resident memory of the process tree in MB
+    """
+    rss_kb = 0
+    for p in processTree(pid, children):
+        try:
+            with open('/proc/%s/status' % p, 'r') as my_file:
+                for line in my_file:
+                    if line.startswith('VmRSS:'):
+                        rss_kb += int(line.split()[1])
+                        break
+        except:
+            pass
+    return rss_kb / 1024.
+
+def killProcessTree(pid):
+    """
+    stops a worker and every command it started
+
+    Arguments In:
+        pid:            the process id of the worker
+
+    Arguments Out:
+        None
+    """
+    for p in reversed(processTree(pid)):
+        try:
+            os.kill(p, signal.SIGKILL)
+        except:
+            pass
+
+def loadPoolProfile(config, ip_address):
+    """
+    reads the peak memory measured for each servant task in earlier runs on
+    this server
+
+    Arguments In:
+        config:         the json variable that contains all configration
+                        data required for the data processing
+        ip_address:     a string variable that contains the IP address of
+                        the servant
+
+    Arguments Out:
+        profile:        a dictionary keyed by task name that contains the
+                        peak memory of one worker in MB
+    """
+    try:
+        with open(config['pool_sizing']['profile_file'] % ip_address, 'r') as my_file:
+            return json.load(my_file)
+    except:
+        return {}
+
+def savePoolProfile(config, ip_address, task_name, peak_mb):
+    """
+    records the peak memory measured for a servant task so the next run
+    starts with the right pool size
+
+    Arguments In:
+        config:         the json variable that contains all configration
+                        data required for the data processing
+        ip_address:     a string variable that contains the IP address of
+                        the servant
+        task_name:      the name of the servant task (e.g., 'parse_fbd')
+        peak_mb:        the peak memory of one worker in MB
+
+    Arguments Out:
+        None
+    """
+    file_name = config['pool_sizing']['profile_file'] % ip_address
+    profile = loadPoolProfile(config, ip_address)
+    profile[task_name] = int(peak_mb)
+    with open(file_name + '.tmp', 'w') as my_file:
+        json.dump(profile, my_file, indent=4, sort_keys=True)
+    os.replace(file_name + '.tmp', file_name)
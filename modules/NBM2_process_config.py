@@ -23,6 +23,108 @@ config = {}
 config['number_servers'] = 3
 #--------------------------------------------------------------------------------
 
+# 'distributed' runs the servant tasks on the servant servers through the queue manager.  'local' runs
+# the same servant routines in a pool of local_workers threads inside the master's process (no queue
+# manager or servants are needed) so a single workstation can run a slice of the data end to end.
+# local_workers = None uses one thread per CPU
+config['executor'] = {  'mode':             'distributed',  # 'distributed' or 'local'
+                        'local_workers':    None}
+#--------------------------------------------------------------------------------
+
+# the task ledger tracks every task placed in the distributed queue so a servant that dies only costs
+# its own task, and a killed run can be resumed.  Set resume_run to True to restart a run where it
+# stopped instead of from the beginning (completed steps are skipped and completed tasks are not rerun)
+#
+# a task that runs straggler_factor times longer than it did in the previous run (or than the median
+# task of the stage) is flagged as a straggler.  In the speculative stages, whose workers write their
+# outputs atomically and do not change the database, an idle worker on another servant runs a copy of
+# the straggler and the first copy to finish is kept.  Only those stages use the short lease: a task
+# of any other stage (e.g., the database inserts of step 0) is only run again after a long silence, 
+# since a second copy of it would not be harmless
+config['task_ledger'] = {   'ledger_file':      nbm2_root + "/temp/task_ledger.sqlite",  # should almost never change
+                            'heartbeat_seconds':30,         # how often a worker renews the lease on its task
+                            'lease_seconds':    14400,      # a task without a heartbeat for this long is run again
+                            'max_retries':      2,          # times a task is retried after its worker dies
+                            'resume_run':       False,      # should normally be False
+                            'speculation':  {   'lease_seconds':    600,    # the lease of the speculative stages
+                                                'straggler_factor': 3,      
+                                                'min_seconds':      300,    # never a straggler before this
+                                                'min_samples':      5,      # completed tasks needed for a median
+                                                'stages':           ['parse_blockdf', 'parse_fbd',
+                                                                    'create_block_numprov', 'create_tract_numprov',
+                                                                    'tract_sort', 'provider_files',
+                                                                    'initial_geojson', 'zoom_mbtiles',
+                                                                    'large_zoom_mbtiles', 'speed_mbtile',
+                                                                    'prep_providers', 'make_providers']}}
+
+# the master waits on the output queue instead of polling it.  result_seconds is how long a single wait
+# lasts before it is repeated; drain_seconds is how long a finished stage waits for workers that are 
+# still running before their results are ignored
+config['queue_timeouts'] = {'result_seconds':   60,
+                            'drain_seconds':    600}
+
+# the task ledger writes one JSON line per task (run time, CPU time, peak memory, bytes read and
+# written, rows), per distributed stage and per step to run_<run id>.jsonl.  At the end of the run the
+# master ranks the slowest steps, stages and tasks in run_<run id>_report.txt and writes the timeline
+# of the run to run_<run id>_trace.json (open it in chrome://tracing or ui.perfetto.dev)
+config['telemetry'] = { 'telemetry_dir':    nbm2_root + "/temp/telemetry/",     # should almost never change
+                        'report_tasks':     25}         # number of slowest tasks listed in the report
+#--------------------------------------------------------------------------------
+
+# large objects (e.g., the block master data frame) are published once to the broadcast store and the
+# queue elements only carry a small handle.  Each servant copies an object into its node cache (shared
+# memory) the first time a worker asks for it and all of its workers map it from there
+config['broadcast_store'] = {   'store_dir':        nbm2_root + "/temp/broadcast/",     # should almost never change
+                                'node_cache_dir':   "/dev/shm/nbm2_broadcast/"}         # local to each servant
+#--------------------------------------------------------------------------------
+
+# each servant sizes its worker pools from the memory and CPUs of its own server.  A pool starts with
+# one worker and adds workers while the server has room for another one at the task's peak memory
+# (peak_mb until the task has been measured on that server, then the measured peak).  Tasks that run
+# multi-threaded commands (tippecanoe -P) are pinned to cpus_per_worker CPUs per worker
+config['pool_sizing'] = {   'profile_file':         nbm2_root + "/temp/pool_profile_%s.json",   # one file per servant IP
+                            'memory_reserve_mb':    4096,       # memory left free for the OS and the servant
+                            'check_seconds':        5,          # how often the pool is resized
+                            'tasks': {
+                                # task name                         first estimate     CPUs per worker         pin
+                                'load_complex_shape':           {'peak_mb': 6000,   'cpus_per_worker': 1,   'pin_cpus': False},
+                                'load_other_files':             {'peak_mb': 6000,   'cpus_per_worker': 1,   'pin_cpus': False},
+                                'parse_blockdf':                {'peak_mb': 4000,   'cpus_per_worker': 1,   'pin_cpus': False},
+                                'initial_spatial_intersection': {'peak_mb': 2000,   'cpus_per_worker': 1,   'pin_cpus': False},
+                                'assign_water_blocks':          {'peak_mb': 2000,   'cpus_per_worker': 1,   'pin_cpus': False},
+                                'parse_fbd':                    {'peak_mb': 8000,   'cpus_per_worker': 1,   'pin_cpus': False},
+                                'create_block_numprov':         {'peak_mb': 20000,  'cpus_per_worker': 1,   'pin_cpus': False},
+                                'create_tract_numprov':         {'peak_mb': 20000,  'cpus_per_worker': 1,   'pin_cpus': False},
+                                'tract_sort':                   {'peak_mb': 2000,   'cpus_per_worker': 1,   'pin_cpus': False},
+                                'provider_files':               {'peak_mb': 2000,   'cpus_per_worker': 1,   'pin_cpus': False},
+                                'initial_geojson':              {'peak_mb': 4000,   'cpus_per_worker': 1,   'pin_cpus': False},
+                                'zoom_mbtiles':                 {'peak_mb': 8000,   'cpus_per_worker': 4,   'pin_cpus': True},
+                                'large_zoom_mbtiles':           {'peak_mb': 16000,  'cpus_per_worker': 8,   'pin_cpus': True},
+                                'speed_mbtile':                 {'peak_mb': 4000,   'cpus_per_worker': 1,   'pin_cpus': False},
+                                'prep_providers':               {'peak_mb': 8000,   'cpus_per_worker': 8,   'pin_cpus': True},
+                                'make_providers':               {'peak_mb': 8000,   'cpus_per_worker': 8,   'pin_cpus': True}}}
+#--------------------------------------------------------------------------------
+
+# the block and place shape files are streamed into their tables with a binary COPY.  chunk_rows is
+# the number of rows read from the file, encoded and held in memory at a time
+config['bulk_load'] = { 'chunk_rows':       50000}
+#--------------------------------------------------------------------------------
+
+# the block and place shape files are read straight out of their zip archives (GDAL /vsizip/ paths) 
+# when read_from_zip is True.  Otherwise, and for the other shape files, the archives are extracted 
+# extract_threads at a time; unzip_manifest.json in each directory records what was extracted so a 
+# rerun skips the archives that have not changed
+config['shape_archives'] = {'read_from_zip':    True,
+                            'extract_threads':  8}
+#--------------------------------------------------------------------------------
+
+# step 0 task 13 splits the fbd csv into byte ranges of about range_mb that the servants read once 
+# between them; each range is split by county and written to part files that the master joins into
+# the county files with join_threads threads
+config['fbd_partition'] = { 'range_mb':         512,
+                            'join_threads':     16}
+#--------------------------------------------------------------------------------
+
 # Turn Processes on or off.  Setting a value to False will allow the process to be skipped
 # in the NBM_MASTER_SCRIPT routine once it is written. 
 #                   Step Number      Run    Comments
@@ -61,11 +163,61 @@ config['previous_lookup_table']             = '2018_Geography_Lookup_Table.csv'
 config['previous_provider_lookup_table']    = 'provider_lookup_table_dec2017.csv'       #   downloaded from the fbd data page
 #--------------------------------------------------------------------------------
 
+# step 0 task 2 records the size, modification time and sha256 of every input file (shape files, their
+# archives and the input csvs) in the manifest.  A file whose size and modification time match the 
+# previous manifest keeps its hash, so only new or changed files are hashed (hash_threads at a time)
+config['input_manifest'] = {'manifest_file':    config['input_csvs_path'] + 'input_manifest.json',
+                            'hash_threads':     8}
+#--------------------------------------------------------------------------------
+
 # data vintage parameters
 config['census_vintage']    = "2010"        # should change once a decade after the census count
 config['geometry_vintage']  = "2018"        # should change once a year
 config['household_vintage'] = "2018"        # should change once a year <-- this is for the us20XX table with hh_hu_pop data
 config['fbd_vintage']       = "jun2018"     # should change every 6 months
+#--------------------------------------------------------------------------------
+
+# the files, database tables and shared resources each step reads and writes.  The master starts a
+# step as soon as every earlier step that writes something it reads (or reads or writes something
+# it writes) has finished, so independent steps (e.g., step 4 and steps 1 to 3, or step 5 and steps
+# 1 to 3) run at the same time instead of one after another.  A resource matches every resource whose
+# name starts with it.  The distributed tasks of steps running at the same time share the servants.
+# Steps 1 and 2 both hold the whole FBD file in the master's memory, so they share the
+# master_memory:fbd_df resource and never run together.
+#
+# task_reads lists the reads of a step that its tasks declare one file at a time (e.g., each step 3
+# task reads the block numprov file of its speed, which the step 2 task of that speed writes).  The
+# step does not wait for the step that writes them; each task waits in the task ledger until its file
+# has been written.  Update these lists when a step starts reading or writing a new file
+config['step_graph'] = {
+    'step0':    {'reads':   [config['input_csvs_path'], config['shape_files_path']],
+                 'writes':  [config['input_csvs_path'] + config['blockmaster_data_file'],
+                             config['input_manifest']['manifest_file'], config['output_dir_path'],
+                             config['temp_csvs_dir_path'] + 'county_fips.csv', config['temp_csvs_dir_path'] + 'county_fbd/',
+                             config['temp_geog_geojson_path'] + 'county_block/', 'database:nbm2_']},
+    'step1':    {'reads':   [config['input_csvs_path'] + config['fbData'],
+                             config['input_csvs_path'] + config['blockmaster_data_file']],
+                 'writes':  [config['output_dir_path'] + 'provider_table_', 'master_memory:fbd_df']},
+    'step2':    {'reads':   [config['input_csvs_path'] + config['fbData'],
+                             config['input_csvs_path'] + config['blockmaster_data_file']],
+                 'writes':  [config['temp_csvs_dir_path'] + 'block_numprov/', config['output_dir_path'] + 'area_table_',
+                             config['temp_pickles'] + 'enhanced_fbd_df.pkl', 'master_memory:fbd_df']},
+    'step3':    {'reads':   [config['input_csvs_path'] + config['blockmaster_data_file'],
+                             config['temp_csvs_dir_path'] + 'block_numprov/'],
+                 'writes':  [config['temp_csvs_dir_path'] + 'tract_numprov/',
+                             config['temp_csvs_dir_path'] + 'county_numprov/'],
+                 'task_reads':  [config['temp_csvs_dir_path'] + 'block_numprov/']},
+    'step4':    {'reads':   ['database:nbm2_', config['shape_files_path']],
+                 'writes':  [config['temp_geog_geojson_path'] + 'nbm2_', config['output_mbtiles_path']]},
+    'step5':    {'reads':   [config['input_csvs_path'], config['shape_files_path'], 'database:nbm2_',
+                             config['temp_geog_geojson_path'], config['temp_csvs_dir_path'] + 'county_fbd/'],
+                 'writes':  [config['temp_speed_geojson_path'], config['temp_pickles'] + 'block_df.pkl',
+                             config['temp_pickles'] + 'tract_df.pkl',
+                             config['temp_csvs_dir_path'] + 'h2only_undev_', config['temp_csvs_dir_path'] + 'tract_area_',
+                             config['output_dir_path'] + 'provider_lookup_table_']},
+    'step6':    {'reads':   [config['temp_csvs_dir_path'], config['temp_speed_geojson_path']],
+                 'writes':  [config['temp_mbtiles_path'], config['output_mbtiles_path']]},
+    }
 
 #########################################################################################################################
 #########################################################################################################################
@@ -122,6 +274,33 @@ config['block_shape_dir_name'] = "block"                                    # ft
 config['place_shape_dir_name'] = "place"                                    # ftp2.census.gov --> geo/tiger<geometry_vintage>/PLACE
 #--------------------------------------------------------------------------------
 
+# the columns of the block and place tables: [column, postgres type, source].  The source is the shape
+# file attribute the column is loaded from (the column itself when it is left out) or, for a FIPS code
+# built from several attributes, a list of [attribute, number of digits].  Step 0 task 4 creates the
+# tables from these before any file is loaded, so every file loads at the same time and the block
+# table gets its final columns and types without being rewritten.  The block table is partitioned by
+# STATE_FIPS (one partition per state).  A file that is missing one of the source attributes fails to
+# load.  A GENERATED column is computed by the database while the file is copied in: GEODESIC_AREA is the
+# area (square meters) of the block on the spheroid, which every overlay statement reuses instead of 
+# recomputing ST_AREA on geography.  It is only computed again when the block table is reloaded
+# Every shape table also gets a GEOMETRY_VALID flag: invalid geometries are repaired once as they are
+# loaded and the overlays only fall back to ST_BUFFER(..., 0) when one of the two geometries is flagged
+config['block_table_columns'] = [   ['BLOCK_FIPS',      'varchar(15)',      'GEOID%s' % config['census_vintage'][2:]],
+                                    ['ALAND%s'  % config['census_vintage'][2:],     'double precision'],
+                                    ['AWATER%s' % config['census_vintage'][2:],     'double precision'],
+                                    ['CENTROID_LAT',    'numeric(10,7)',    'INTPTLAT%s' % config['census_vintage'][2:]],
+                                    ['CENTROID_LON',    'numeric(10,7)',    'INTPTLON%s' % config['census_vintage'][2:]],
+                                    ['STATE_FIPS',      'varchar(2)',       [['STATEFP%s'  % config['census_vintage'][2:], 2]]],
+                                    ['COUNTY_FIPS',     'varchar(5)',       [['STATEFP%s'  % config['census_vintage'][2:], 2],
+                                                                            ['COUNTYFP%s' % config['census_vintage'][2:], 3]]],
+                                    ['GEODESIC_AREA',   'double precision GENERATED ALWAYS AS (ST_AREA("GEOMETRY"::geography)) STORED']]
+config['place_table_columns'] = [[c, 'text'] for c in 
+                                    ['STATEFP', 'PLACEFP', 'PLACENS', 'GEOID', 'NAME', 'NAMELSAD', 
+                                    'LSAD', 'CLASSFP', 'PCICBSA', 'PCINECTA', 'MTFCC', 'FUNCSTAT']] + \
+                                [[c, 'bigint'] for c in ['ALAND', 'AWATER']] + \
+                                [[c, 'text'] for c in ['INTPTLAT', 'INTPTLON']]
+#--------------------------------------------------------------------------------
+
 # index fields for block and place shape files.  These should rarely change
 config['block_indexes']     = ['"BLOCK_FIPS"', '"COUNTY_FIPS"', '"GEOMETRY"']
 config['place_indexes']     = ['"GEOMETRY"']
@@ -131,6 +310,20 @@ config['place_indexes']     = ['"GEOMETRY"']
 # These should only change if a new spatial analysis is required 
 config['spatial_list']              = ['tribe', 'place', 'congress']
 
+# step 0 task 7 splits the tribe, place and congress polygons into pieces of at most max_vertices 
+# vertices (ST_Subdivide).  A block inside one of the pieces is inside the polygon, so the exact 
+# intersection is only computed for the blocks on a polygon's boundary.  columns are the attributes 
+# each piece keeps
+config['spatial_subdivide'] = { 'max_vertices':     256,
+                                'columns':      {   'tribe':    ['"GEOID"', '"CLASSFP"'],
+                                                    'place':    ['"GEOID"'],
+                                                    'congress': ['"GEOID"']}}
+
+# step 0 task 8 assigns each water only block to the nearest congressional district.  The knn_candidates
+# nearest pieces of the subdivided districts are found with the gist index (<->) and only those are 
+# ranked by their geodesic distance
+config['water_block_assignment'] = {'knn_candidates': 8}
+
 #--------------------------------------------------------------------------------
 
 # counties periodically change geometry (and or appear and disappear)
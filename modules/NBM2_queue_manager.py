@@ -1,4 +1,5 @@
 from multiprocessing.managers import BaseManager
+from NBM2_task_ledger import TaskLedger
 from queue import Queue
 import socket
 import json
@@ -17,9 +18,10 @@ ip_file = config['temp_csvs_dir_path'] + 'queue_ip.txt'
 with open(ip_file, 'w') as my_file:
     my_file.write(queue_IP_address)
 
-input_queue = Queue()
 output_queue = Queue()
 message_queue = Queue()
+input_queue = TaskLedger(config['task_ledger'], output_queue,
+                        config['telemetry']['telemetry_dir'])
 
 manager = BaseManager(  address=('', db_config['distributed_port']), 
                         authkey= bytes(db_config['queue_auth_key'], 'utf-8'))
@@ -0,0 +1,262 @@
+import NBM2_task_ledger as nbtl
+import NBM2_functions as nbmf
+import NBM2_telemetry as nbmt
+import threading
+import traceback
+import queue
+import time
+import os
+import gc
+
+
+def stepsConflict(earlier_step, later_step):
+    """
+    determines whether a step must wait for an earlier step.  The later step
+    waits if it reads something the earlier step writes, or writes something
+    the earlier step reads or writes.  Reads the later step's tasks declare
+    themselves ('task_reads') do not make it wait - each of those tasks 
+    waits in the task ledger until the file it reads has been written
+
+    Arguments In:
+        earlier_step:   a dictionary with the 'reads' and 'writes' lists of
+                        the step that comes first in the run order
+        later_step:     a dictionary with the 'reads' and 'writes' lists, and
+                        optionally the 'task_reads' list, of the step that 
+                        comes later in the run order
+
+    Arguments Out:
+        conflict:       a boolean variable that indicates if the later step
+                        depends on the earlier step
+    """
+    task_reads = later_step.get('task_reads', [])
+    for w in earlier_step['writes']:
+        for r in later_step['reads']:
+            if nbtl.resourcesOverlap(w, r) and not \
+                any(r.startswith(t) for t in task_reads):
+                return True
+        for later_w in later_step['writes']:
+            if nbtl.resourcesOverlap(w, later_w):
+                return True
+    for r in earlier_step['reads']:
+        for w in later_step['writes']:
+            if nbtl.resourcesOverlap(r, w):
+                return True
+    return False
+
+def buildStepGraph(config, step_names):
+    """
+    creates the dependency graph for the steps from the files each step
+    declares it reads and writes in config['step_graph']
+
+    Arguments In:
+        config:         the json variable that contains all configration
+                        data required for the data processing
+        step_names:     a list of the step names in run order (e.g.,
+                        ['step0', 'step1', ...])
+
+    Arguments Out:
+        depends_on:     a dictionary keyed by step name that contains the set
+                        of earlier steps that must finish before the step can
+                        start
+    """
+    depends_on = {}
+    for i, step in enumerate(step_names):
+        depends_on[step] = set()
+        for earlier in step_names[:i]:
+            if stepsConflict(config['step_graph'][earlier],
+                            config['step_graph'][step]):
+                depends_on[step].add(earlier)
+    return depends_on
+
+def runStep(step, step_main, config, db_config, input_queue, output_queue,
+            message_queue, done_queue):
+    """
+    runs a single step module in its own thread and reports the result to
+    the scheduler.  The step gets its own view of the task ledger and of the
+    results, so its stages and messages are kept apart from the steps that
+    run at the same time
+
+    Arguments In:
+        step:           a string variable that contains the step name
+        step_main:      the myMain routine of the step module
+        config:         the json variable that contains all configration
+                        data required for the data processing
+        db_config:      a dictionary that contains the configuration
+                        information for the database and queue
+        input_queue:    a multiprocessing queue that can be shared across
+                        multiple servers and cores.  All information to be
+                        processed is loaded into the queue
+        output_queue:   a multiprocessing queue that can be shared across
+                        multiple servers and cores.  All results from the
+                        various processes are loaded into the queue
+        message_queue:  a multiprocessing queue variable that is used to
+                        communicate between the master and servants
+        done_queue:     a queue that carries (step, continue_run) back to
+                        the scheduler
+
+    Arguments Out:
+        None
+    """
+    step_queue = nbtl.StageQueue(input_queue, step)
+    try:
+        continue_run = step_main(config, db_config, step_queue, 
+                                nbtl.StageResults(step_queue), message_queue)
+    except:
+        print(traceback.format_exc())
+        continue_run = False
+    # a step that failed before closing its stage must not leave it open
+    try:
+        step_queue.abandonStage()
+    except:
+        print(traceback.format_exc())
+    gc.collect()
+    done_queue.put((step, continue_run))
+
+def runStepGraph(config, db_config, input_queue, output_queue, message_queue,
+                step_mains, resume_run):
+    """
+    runs the steps in dependency order.  Every step whose prerequisites have
+    finished is started right away, so independent steps run at the same
+    time and their distributed tasks share the servants.  The files each
+    unfinished step writes are promised in the task ledger, so a task that
+    declares it reads one of them waits for it rather than its whole step
+    waiting for the step that writes it.  Once a step fails no new steps 
+    are started, the promises of the steps that will not finish are broken
+    and the routine waits for the running steps to finish.  The run time of
+    every step is written to the run telemetry and the run report is 
+    written at the end
+
+    Arguments In:
+        config:         the json variable that contains all configration
+                        data required for the data processing
+        db_config:      a dictionary that contains the configuration
+                        information for the database and queue
+        input_queue:    the task ledger served by the queue manager
+        output_queue:   a multiprocessing queue that can be shared across
+                        multiple servers and cores.  All results from the
+                        various processes are loaded into the queue
+        message_queue:  a multiprocessing queue variable that is used to
+                        communicate between the master and servants
+        step_mains:     a list of (step name, myMain routine) tuples in run
+                        order
+        resume_run:     a boolean variable that indicates if steps completed
+                        by a previous run should be skipped
+
+    Arguments Out:
+        continue_run:   a boolean variable that indicates if all of the steps
+                        successfully completed
+    """
+    step_names = [s[0] for s in step_mains]
+    step_mains = dict(step_mains)
+    depends_on = buildStepGraph(config, step_names)
+    start_time = time.localtime()
+
+    # steps that are turned off, or that completed in the previous run, are
+    # treated as finished
+    finished = set()
+    for step in step_names:
+        if not config['steps'][step]:
+            print("WARNING - MAIN (MASTER): SKIPPING %s" % step.upper())
+            finished.add(step)
+        elif resume_run and input_queue.isCheckpointed(step):
+            print("INFO - MAIN (MASTER): %s COMPLETED IN THE PREVIOUS RUN - SKIPPING" % step.upper())
+            finished.add(step)
+    for step in step_names:
+        if step not in finished:
+            input_queue.promiseResources(step, 
+                                        config['step_graph'][step]['writes'])
+
+    continue_run = True
+    running = {}
+    step_start = {}
+    done_queue = queue.Queue()
+    while True:
+        # start every step whose prerequisites have finished
+        if continue_run:
+            for step in step_names:
+                if step in finished or step in running:
+                    continue
+                if depends_on[step] <= finished:
+                    my_message = """
+                        INFO - MAIN (MASTER): STARTING %s - RUNNING WITH %s
+                        """ % (step.upper(), ', '.join(sorted(running)).upper() or 'NO OTHER STEPS')
+                    print(nbmf.logMessage(' '.join(my_message.split()),
+                        start_time, time.localtime(),
+                        time.mktime(time.localtime())-time.mktime(start_time)))
+                    running[step] = threading.Thread(target=runStep,
+                                    args=(step, step_mains[step], config,
+                                    db_config, input_queue, output_queue,
+                                    message_queue, done_queue))
+                    step_start[step] = (time.time(), time.monotonic())
+                    running[step].start()
+
+        if len(running) == 0:
+            break
+
+        # wait for a running step to finish
+        step, step_result = done_queue.get()
+        running.pop(step).join()
+        input_queue.recordEvent({   'type':         'step',
+                                    'step':         step,
+                                    'start':        round(step_start[step][0], 3),
+                                    'wall_seconds': round(time.monotonic() - 
+                                                    step_start[step][1], 3),
+                                    'result':       'completed' if step_result
+                                                    else 'failed'})
+        if step_result:
+            finished.add(step)
+            input_queue.keepPromise(step)
+            input_queue.checkpoint(step)
+            my_message = """
+                INFO - MAIN (MASTER): COMPLETED %s
+                """ % step.upper()
+            print(nbmf.logMessage(' '.join(my_message.split()), start_time,
+                time.localtime(),
+                time.mktime(time.localtime())-time.mktime(start_time)))
+            os.system("sudo sh -c 'echo 1 >/proc/sys/vm/drop_caches'")
+        else:
+            continue_run = False
+            my_message = """
+                ERROR - %s (MASTER): THERE WAS AN ERROR IN RUNNING THE STEP
+                MODULE - CHECK THE LOGS
+                """ % step.upper()
+            print(' '.join(my_message.split()))
+            # the failed step, and the steps that will not be started, will
+            # not write what they promised
+            for other_step in step_names:
+                if other_step not in finished and other_step not in running:
+                    input_queue.breakPromise(other_step, '%s FAILED' % 
+                                            step.upper())
+
+    writeRunReport(config, input_queue)
+    return continue_run
+
+def writeRunReport(config, input_queue):
+    """
+    writes the report that ranks the slowest steps, stages and tasks of the
+    run next to the run telemetry and prints it, along with the trace of the
+    run (Chrome trace event format)
+
+    Arguments In:
+        config:         the json variable that contains all configration
+                        data required for the data processing
+        input_queue:    the task ledger served by the queue manager
+
+    Arguments Out:
+        None
+    """
+    try:
+        telemetry_file = input_queue.telemetryFile()
+        if telemetry_file is None or not os.path.exists(telemetry_file):
+            return
+        report = nbmt.writeRunReport(telemetry_file, 
+                    telemetry_file.replace('.jsonl', '_report.txt'),
+                    config['telemetry']['report_tasks'])
+        print(report)
+        nbmt.writeChromeTrace(telemetry_file,
+                    telemetry_file.replace('.jsonl', '_trace.json'))
+    except:
+        my_message = """
+            WARNING - MAIN (MASTER): UNABLE TO WRITE THE RUN REPORT
+            """
+        print(' '.join(my_message.split()) + '\n' + traceback.format_exc())
@@ -1,4 +1,8 @@
 from multiprocessing.managers import BaseManager
+import multiprocessing.connection
+import NBM2_task_ledger as nbtl
+import NBM2_pool_sizing as nbps
+import NBM2_broadcast as nbbs
 import NBM2_functions as nbmf 
 import multiprocessing as mp
 import servant_step0 as ss0
@@ -7,113 +11,344 @@ import servant_step3 as ss3
 import servant_step5 as ss5 
 import servant_step6 as ss6
 import traceback 
+import socket
+import threading
 import json
+import os
 import time
 import gc 
 
 
-def poolProcessor(worker_name, input_queue, output_queue, config, db_config, 
-                    pool_size):
+# the CPUs held by the workers of every pool on this servant.  The pools of
+# stages that run at the same time draw their slots from the same CPUs
+busy_cpus = set()
+cpu_lock = threading.Lock()
+
+# the number of pools running on this servant.  The node cache is emptied 
+# when the last one finishes
+running_pools = [0]
+pool_lock = threading.Lock()
+
+def takeSlot(slot_size):
+    """
+    reserves the CPUs for one worker
+
+    Arguments In:
+        slot_size:      the number of CPUs the worker needs
+
+    Arguments Out:
+        slot:           a list of the reserved CPUs, or None if not enough
+                        CPUs are free
+    """
+    with cpu_lock:
+        free_cpus = [c for c in sorted(os.sched_getaffinity(0)) 
+                    if c not in busy_cpus]
+        if len(free_cpus) < slot_size:
+            return None
+        slot = free_cpus[:slot_size]
+        busy_cpus.update(slot)
+        return slot
+
+def returnSlot(slot):
+    with cpu_lock:
+        busy_cpus.difference_update(slot)
+
+def leasedWorker(worker_name, task_name, input_queue, output_queue, config, 
+                db_config, cpu_list=None, worker_id=None, heartbeats=True):
+    """
+    runs a servant worker routine against the task ledger.  Each element the
+    worker takes from the input queue is leased to this process and is 
+    acknowledged when the worker asks for its next element
+
+    Arguments In:
+        worker_name:    the servant routine to be run (e.g., 
+                        servant_step0.parseFBD)
+        task_name:      the name of the servant task (e.g., 'parse_fbd').
+                        The worker only takes tasks from this stage
+        input_queue:    the task ledger served by the queue manager
+        output_queue:   a multiprocessing queue that can be shared across
+                        multiple servers and cores.  All results from the 
+                        various processes are loaded into the queue
+        config:			the json variable that contains all configration
+    					data required for the data processing
+        db_config:      a dictionary that contains the configuration
+                        information for the database and queue
+        cpu_list:       a list of the CPUs the worker (and the commands it
+                        runs) is pinned to.  None if the worker is not pinned
+        worker_id:      the identifier the ledger tracks the worker by.
+                        Defaults to the servant's IP address and the pid
+        heartbeats:     a boolean variable that indicates if the worker 
+                        renews its lease with heartbeats.  False for the 
+                        threads of the local executor, which share the 
+                        master's process and cannot be stopped on their own.
+                        Their tasks are measured per thread
+
+    Arguments Out:
+        None
+    """
+    if cpu_list is not None:
+        # the commands the worker runs (e.g., tippecanoe -P) inherit the
+        # affinity and size their thread pools to it
+        os.sched_setaffinity(0, cpu_list)
+        os.environ['TIPPECANOE_MAX_THREADS'] = str(len(cpu_list))
+
+    heartbeat_seconds = config['task_ledger']['heartbeat_seconds'] \
+                        if heartbeats else None
+    leased_queue = nbtl.LeasedQueue(input_queue, task_name, worker_id,
+                                    heartbeat_seconds, not heartbeats)
+    recording_queue = nbtl.RecordingQueue(output_queue, leased_queue)
+    try:
+        worker_name(leased_queue, recording_queue, config, db_config)
+    finally:
+        # the worker stopped while holding a task - it has already reported
+        # the error to the master so the task is not retried
+        leased_queue.release()
+
+def poolProcessor(worker_name, task_name, input_queue, output_queue, config, 
+                    db_config):
+    """
+    runs a pool of worker processes for a servant task.  Each check starts
+    as many workers as there are tasks waiting in the queue, free CPU slots,
+    and memory on the node for a worker at the task's peak memory, so the
+    pool reaches its full width in one pass.  The pools of stages that run
+    at the same time share the CPUs of the servant (see takeSlot), but a 
+    pool always has at least one worker.  If free memory falls below the
+    reserve the newest worker is stopped and its task is put back in the 
+    queue without counting as one of its retries.  The peak memory of the 
+    task is measured while it runs and saved for the next run
+
+    Arguments In:
+        worker_name:    the servant routine to be run (e.g., 
+                        servant_step0.parseFBD)
+        task_name:      the name of the servant task (e.g., 'parse_fbd') used
+                        to look up config['pool_sizing']['tasks']
+        input_queue:    the task ledger served by the queue manager
+        output_queue:   a multiprocessing queue that can be shared across
+                        multiple servers and cores.  All results from the 
+                        various processes are loaded into the queue
+        config:			the json variable that contains all configration
+    					data required for the data processing
+        db_config:      a dictionary that contains the configuration
+                        information for the database and queue
+
+    Arguments Out:
+        None
+    """
+    my_ip_address = socket.gethostbyname(socket.gethostname())
+    slots = {}
     try:
-        processes = [mp.Process(target=worker_name, args=(input_queue,output_queue,config, db_config)) for x in range(pool_size)]
+        sizing = config['pool_sizing']
+        settings = sizing['tasks'][task_name]
+        profile = nbps.loadPoolProfile(config, my_ip_address)
+        expected_mb = profile.get(task_name, settings['peak_mb'])
+        measured_mb = 0.
+
+        # each worker holds a slot of CPUs.  Tasks that run multi-threaded 
+        # commands are pinned to their slot so the commands do not compete 
+        # for cores
+        slot_size = min(settings['cpus_per_worker'], 
+                        len(os.sched_getaffinity(0)))
 
-        # start the pool processes
-        for p in processes:
-            p.start()
+        running = []
+        draining = False
+        while True:
+            # measure the workers and decide whether to grow or shrink the pool
+            children = nbps.childProcessMap()
+            worker_mb = {p.pid: nbps.processTreeRSS(p.pid, children) for p in running}
+            if len(worker_mb) > 0:
+                measured_mb = max([measured_mb] + list(worker_mb.values()))
+            peak_mb = max(expected_mb, measured_mb)
+            headroom_mb = nbps.availableMemoryMB() - sizing['memory_reserve_mb']
+            growth_mb = sum([max(0, peak_mb - m) for m in worker_mb.values()])
 
-        # join the pool processes
-        for p in processes:
-            p.join()
+            if headroom_mb < 0 and len(running) > 1:
+                p = running.pop()
+                nbps.killProcessTree(p.pid)
+                p.join()
+                input_queue.releaseWorker(nbtl.workerID(my_ip_address, p.pid),
+                                        count_attempt=False)
+                returnSlot(slots.pop(p.pid))
+                print('memory is low - stopped a %s worker, %s remain' % 
+                    (task_name, len(running)))
 
-        # temrinate the pool processes
-        for p in processes:
-            p.terminate()
+            elif not draining:
+                # start every worker the memory and the CPU slots allow, but
+                # no more than there are tasks waiting
+                budget_mb = headroom_mb - growth_mb
+                waiting = input_queue.qsize(task_name)
+                while len(running) == 0 or (waiting > 0 and 
+                    budget_mb >= peak_mb):
+                    slot = takeSlot(slot_size)
+                    if slot is None:
+                        if len(running) > 0:
+                            break
+                        # the other pools hold every CPU - the first worker
+                        # runs unpinned so the stage still makes progress
+                        slot = []
+                    p = mp.Process(target=leasedWorker, args=(worker_name, 
+                        task_name, input_queue, output_queue, config, 
+                        db_config, slot if settings['pin_cpus'] and 
+                        len(slot) > 0 else None))
+                    p.start()
+                    running.append(p)
+                    slots[p.pid] = slot
+                    budget_mb -= peak_mb
+                    waiting -= 1
+
+            # wait for a worker to finish or for the next check.  A worker that
+            # exits cleanly has taken a sentinel so the pool stops growing.  If
+            # a worker dies (e.g., it runs out of memory) its leased task is
+            # put back in the queue so another worker can pick it up
+            multiprocessing.connection.wait([p.sentinel for p in running], 
+                                            sizing['check_seconds'])
+            for p in [p for p in running if not p.is_alive()]:
+                running.remove(p)
+                p.join()
+                returnSlot(slots.pop(p.pid))
+                if p.exitcode == 0:
+                    draining = True
+                else:
+                    input_queue.releaseWorker(nbtl.workerID(my_ip_address, p.pid))
+            if draining and len(running) == 0:
+                break
+
+        if measured_mb > 0:
+            nbps.savePoolProfile(config, my_ip_address, task_name, measured_mb)
 
     except:
         print(traceback.format_exc())
 
+    for slot in slots.values():
+        returnSlot(slot)
     gc.collect()
     return
 
-def myMain(input_queue, output_queue, message_queue, config, db_config):
+# the servant routine run for each distributed task, and what it does.  The 
+# master starts a task by putting its name in the message queue
+servant_tasks = {
+    'load_complex_shape':           (ss0.loadComplexShapes,         # step 0 task 4
+                                    'processing block and place shape files'),
+    'load_other_files':             (ss0.loadOtherFiles,            # step 0 task 5
+                                    'loading other shape files and csv files'),
+    'parse_blockdf':                (ss0.parseBlockDF,              # step 0 task 6
+                                    'parsing block data into county level geojsons'),
+    'initial_spatial_intersection': (ss0.basicSpatialIntersection,  # step 0 task 7
+                                    'performing initial spatial intersections'),
+    'assign_water_blocks':          (ss0.assignWaterBlocks,         # step 0 task 8
+                                    'assigning water blocks to congressional districts'),
+    'parse_fbd':                    (ss0.parseFBD,                  # step 0 task 13
+                                    'parsing fixed broadband data to county level data'),
+    'create_block_numprov':         (ss2.makeBlockNumProv,          # step 2 task 4
+                                    'making the block numprov files'),
+    'create_tract_numprov':         (ss3.makeLargeTracts,           # step 3 task 2
+                                    'making tract and county numprov files'),
+    'tract_sort':                   (ss5.genTractGeoJson,           # step 5 task 6
+                                    'dissolving at the tract level'),
+    'provider_files':               (ss5.genCountyHoCoNumGeoJson,   # step 5 task 12
+                                    'dissolving at the county and hoconum level'),
+    'initial_geojson':              (ss6.genInitialGeoJson,         # step 6 task 1
+                                    'making initial geojson files'),
+    'zoom_mbtiles':                 (ss6.genZoomTiles,              # step 6 task 2a
+                                    'making zoom files'),
+    'large_zoom_mbtiles':           (ss6.genLargeZoomTiles,         # step 6 task 2b
+                                    'making final zoom files'),
+    'speed_mbtile':                 (ss6.genInterimTiles,           # step 6 task 3
+                                    'making speed level map box tiles'),
+    'prep_providers':               (ss6.genPrepProviderTiles,      # step 6 task 4
+                                    'preparing provider files'),
+    'make_providers':               (ss6.genFinalTiles,             # step 6 task 5
+                                    'making provider files')}
+
+def runPool(pool_processor, task, input_queue, output_queue, config, 
+            db_config):
+    """
+    runs the pool of workers of a distributed task in its own thread, so the
+    pools of stages that are open at the same time run side by side.  The
+    node cache is emptied once no pool is running
+
+    Arguments In:
+        pool_processor: the routine that runs the workers of a task
+        task:           the name of the servant task (e.g., 'parse_fbd')
+        input_queue:    the task ledger served by the queue manager
+        output_queue:   a multiprocessing queue that can be shared across
+                        multiple servers and cores.  All results from the 
+                        various processes are loaded into the queue
+        config:         the json variable that contains all configration
+                        data required for the data processing
+        db_config:      a dictionary that contains the configuration
+                        information for the database and queue
+
+    Arguments Out:
+        None
+    """
+    worker_name, description = servant_tasks[task]
+    print('running routines for %s' % description)
+    try:
+        pool_processor(worker_name, task, input_queue, output_queue, config,
+                        db_config)
+    except:
+        print(traceback.format_exc())
+    print('completed %s\n' % description)
+
+    # the broadcast objects fetched for the tasks are no longer needed
+    with pool_lock:
+        running_pools[0] -= 1
+        if running_pools[0] == 0:
+            nbbs.clearNodeCache(config)
+    gc.collect()
+
+def myMain(input_queue, output_queue, message_queue, config, db_config,
+            pool_processor=poolProcessor):
+    """
+    runs the servant: waits for the master to start a distributed task and
+    runs a pool of workers for it until the master sends None.  A task that
+    arrives while another is running gets a pool of its own (see runPool)
+
+    Arguments In:
+        input_queue:    the task ledger served by the queue manager
+        output_queue:   a multiprocessing queue that can be shared across
+                        multiple servers and cores.  All results from the 
+                        various processes are loaded into the queue
+        message_queue:  a multiprocessing queue variable that is used to
+                        communicate between the master and servants
+        config:			the json variable that contains all configration
+    					data required for the data processing
+        db_config:      a dictionary that contains the configuration
+                        information for the database and queue
+        pool_processor: the routine that runs the workers of a task - 
+                        poolProcessor on a servant server, or the local
+                        executor's pool (see NBM2_executor)
+
+    Arguments Out:
+        None
+    """
+    pools = []
     while True:
         try:
             task = message_queue.get()
-            if task == 'load_complex_shape':            # step 0 task 4
-                print('running routine to process block and place shape files')
-                poolProcessor(ss0.loadComplexShapes, input_queue, output_queue, config, db_config, 6)
-                print('completed processing block and place shape files\n')
-            if task == 'load_other_files':              # step 0 task 5
-                print('running routine to process other shape files and csv files')
-                poolProcessor(ss0.loadOtherFiles, input_queue, output_queue, config, db_config, 3)
-                print('completed loading other shape files and csv files\n')
-            if task == 'parse_blockdf':                 # step 0 task 6
-                print('running routine to parse block data into county level geojsons')
-                poolProcessor(ss0.parseBlockDF, input_queue, output_queue, config, db_config, 3)
-                print('completed parsing block data into county level geojsons\n')
-            if task == 'initial_spatial_intersection':  # step 0 task 7
-                print('running routines for performing initial spatial intersections')
-                poolProcessor(ss0.basicSpatialIntersection, input_queue, output_queue, config, db_config, 8)
-                print('completed performing initial spatial intersections\n')
-            if task == 'assign_water_blocks':           # step 0 task 8
-                print('running routines for assigning water blocks to congressional districts')
-                poolProcessor(ss0.assignWaterBlocks, input_queue, output_queue, config, db_config, 8)
-                print('completed assigning water blocks to congressional districts\n')
-            elif task == 'parse_fbd':                   # step 0 task 13
-                print('running routines for parsing fixed broadband data to county level data')
-                poolProcessor(ss0.parseFBD, input_queue, output_queue, config, db_config, 8)
-                print('completed parsing fixed broadband data to county level\n')
-            elif task == 'create_block_numprov':        # step 2 task 4 
-                print('running processes for creating the block numprov files')
-                poolProcessor(ss2.makeBlockNumProv, input_queue, output_queue, config, db_config, 3)
-                print('completed making block numprov\n')
-            elif task == 'create_tract_numprov':         # step 3 task 2 
-                print('running processes for making tract and county numprov files')
-                poolProcessor(ss3.makeLargeTracts,input_queue, output_queue, config, db_config, 3)
-                print('completed making tract and county numprov files\n')
-            elif task == 'tract_sort':                  # step 5 task 6
-                print('running processes for dissolving at the tract level')
-                poolProcessor(ss5.genTractGeoJson, input_queue, output_queue, config, db_config, 32)
-                print('completed dissolving at the tract level\n')
-            elif task == 'provider_files':              # step 5 task 12
-                print('running processes for dissolving at the county and hoconum level')
-                poolProcessor(ss5.genCountyHoCoNumGeoJson, input_queue, output_queue, config, db_config, 32)
-                print('completed dissolving at the county and hoconum level\n')
-            elif task == 'initial_geojson':             # step 6 task 1
-                print('running processes for making initial geojson files')
-                poolProcessor(ss6.genInitialGeoJson, input_queue, output_queue, config, db_config, 8)
-                print('completed making initial geojson files\n')
-            elif task == 'zoom_mbtiles':                # step 6 task 2a
-                print('running processes for creating zoom files')
-                poolProcessor(ss6.genZoomTiles, input_queue, output_queue, config, db_config, 4)
-                print('completed making zoom files\n')
-            elif task == 'large_zoom_mbtiles':          # step 6 task 2b
-                print('running processes for making final zoom files')
-                poolProcessor(ss6.genLargeZoomTiles, input_queue, output_queue, config, db_config, 2)
-                print('completed making final zoom files\n')
-            elif task == 'speed_mbtile':                # step 6 task 3
-                print('running proceses for making speed level map box tiles')
-                poolProcessor(ss6.genInterimTiles, input_queue, output_queue, config, db_config, 3)
-                print('completed making speed level map box tiles\n')
-            elif task == 'prep_providers':              # step 6 task 4
-                print('running processes for preparing provider files')
-                poolProcessor(ss6.genPrepProviderTiles, input_queue, output_queue, config, db_config, 2)
-                print('completed prepping provider files')
-            elif task == 'make_providers':              # step 6 task 5
-                print('running processes to make provider files')
-                poolProcessor(ss6.genFinalTiles, input_queue, output_queue, config, db_config, 2)
-                print('completed making provider files')
-            elif task is None:
+            if task is None:
                 break
-            else:
-                pass
-            # sleep to let the other servants get their task
-            gc.collect()
-            time.sleep(5)
+
+            # ignore a task message left over from a stage that has already
+            # finished (e.g., this servant was down when it was sent)
+            if not input_queue.isOpen(task):
+                print('ignoring %s - the stage has already finished' % task)
+                continue
+
+            if task in servant_tasks:
+                with pool_lock:
+                    running_pools[0] += 1
+                pool = threading.Thread(target=runPool, args=(pool_processor,
+                        task, input_queue, output_queue, config, db_config))
+                pool.start()
+                pools = [p for p in pools if p.is_alive()] + [pool]
         except:
             # sleep until a new set of tasks come in to be worked
             time.sleep(10)    
 
+    for pool in pools:
+        pool.join()
+
 if __name__ == '__main__':
 
     # connect to the distributed queue
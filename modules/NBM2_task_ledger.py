@@ -0,0 +1,1287 @@
+import NBM2_pool_sizing as nbps
+import NBM2_telemetry as nbmt
+import collections
+import threading
+import sqlite3
+import socket
+import pickle
+import queue
+import json
+import time
+import os
+
+
+def isSentinel(item):
+    """
+    identifies the sentinels (poison pills) that the master places in the
+    input queue to shut down the servant processes.  Sentinels are passed
+    through the ledger untracked
+
+    Arguments In:
+        item:           an element placed into the input queue
+
+    Arguments Out:
+        is_sentinel:    a boolean variable that indicates if the element is
+                        a sentinel
+    """
+    if item is None:
+        return True
+    try:
+        return isinstance(item, tuple) and len(item) > 0 and item[0] is None
+    except:
+        return False
+
+def taskKey(item):
+    """
+    builds a stable key for a queue element so a task can be recognized
+    across runs.  Only the simple values in the element (file names, FIPS
+    codes, speeds) are used; configuration dictionaries, time structures and
+    data frames change from run to run and are ignored
+
+    Arguments In:
+        item:           an element placed into the input queue
+
+    Arguments Out:
+        task_key:       a string that identifies the task within a stage
+    """
+    if not isinstance(item, (tuple, list)) or \
+        isinstance(item, time.struct_time):
+        item = (item,)
+    key_parts = []
+    for part in item:
+        if isinstance(part, (str, int, float)) and not isinstance(part, bool):
+            key_parts.append(str(part))
+    return '|'.join(key_parts)
+
+def isErrorMessage(message):
+    """
+    identifies the messages a worker sends to the master when a task fails.
+    Most steps send (2, message, start, end); step 6 sends (message, start,
+    end) with ERROR in the message text
+
+    Arguments In:
+        message:        an element placed into the output queue
+
+    Arguments Out:
+        is_error:       a boolean variable that indicates if the element
+                        reports an error
+    """
+    try:
+        if isinstance(message, tuple) and len(message) > 0:
+            if isinstance(message[0], int) and not isinstance(message[0], bool):
+                return message[0] == 2
+            if isinstance(message[0], str):
+                return 'ERROR' in message[0]
+    except:
+        pass
+    return False
+
+def workerID(ip_address=None, pid=None):
+    """
+    creates the identifier the ledger uses to track which servant process
+    holds a lease
+
+    Arguments In:
+        ip_address:     a string variable that contains the IP address of
+                        the servant.  Defaults to the local address
+        pid:            the process id of the worker.  Defaults to the
+                        current process
+
+    Arguments Out:
+        worker_id:      a string that identifies the worker process
+    """
+    if ip_address is None:
+        ip_address = socket.gethostbyname(socket.gethostname())
+    if pid is None:
+        pid = os.getpid()
+    return '%s-%s' % (ip_address, pid)
+
+def workerAddress(worker_id):
+    # the IP address of the servant a worker runs on
+    return str(worker_id).rsplit('-', 1)[0]
+
+
+def resourcesOverlap(resource_a, resource_b):
+    """
+    determines whether two declared resources refer to the same data.  A
+    resource covers every resource whose name starts with it, so a directory
+    overlaps every file inside of it
+
+    Arguments In:
+        resource_a:     a string variable that names a file, directory,
+                        database table prefix or shared resource
+        resource_b:     a string variable that names a file, directory,
+                        database table prefix or shared resource
+
+    Arguments Out:
+        overlap:        a boolean variable that indicates if the resources
+                        refer to the same data
+    """
+    return resource_a.startswith(resource_b) or resource_b.startswith(resource_a)
+
+
+class TaskLedger(object):
+    """
+    a durable replacement for the plain input queue served by the queue
+    manager.  Every element the master puts into the queue becomes a task
+    with an ID that servant workers lease, acknowledge, or fail.  Workers
+    send a heartbeat while they hold a task; a lease that is not renewed, or
+    that belongs to a worker that died, is placed back in the queue so only
+    the lost task is repeated.  Acknowledged tasks are written to a sqlite
+    file so a killed run can be resumed; when a resumable stage is restarted
+    the completed tasks are not queued again and the messages they produced
+    are replayed into the output queue instead.
+
+    Each distributed task runs in its own stage (namespace) with its own
+    queue of tasks, and the stages of steps that run at the same time are
+    open at the same time - a worker only takes tasks from the stage it was
+    started for.  Messages sent by workers still finishing a stage that has
+    been drained never reach the master, and closing a stage tells every
+    worker of the stage to stop once its queue is empty - so the master no
+    longer floods the queue with sentinels.  A stage begun through a
+    StageQueue keeps the messages of its tasks for the step that owns it
+    (see StageResults); any other stage sends them to the output queue.
+
+    A task may declare the files (or other resources) it reads and writes.
+    The scheduler promises the resources every unfinished step writes, and a
+    task that reads a promised resource of another step waits until a task
+    that writes it is acknowledged or the step finishes.  So step 3 can
+    start on a speed as soon as step 2 has written that speed's file.
+
+    A task that runs far longer than expected (its run time in the previous
+    run, or the typical run time of the stage) is flagged as a straggler.  In
+    stages whose outputs are written atomically, an idle worker on another
+    servant is handed a speculative copy of the straggler; whichever copy
+    finishes first is kept and the other worker is stopped.  The messages a
+    task produces are held by its worker until the task finishes so only the
+    copy that is kept reaches the master.
+
+    The ledger also writes the telemetry of the run: a JSON line for every
+    task a worker finishes or fails, and for every stage and step.
+
+    The queue methods (put, get, qsize, ...) behave like queue.Queue so the
+    existing master routines can use the ledger without modification.
+    Without a stage they work on the stage that was begun last
+    """
+
+    def __init__(self, ledger_config, output_queue, telemetry_dir=None):
+        """
+        Arguments In:
+            ledger_config:  a dictionary that contains the ledger file, the
+                            lease length, the number of retries allowed and
+                            the speculation settings (config['task_ledger'])
+            output_queue:   the queue that carries results back to the
+                            master.  Used to forward the messages of finished
+                            tasks, to replay completed tasks and to report
+                            tasks that exhausted their retries
+            telemetry_dir:  the directory the JSON lines telemetry of each
+                            run is written to (config['telemetry']).  No
+                            telemetry is written if it is None
+        """
+        self.ledger_file        = ledger_config['ledger_file']
+        self.lease_seconds      = ledger_config['lease_seconds']
+        self.heartbeat_seconds  = ledger_config['heartbeat_seconds']
+        self.max_retries        = ledger_config['max_retries']
+        self.speculation        = ledger_config['speculation']
+        self.output_queue       = output_queue
+        self.telemetry_dir      = telemetry_dir
+        if telemetry_dir is not None:
+            os.makedirs(telemetry_dir, exist_ok=True)
+
+        self.condition      = threading.Condition()
+        self.tasks          = {}
+        self.next_id        = 1
+        self.stages         = {}
+        self.stage          = None
+        self.generation     = 0
+        self.promises       = {}
+        self.written        = set()
+
+        # load the tasks that were acknowledged by a previous run
+        self.db = sqlite3.connect(self.ledger_file, check_same_thread=False)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS tasks (stage TEXT, task_key TEXT,
+            state TEXT, attempts INTEGER, finished REAL, messages BLOB,
+            PRIMARY KEY (stage, task_key))""")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS checkpoints (name TEXT PRIMARY KEY,
+            finished REAL)""")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS runs (run_id TEXT, started REAL)""")
+        # the run time of every task the last time it completed.  Kept across
+        # runs so the master can queue the longest tasks first
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS task_costs (stage TEXT, task_key TEXT,
+            wall_seconds REAL, PRIMARY KEY (stage, task_key))""")
+        self.db.commit()
+        # a resumed run keeps writing to the telemetry of the run it resumes
+        rows = self.db.execute("""
+            SELECT run_id FROM runs ORDER BY started DESC LIMIT 1""").fetchall()
+        if len(rows) > 0:
+            self.run_id = rows[0][0]
+        else:
+            self._newRun()
+        self.completed = {}
+        for row in self.db.execute("""
+                SELECT stage, task_key, messages FROM tasks
+                WHERE state = 'acked'"""):
+            self.completed[(row[0], row[1])] = row[2]
+
+    ############################################################################
+    # queue.Queue compatible interface used by the master
+    ############################################################################
+    def put(self, item, block=True, timeout=None, reads=None, writes=None,
+            stage=None):
+        """
+        adds a task to a stage (by default the stage begun last).  Returns
+        False if the task was completed by a previous run of a resumable
+        stage (its messages are replayed) and True otherwise.  reads and
+        writes are lists of the resources the task reads and writes; a task
+        that reads a resource another step has promised to write waits until
+        it is written
+        """
+        with self.condition:
+            if stage is None:
+                stage = self.stage
+            stage_state = self._stageState(stage)
+            if isSentinel(item):
+                stage_state['pending'].append((None, item))
+                self.condition.notify_all()
+                return True
+
+            task_key = taskKey(item)
+            if stage_state['resumable'] and (stage, task_key) in self.completed:
+                for message in pickle.loads(self.completed[(stage, task_key)]):
+                    self._forward(stage, message)
+                self._markWritten(writes)
+                return False
+
+            task_id = self.next_id
+            self.next_id += 1
+            self.tasks[task_id] = { 'stage':        stage,
+                                    'generation':   stage_state['generation'],
+                                    'key':          task_key,
+                                    'item':         item,
+                                    'state':        'queued',
+                                    'attempts':     0,
+                                    'queued':       time.time(),
+                                    'leases':       {},
+                                    'flagged':      False,
+                                    'reads':        list(reads or []),
+                                    'writes':       list(writes or [])}
+            if self._blockingStep(self.tasks[task_id]) is None:
+                stage_state['pending'].append((task_id, item))
+            else:
+                self.tasks[task_id]['state'] = 'waiting'
+                stage_state['waiting'].append(task_id)
+            self.condition.notify_all()
+            return True
+
+    def put_nowait(self, item):
+        return self.put(item, False)
+
+    def get(self, block=True, timeout=None, stage=None):
+        """
+        removes the next element from the queue of a stage without leasing
+        it.  This is what the master uses to flush the queue; workers use
+        lease()
+        """
+        with self.condition:
+            if stage is None:
+                stage = self.stage
+            self._waitForPending(stage, block, timeout)
+            stage_state = self.stages.get(stage)
+            if stage_state is None or len(stage_state['pending']) == 0:
+                raise queue.Empty
+            task_id, item = stage_state['pending'].popleft()
+            if task_id is not None:
+                del self.tasks[task_id]
+            return item
+
+    def get_nowait(self):
+        return self.get(False)
+
+    def qsize(self, stage=None):
+        # the tasks of the stage that can be leased right away
+        with self.condition:
+            if stage is None:
+                stage = self.stage
+            stage_state = self.stages.get(stage)
+            return 0 if stage_state is None else len(stage_state['pending'])
+
+    def empty(self):
+        return self.qsize() == 0
+
+    ############################################################################
+    # task interface used by the servant workers
+    ############################################################################
+    def lease(self, worker_id, stage=None, block=True, timeout=None):
+        """
+        hands the next task to a worker and starts its lease.  When the queue
+        is empty an idle worker may be handed a speculative copy of a
+        straggler running on another servant
+
+        Arguments In:
+            worker_id:  a string that identifies the worker process
+            stage:      the stage the worker was started for.  A worker is
+                        never handed a task from a different stage
+            block:      a boolean variable that indicates whether to wait
+                        for a task
+            timeout:    the number of seconds to wait for a task
+
+        Arguments Out:
+            task_id:    the ID of the leased task (None for a sentinel)
+            stage:      the stage the task belongs to
+            item:       the element placed in the queue by the master.  A
+                        sentinel once the stage is closed and empty
+        """
+        end_time = None if timeout is None else time.time() + timeout
+        with self.condition:
+            if stage is None:
+                stage = self.stage
+            while True:
+                self._checkLeases()
+                stage_state = self.stages.get(stage)
+                if stage_state is None:
+                    # the stage was drained - tell the worker to stop
+                    return None, stage, (None, None)
+                if len(stage_state['pending']) > 0:
+                    task_id, item = stage_state['pending'].popleft()
+                    if task_id is not None:
+                        self._startLease(task_id, worker_id)
+                    return task_id, stage, item
+                if stage_state['closed']:
+                    return None, stage, (None, None)
+
+                task_id = self._findStraggler(worker_id, stage)
+                if task_id is not None:
+                    task = self.tasks[task_id]
+                    my_message = """
+                        WARNING - TASK LEDGER: STARTING A SPECULATIVE COPY OF
+                        %s TASK %s ON %s
+                        """ % (task['stage'], task['key'], worker_id)
+                    print(' '.join(my_message.split()))
+                    self.recordEvent({  'type':     'speculation',
+                                        'stage':    task['stage'],
+                                        'key':      task['key'],
+                                        'worker':   worker_id,
+                                        'start':    round(time.time(), 3)})
+                    self._startLease(task_id, worker_id)
+                    return task_id, stage, task['item']
+
+                if not block:
+                    raise queue.Empty
+                wait_time = self.heartbeat_seconds
+                if end_time is not None:
+                    wait_time = min(wait_time, end_time - time.time())
+                    if wait_time <= 0:
+                        raise queue.Empty
+                self.condition.wait(wait_time)
+
+    def heartbeat(self, task_id, worker_id):
+        """
+        renews a worker's lease on a task.  Returns False if the worker no
+        longer holds the task (another copy finished first, the lease
+        expired or the stage was drained) so the worker can stop
+        """
+        with self.condition:
+            task = self.tasks.get(task_id)
+            if task is None or worker_id not in task['leases'] or \
+                not self._isCurrent(task):
+                return False
+            task['leases'][worker_id]['expires'] = time.time() + \
+                                            self._leaseSeconds(task['stage'])
+            return True
+
+    def ack(self, task_id, messages=None, metrics=None, worker_id=None):
+        """
+        marks a task as complete, forwards the messages it produced to the
+        master and records them so they can be replayed if the stage is
+        resumed.  The resources the task writes are marked as written, which
+        releases the tasks waiting to read them.  metrics are the
+        measurements taken by the worker's TaskMeter.  Returns False if
+        another copy of the task finished first
+        """
+        with self.condition:
+            task = self.tasks.get(task_id)
+            if task is None or task['state'] != 'leased':
+                return False
+            if worker_id is None:
+                worker_id = next(iter(task['leases']))
+            if worker_id not in task['leases']:
+                return False
+            del self.tasks[task_id]
+            if messages is None:
+                messages = []
+            blob = pickle.dumps(messages)
+            self.completed[(task['stage'], task['key'])] = blob
+            self._record(task, 'acked', blob)
+            if self._isCurrent(task):
+                for message in messages:
+                    self._forward(task['stage'], message)
+
+            self._recordTask(task, worker_id, 'acked', metrics)
+            for other_worker in task['leases']:
+                if other_worker != worker_id:
+                    self._recordTask(task, other_worker, 'cancelled', None,
+                                    'COPY ON %s FINISHED FIRST' % worker_id)
+            wall_seconds = metrics['wall_seconds'] if metrics is not None \
+                        else time.time() - task['leases'][worker_id]['leased']
+            if self._isCurrent(task):
+                self.stages[task['stage']]['seconds'].append(wall_seconds)
+            if metrics is not None:
+                self.db.execute("""
+                    INSERT OR REPLACE INTO task_costs VALUES (?, ?, ?)""",
+                    (task['stage'], task['key'], metrics['wall_seconds']))
+                self.db.commit()
+            self._markWritten(task['writes'])
+            self.condition.notify_all()
+            return True
+
+    def fail(self, task_id, reason='', retry=True, metrics=None, worker_id=None,
+            messages=None, count_attempt=True):
+        """
+        returns a task to the queue, or marks it failed once its retries
+        are exhausted (or when retry is False).  If a speculative copy of the
+        task is still running only this copy is dropped.  The messages of a
+        task that is marked failed are forwarded to the master.  A task given
+        up by a worker that did nothing wrong (e.g., it was stopped to free
+        memory) is put back with count_attempt False, which does not use up
+        one of its retries
+        """
+        with self.condition:
+            task = self.tasks.get(task_id)
+            if task is None or task['state'] != 'leased':
+                return False
+            if worker_id is None:
+                worker_id = next(iter(task['leases']))
+            if worker_id not in task['leases']:
+                return False
+
+            if len(task['leases']) > 1:
+                # another copy of the task is still running - let it finish
+                self._recordTask(task, worker_id, 'dropped', metrics, reason)
+                del task['leases'][worker_id]
+                return True
+
+            if count_attempt:
+                task['attempts'] += 1
+            if retry and task['attempts'] <= self.max_retries and \
+                self._isCurrent(task) and \
+                not self.stages[task['stage']]['closed']:
+                self._recordTask(task, worker_id, 'retried', metrics, reason)
+                task['state']   = 'queued'
+                task['leases']  = {}
+                task['queued']  = time.time()
+                task['flagged'] = False
+                self.stages[task['stage']]['pending'].appendleft((task_id,
+                                                                task['item']))
+                self.condition.notify_all()
+                return True
+
+            del self.tasks[task_id]
+            self._record(task, 'failed', None)
+            self._recordTask(task, worker_id, 'failed', metrics, reason)
+            self.condition.notify_all()
+            if self._isCurrent(task):
+                for message in (messages or []):
+                    self._forward(task['stage'], message)
+                if retry:
+                    my_message = """
+                        ERROR - TASK LEDGER: %s TASK %s FAILED %s TIMES -
+                        LAST FAILURE: %s
+                        """ % (task['stage'], task['key'], task['attempts'],
+                                reason)
+                    self._forward(task['stage'], (2, ' '.join(my_message.split()),
+                                        time.localtime(), time.localtime()))
+            return True
+
+    def releaseWorker(self, worker_id, count_attempt=True):
+        """
+        returns every task leased by a worker that exited without finishing
+        its work to the queue.  count_attempt is False when the servant
+        stopped the worker itself (e.g., to free memory), so the task keeps
+        all of its retries
+        """
+        with self.condition:
+            task_ids = [t for t in self.tasks
+                        if worker_id in self.tasks[t]['leases']]
+        reason = 'WORKER %s EXITED' % worker_id if count_attempt else \
+                'WORKER %s WAS STOPPED BY ITS SERVANT' % worker_id
+        for task_id in task_ids:
+            self.fail(task_id, reason, worker_id=worker_id,
+                    count_attempt=count_attempt)
+        return len(task_ids)
+
+    ############################################################################
+    # run management used by the master
+    ############################################################################
+    def beginStage(self, stage, resumable=False, owner=None):
+        """
+        starts the namespace the following tasks belong to.  Tasks and
+        messages left over from an earlier stage of the same name are
+        discarded; stages of other steps are not touched.  Tasks put into a
+        resumable stage are skipped if a previous run acknowledged them.  A
+        stage with an owner (the step that runs it) keeps the messages of
+        its tasks for getResult; any other stage sends them to the output
+        queue
+        """
+        with self.condition:
+            if stage in self.stages:
+                self._discardPending(stage)
+            if owner is None:
+                self._purgeOutput()
+            self.generation += 1
+            self.stages[stage] = {  'generation':   self.generation,
+                                    'owner':        owner,
+                                    'pending':      collections.deque(),
+                                    'waiting':      [],
+                                    'results':      collections.deque()
+                                                    if owner is not None
+                                                    else None,
+                                    'resumable':    resumable,
+                                    'closed':       False,
+                                    'start':        (time.time(),
+                                                    time.monotonic()),
+                                    # the run times of the previous run are
+                                    # used to spot stragglers
+                                    'costs':        self.taskCosts(stage),
+                                    'seconds':      []}
+            self.stage = stage
+            self.condition.notify_all()
+
+    def currentStage(self):
+        """
+        returns the name of the stage begun last, or None if it has been
+        closed
+        """
+        with self.condition:
+            return self.stage if self.isOpen(self.stage) else None
+
+    def isOpen(self, stage):
+        """
+        returns True if a stage has been begun and not yet closed.  Servants
+        use it to ignore task messages left over from an earlier stage
+        """
+        with self.condition:
+            return stage in self.stages and not self.stages[stage]['closed']
+
+    def closeStage(self, stage=None):
+        """
+        closes a stage (by default the stage begun last).  Tasks that were
+        never started are discarded and every worker of the stage waiting
+        for a task is told to stop
+        """
+        with self.condition:
+            if stage is None:
+                stage = self.stage
+            if stage not in self.stages:
+                return
+            self._discardPending(stage)
+            self.stages[stage]['closed'] = True
+            self.condition.notify_all()
+
+    def drainStage(self, timeout=None, stage=None):
+        """
+        waits for the workers to finish the tasks they hold in a stage (by
+        default the stage begun last), then discards any messages they left
+        and forgets the stage
+
+        Arguments In:
+            timeout:    the number of seconds to wait
+            stage:      the name of the stage
+
+        Arguments Out:
+            drained:    a boolean variable that indicates if every leased
+                        task finished before the timeout
+        """
+        end_time = None if timeout is None else time.time() + timeout
+        with self.condition:
+            if stage is None:
+                stage = self.stage
+            if stage not in self.stages:
+                return True
+            while True:
+                self._checkLeases()
+                if self.leasedTasks(stage) == 0:
+                    drained = True
+                    break
+                wait_time = self.heartbeat_seconds
+                if end_time is not None:
+                    wait_time = min(wait_time, end_time - time.time())
+                    if wait_time <= 0:
+                        drained = False
+                        break
+                self.condition.wait(wait_time)
+            stage_state = self.stages.pop(stage, None)
+            if stage_state is None:
+                return drained
+            if stage_state['results'] is None:
+                self._purgeOutput()
+            # the stage ends once its workers are done
+            self.recordEvent({  'type':         'stage',
+                                'stage':        stage,
+                                'start':        round(stage_state['start'][0], 3),
+                                'wall_seconds': round(time.monotonic() -
+                                                stage_state['start'][1], 3),
+                                'drained':      drained})
+            self.condition.notify_all()
+            return drained
+
+    def leasedTasks(self, stage=None):
+        with self.condition:
+            if stage is None:
+                stage = self.stage
+            return len([t for t in self.tasks.values()
+                        if t['state'] == 'leased' and t['stage'] == stage and
+                        self._isCurrent(t)])
+
+    def putResult(self, stage, message):
+        """
+        forwards a worker's message to the master unless it belongs to a
+        stage that has already been drained
+        """
+        with self.condition:
+            if stage is not None and stage not in self.stages:
+                return False
+            if stage is not None and self.stages[stage]['results'] is not None:
+                self._forward(stage, message)
+                return True
+        self.output_queue.put(message)
+        return True
+
+    def getResult(self, stage, block=True, timeout=None):
+        """
+        removes the next message sent by the tasks of a stage begun with an
+        owner.  Raises queue.Empty like queue.Queue.get if no message arrives
+        in time
+        """
+        end_time = None if timeout is None else time.time() + timeout
+        with self.condition:
+            while True:
+                stage_state = self.stages.get(stage)
+                if stage_state is not None and stage_state['results']:
+                    return stage_state['results'].popleft()
+                if not block:
+                    raise queue.Empty
+                wait_time = None
+                if end_time is not None:
+                    wait_time = end_time - time.time()
+                    if wait_time <= 0:
+                        raise queue.Empty
+                self.condition.wait(wait_time)
+
+    def resultSize(self, stage):
+        with self.condition:
+            stage_state = self.stages.get(stage)
+            if stage_state is None or stage_state['results'] is None:
+                return 0
+            return len(stage_state['results'])
+
+    def promiseResources(self, owner, resources):
+        """
+        records the resources a step that has not finished will write.  A
+        task of another step that reads one of them waits until a task
+        writes it, or until the promise is kept or broken
+        """
+        with self.condition:
+            self.promises[owner] = list(resources)
+            self._releaseWaiting()
+
+    def keepPromise(self, owner):
+        """
+        the step finished - its resources are written and every task
+        waiting for them can run
+        """
+        with self.condition:
+            self.promises.pop(owner, None)
+            self._releaseWaiting()
+
+    def breakPromise(self, owner, reason=''):
+        """
+        the step failed or will not run, so the resources it promised that
+        were not written yet never will be.  The tasks waiting for them are
+        marked failed and the steps that own them are told with an error
+        message
+        """
+        with self.condition:
+            if owner not in self.promises:
+                return
+            for stage, stage_state in self.stages.items():
+                for task_id in list(stage_state['waiting']):
+                    task = self.tasks[task_id]
+                    if self._blockingStep(task) != owner:
+                        continue
+                    stage_state['waiting'].remove(task_id)
+                    del self.tasks[task_id]
+                    self._record(task, 'failed', None)
+                    self._recordTask(task, None, 'failed', None, reason)
+                    my_message = """
+                        ERROR - TASK LEDGER: %s TASK %s CANNOT RUN - %s
+                        DID NOT WRITE ITS INPUTS: %s
+                        """ % (stage, task['key'], owner.upper(), reason)
+                    self._forward(stage, (2, ' '.join(my_message.split()),
+                                        time.localtime(), time.localtime()))
+            del self.promises[owner]
+            self._releaseWaiting()
+
+    def completedTasks(self, stage):
+        with self.condition:
+            return len([k for k in self.completed if k[0] == stage])
+
+    def taskCosts(self, stage):
+        """
+        returns the run time in seconds of each task of a stage the last time
+        it completed, keyed by task key
+        """
+        with self.condition:
+            return dict(self.db.execute("""
+                SELECT task_key, wall_seconds FROM task_costs WHERE stage = ?""",
+                (stage,)).fetchall())
+
+    def checkpoint(self, name):
+        with self.condition:
+            self.db.execute("""
+                INSERT OR REPLACE INTO checkpoints VALUES (?, ?)""",
+                (name, time.time()))
+            self.db.commit()
+
+    def isCheckpointed(self, name):
+        with self.condition:
+            rows = self.db.execute("""
+                SELECT 1 FROM checkpoints WHERE name = ?""", (name,)).fetchall()
+            return len(rows) > 0
+
+    def recordEvent(self, record):
+        """
+        appends a record (a dictionary with a 'type' key) to the telemetry
+        of the run
+        """
+        if self.telemetry_dir is None:
+            return
+        record = dict(record, run_id=self.run_id)
+        with self.condition:
+            with open(self.telemetryFile(), 'a') as my_file:
+                my_file.write(json.dumps(record, sort_keys=True) + '\n')
+
+    def telemetryFile(self):
+        if self.telemetry_dir is None:
+            return None
+        return self.telemetry_dir + 'run_%s.jsonl' % self.run_id
+
+    def reset(self):
+        """
+        forgets all tasks and checkpoints so a new run starts from scratch
+        """
+        with self.condition:
+            self.tasks.clear()
+            self.completed.clear()
+            self.stages.clear()
+            self.promises.clear()
+            self.written.clear()
+            self.stage = None
+            self.db.execute("DELETE FROM tasks")
+            self.db.execute("DELETE FROM checkpoints")
+            self.db.commit()
+            self._newRun()
+            self.condition.notify_all()
+
+    ############################################################################
+    # internal routines
+    ############################################################################
+    def _stageState(self, stage):
+        # must be called while holding the condition.  Tasks put before any
+        # stage was begun are kept in an unnamed stage
+        if stage not in self.stages:
+            self.generation += 1
+            self.stages[stage] = {  'generation':   self.generation,
+                                    'owner':        None,
+                                    'pending':      collections.deque(),
+                                    'waiting':      [],
+                                    'results':      None,
+                                    'resumable':    False,
+                                    'closed':       False,
+                                    'start':        (time.time(),
+                                                    time.monotonic()),
+                                    'costs':        {},
+                                    'seconds':      []}
+        return self.stages[stage]
+
+    def _isCurrent(self, task):
+        # must be called while holding the condition.  A task belongs to the
+        # open generation of its stage, not to one that was drained or begun
+        # again since
+        stage_state = self.stages.get(task['stage'])
+        return stage_state is not None and \
+                stage_state['generation'] == task['generation']
+
+    def _forward(self, stage, message):
+        # must be called while holding the condition
+        stage_state = self.stages.get(stage)
+        if stage_state is not None and stage_state['results'] is not None:
+            stage_state['results'].append(message)
+            self.condition.notify_all()
+        else:
+            self.output_queue.put(message)
+
+    def _blockingStep(self, task):
+        # must be called while holding the condition.  Returns the step whose
+        # promise keeps the task from running, or None if every resource it
+        # reads is available.  A task is never held up by its own step
+        stage_state = self.stages.get(task['stage'])
+        owner = stage_state['owner'] if stage_state is not None else None
+        for resource in task['reads']:
+            if any(resource.startswith(w) for w in self.written):
+                continue
+            for step, promised in self.promises.items():
+                if step == owner:
+                    continue
+                if any(resourcesOverlap(resource, p) for p in promised):
+                    return step
+        return None
+
+    def _markWritten(self, resources):
+        # must be called while holding the condition
+        if not resources:
+            return
+        self.written.update(resources)
+        self._releaseWaiting()
+
+    def _releaseWaiting(self):
+        # must be called while holding the condition.  Moves the waiting
+        # tasks whose inputs are now available into their stage's queue, in
+        # the order they were put
+        for stage_state in self.stages.values():
+            still_waiting = []
+            for task_id in stage_state['waiting']:
+                task = self.tasks[task_id]
+                if self._blockingStep(task) is None:
+                    task['state'] = 'queued'
+                    task['queued'] = time.time()
+                    stage_state['pending'].append((task_id, task['item']))
+                else:
+                    still_waiting.append(task_id)
+            stage_state['waiting'] = still_waiting
+        self.condition.notify_all()
+
+    def _waitForPending(self, stage, block, timeout):
+        # must be called while holding the condition
+        end_time = None if timeout is None else time.time() + timeout
+        while True:
+            self._checkLeases()
+            stage_state = self.stages.get(stage)
+            if stage_state is None or len(stage_state['pending']) > 0 or \
+                stage_state['closed']:
+                return
+            if not block:
+                raise queue.Empty
+            wait_time = self.heartbeat_seconds
+            if end_time is not None:
+                wait_time = min(wait_time, end_time - time.time())
+                if wait_time <= 0:
+                    raise queue.Empty
+            self.condition.wait(wait_time)
+
+    def _discardPending(self, stage):
+        # must be called while holding the condition
+        stage_state = self.stages[stage]
+        for task_id, item in stage_state['pending']:
+            if task_id is not None:
+                del self.tasks[task_id]
+        for task_id in stage_state['waiting']:
+            del self.tasks[task_id]
+        stage_state['pending'].clear()
+        stage_state['waiting'] = []
+
+    def _purgeOutput(self):
+        # must be called while holding the condition
+        while True:
+            try:
+                self.output_queue.get_nowait()
+            except queue.Empty:
+                break
+
+    def _startLease(self, task_id, worker_id):
+        # must be called while holding the condition
+        task = self.tasks[task_id]
+        task['state'] = 'leased'
+        task['leases'][worker_id] = {   'leased':   time.time(),
+                                        'expires':  time.time() +
+                                            self._leaseSeconds(task['stage'])}
+
+    def _leaseSeconds(self, stage):
+        # the speculative stages write their outputs atomically, so a task
+        # whose heartbeat stops can be handed to another worker quickly.  Any
+        # other stage keeps the long lease
+        if stage in self.speculation['stages']:
+            return self.speculation['lease_seconds']
+        return self.lease_seconds
+
+    def _stragglerSeconds(self, task):
+        # must be called while holding the condition.  A task is a straggler
+        # once it runs straggler_factor times longer than its run time in the
+        # previous run, or than the median run time of the stage so far
+        stage_state = self.stages[task['stage']]
+        expected = stage_state['costs'].get(task['key'])
+        if expected is None:
+            seconds = stage_state['seconds']
+            if len(seconds) < self.speculation['min_samples']:
+                return None
+            expected = sorted(seconds)[len(seconds) // 2]
+        return max(expected * self.speculation['straggler_factor'],
+                    self.speculation['min_seconds'])
+
+    def _checkLeases(self):
+        # must be called while holding the condition.  Leases that were not
+        # renewed by a heartbeat are failed and stragglers are flagged
+        now = time.time()
+        expired = []
+        for task_id, task in self.tasks.items():
+            for worker_id, lease in task['leases'].items():
+                if lease['expires'] < now:
+                    expired.append((task_id, worker_id))
+            if task['state'] == 'leased' and not task['flagged'] and \
+                self._isCurrent(task):
+                limit = self._stragglerSeconds(task)
+                started = min(l['leased'] for l in task['leases'].values())
+                if limit is not None and now - started > limit:
+                    task['flagged'] = True
+                    my_message = """
+                        WARNING - TASK LEDGER: %s TASK %s HAS RUN FOR %s
+                        SECONDS ON %s - EXPECTED AT MOST %s
+                        """ % (task['stage'], task['key'], int(now - started),
+                                ', '.join(task['leases']), int(limit))
+                    print(' '.join(my_message.split()))
+                    self.recordEvent({  'type':         'straggler',
+                                        'stage':        task['stage'],
+                                        'key':          task['key'],
+                                        'start':        round(now, 3),
+                                        'run_seconds':  round(now - started, 3),
+                                        'limit_seconds':round(limit, 3)})
+        for task_id, worker_id in expired:
+            self.fail(task_id, 'LEASE EXPIRED - NO HEARTBEAT FROM %s' % worker_id,
+                    worker_id=worker_id)
+
+    def _findStraggler(self, worker_id, stage):
+        # must be called while holding the condition.  Finds the straggler of
+        # the stage that is furthest past its expected run time and is
+        # running on a different servant than the idle worker
+        if stage not in self.speculation['stages']:
+            return None
+        now = time.time()
+        best_task, best_ratio = None, 1.
+        for task_id, task in self.tasks.items():
+            if task['stage'] != stage or task['state'] != 'leased' or \
+                len(task['leases']) != 1 or not self._isCurrent(task):
+                continue
+            other_worker, lease = list(task['leases'].items())[0]
+            if workerAddress(other_worker) == workerAddress(worker_id):
+                continue
+            limit = self._stragglerSeconds(task)
+            if limit is None:
+                continue
+            ratio = (now - lease['leased']) / limit
+            if ratio > best_ratio:
+                best_task, best_ratio = task_id, ratio
+        return best_task
+
+    def _newRun(self):
+        # must be called while holding the condition (or from __init__)
+        self.run_id = time.strftime('%Y%m%d_%H%M%S')
+        self.db.execute("INSERT INTO runs VALUES (?, ?)", (self.run_id, 
+                        time.time()))
+        self.db.commit()
+
+    def _recordTask(self, task, worker_id, state, metrics, reason=None):
+        # must be called while holding the condition
+        lease = task['leases'].get(worker_id)
+        leased = lease['leased'] if lease is not None else None
+        record = {  'type':         'task',
+                    'stage':        task['stage'],
+                    'key':          task['key'],
+                    'state':        state,
+                    'attempt':      task['attempts'] + 
+                                    (state not in ('retried', 'failed')),
+                    'worker':       worker_id,
+                    'speculative':  lease is not None and leased > min(
+                                    l['leased'] for l in task['leases'].values()),
+                    'queue_seconds':round(leased - task['queued'], 3)
+                                    if leased is not None else None}
+        if metrics is None:
+            # the worker died, its lease expired or another copy finished
+            # first - only the ledger's view of the task is known
+            metrics = { 'start':            leased,
+                        'wall_seconds':     round(time.time() - leased, 3)
+                                            if leased is not None else 0.,
+                        'cpu_seconds':      0.,
+                        'child_cpu_seconds':0.,
+                        'peak_rss_mb':      0.,
+                        'read_bytes':       0,
+                        'write_bytes':      0,
+                        'rows':             0,
+                        'pid':              None}
+        record.update(metrics)
+        if reason:
+            record['reason'] = reason
+        self.recordEvent(record)
+
+    def _record(self, task, state, blob):
+        # must be called while holding the condition
+        self.db.execute("""
+            INSERT OR REPLACE INTO tasks VALUES (?, ?, ?, ?, ?, ?)""",
+            (task['stage'], task['key'], state, task['attempts'], time.time(),
+            blob))
+        self.db.commit()
+
+
+class LeasedQueue(object):
+    """
+    the view of the task ledger handed to a single servant worker.  It looks
+    like the input queue to the worker routines in the servant_step modules:
+    asking for the next element acknowledges the previous one.  The messages
+    the worker sends to the output queue while holding a task are kept and
+    handed to the ledger with the acknowledgement, and a heartbeat renews the
+    lease while the task runs.  If the ledger no longer recognizes the lease
+    (a speculative copy finished first, or the lease expired and the task 
+    was handed to another worker) the worker and every command it is running
+    are stopped; the servant's pool replaces it
+    """
+
+    def __init__(self, ledger, stage=None, worker_id=None, 
+                heartbeat_seconds=None, per_thread=False):
+        self.ledger     = ledger
+        self.worker_id  = worker_id if worker_id is not None else workerID()
+        self.task_id    = None
+        self.stage      = stage
+        self.messages   = []
+        self.meter      = nbmt.TaskMeter(per_thread)
+        self.lock       = threading.Lock()
+        if heartbeat_seconds is not None:
+            self.heartbeat_seconds = heartbeat_seconds
+            threading.Thread(target=self.sendHeartbeats, daemon=True).start()
+
+    def get(self, block=True, timeout=None):
+        self.ack()
+        task_id, stage, item = self.ledger.lease(self.worker_id, self.stage,
+                                                block, timeout)
+        with self.lock:
+            self.task_id = task_id
+            self.stage = stage
+            if task_id is not None:
+                self.meter.start()
+        return item
+
+    def get_nowait(self):
+        return self.get(False)
+
+    def put(self, item, block=True, timeout=None):
+        return self.ledger.put(item, block, timeout, stage=self.stage)
+
+    def put_nowait(self, item):
+        return self.put(item, False)
+
+    def qsize(self):
+        return self.ledger.qsize(self.stage)
+
+    def record(self, message):
+        """
+        keeps a message for the task being worked.  Returns False if the
+        worker holds no task, in which case the message is sent right away
+        """
+        if self.task_id is None:
+            return False
+        self.messages.append(message)
+        return True
+
+    def countRows(self, rows):
+        self.meter.countRows(rows)
+
+    def addSpan(self, span):
+        self.meter.addSpan(span)
+
+    def ack(self):
+        # a task that reported an error is not recorded as complete, so a
+        # resumed run processes it again
+        with self.lock:
+            if self.task_id is not None:
+                metrics = self.meter.stop()
+                if any(isErrorMessage(m) for m in self.messages):
+                    self.ledger.fail(self.task_id, 'WORKER REPORTED AN ERROR', 
+                                    False, metrics, self.worker_id, 
+                                    self.messages)
+                else:
+                    self.ledger.ack(self.task_id, self.messages, metrics, 
+                                    self.worker_id)
+            self.task_id  = None
+            self.messages = []
+
+    def release(self):
+        """
+        called when the worker routine returns while still holding a task
+        (it stopped on an error), so the task is marked failed rather than 
+        retried
+        """
+        with self.lock:
+            if self.task_id is not None:
+                self.ledger.fail(self.task_id, 'WORKER STOPPED', False,
+                                self.meter.stop(), self.worker_id, 
+                                self.messages)
+            self.task_id  = None
+            self.messages = []
+
+    def sendHeartbeats(self):
+        # runs in its own thread for the life of the worker.  The lock is not
+        # held while the ledger is called or the worker is stopped
+        while True:
+            time.sleep(self.heartbeat_seconds)
+            with self.lock:
+                task_id = self.task_id
+            if task_id is None:
+                continue
+            try:
+                holds_task = self.ledger.heartbeat(task_id, self.worker_id)
+            except:
+                # the queue manager could not be reached - try again
+                continue
+            if not holds_task:
+                # stop only if the worker is still on the task it lost (it
+                # may have finished it in the meantime)
+                with self.lock:
+                    lost_task = self.task_id == task_id
+                if lost_task:
+                    nbps.killProcessTree(os.getpid())
+
+
+class RecordingQueue(object):
+    """
+    wraps the output queue for a single servant worker.  Messages sent while
+    the worker holds a task are kept with the task and reach the master when
+    the task finishes; anything else is sent right away through the ledger so
+    messages from a stage that has already been replaced are dropped
+    """
+
+    def __init__(self, output_queue, leased_queue):
+        self.output_queue = output_queue
+        self.leased_queue = leased_queue
+
+    def put(self, item, block=True, timeout=None):
+        if self.leased_queue.record(item):
+            return True
+        return self.leased_queue.ledger.putResult(self.leased_queue.stage, item)
+
+    def put_nowait(self, item):
+        return self.put(item, False)
+
+    def countRows(self, rows):
+        """
+        adds to the number of rows the worker processed for the leased task
+        (reported in the telemetry)
+        """
+        self.leased_queue.countRows(rows)
+
+    def addSpan(self, span):
+        """
+        records a command the worker ran for the leased task (see 
+        NBM2_telemetry.runCommand)
+        """
+        self.leased_queue.addSpan(span)
+
+    def get(self, block=True, timeout=None):
+        return self.output_queue.get(block, timeout)
+
+    def get_nowait(self):
+        return self.output_queue.get_nowait()
+
+    def qsize(self):
+        return self.output_queue.qsize()
+
+
+class StageQueue(object):
+    """
+    the view of the task ledger handed to the master routines of one step
+    run by the scheduler.  It looks like the input queue to the step: the
+    stage the step begins is remembered, so the tasks it puts, the queue 
+    size it checks and the stage it closes are its own even while other 
+    steps have stages open on the same ledger
+    """
+
+    def __init__(self, ledger, step):
+        self.ledger = ledger
+        self.step   = step
+        self.stage  = None
+
+    def beginStage(self, stage, resumable=False):
+        self.stage = stage
+        self.ledger.beginStage(stage, resumable, self.step)
+
+    def currentStage(self):
+        if self.stage is not None and self.ledger.isOpen(self.stage):
+            return self.stage
+        return None
+
+    def closeStage(self):
+        if self.stage is not None:
+            self.ledger.closeStage(self.stage)
+
+    def drainStage(self, timeout=None):
+        if self.stage is None:
+            return True
+        return self.ledger.drainStage(timeout, self.stage)
+
+    def abandonStage(self):
+        """
+        closes the stage the step left open when it stopped on an error, 
+        without waiting for its workers
+        """
+        if self.stage is not None and self.ledger.isOpen(self.stage):
+            self.ledger.closeStage(self.stage)
+            self.ledger.drainStage(0, self.stage)
+
+    def put(self, item, block=True, timeout=None, reads=None, writes=None):
+        return self.ledger.put(item, block, timeout, reads, writes, self.stage)
+
+    def put_nowait(self, item):
+        return self.put(item, False)
+
+    def get(self, block=True, timeout=None):
+        return self.ledger.get(block, timeout, self.stage)
+
+    def get_nowait(self):
+        return self.get(False)
+
+    def qsize(self):
+        return self.ledger.qsize(self.stage)
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def completedTasks(self, stage):
+        return self.ledger.completedTasks(stage)
+
+    def taskCosts(self, stage):
+        return self.ledger.taskCosts(stage)
+
+
+class StageResults(object):
+    """
+    the output queue handed to the master routines of one step run by the
+    scheduler.  It holds the messages sent by the tasks of the step's open
+    stage, so the steps that run at the same time never read each other's
+    results
+    """
+
+    def __init__(self, stage_queue):
+        self.stage_queue = stage_queue
+
+    def get(self, block=True, timeout=None):
+        return self.stage_queue.ledger.getResult(self.stage_queue.stage, block,
+                                                timeout)
+
+    def get_nowait(self):
+        return self.get(False)
+
+    def qsize(self):
+        return self.stage_queue.ledger.resultSize(self.stage_queue.stage)
+
+    def empty(self):
+        return self.qsize() == 0
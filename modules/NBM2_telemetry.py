@@ -0,0 +1,374 @@
+import resource
+import json
+import time
+import os
+
+
+def readProcIO():
+    """
+    reads the bytes the current process (and the children it has waited for,
+    e.g., ogr2ogr or tippecanoe run with os.system) has read from and written
+    to storage
+
+    Arguments In:
+        None
+
+    Arguments Out:
+        read_bytes:     the number of bytes read
+        write_bytes:    the number of bytes written
+    """
+    read_bytes = write_bytes = 0
+    try:
+        with open('/proc/self/io', 'r') as my_file:
+            for line in my_file:
+                if line.startswith('read_bytes:'):
+                    read_bytes = int(line.split()[1])
+                elif line.startswith('write_bytes:'):
+                    write_bytes = int(line.split()[1])
+    except:
+        pass
+    return read_bytes, write_bytes
+
+def resetPeakRSS():
+    # lets VmHWM measure the peak of the next task rather than of the process
+    try:
+        with open('/proc/self/clear_refs', 'w') as my_file:
+            my_file.write('5')
+    except:
+        pass
+
+def readPeakRSS():
+    """
+    reads the peak resident memory of the current process in MB
+    """
+    try:
+        with open('/proc/self/status', 'r') as my_file:
+            for line in my_file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024.
+    except:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+class TaskMeter(object):
+    """
+    measures a single task run by a servant worker: monotonic wall time, CPU
+    time of the worker and the commands it runs, peak memory, storage I/O,
+    and the rows the worker reports it processed.  Commands the task runs
+    through runCommand (e.g., tippecanoe) are kept as spans within the task.
+    A worker that is a thread of the master (the local executor) shares the 
+    process with the other workers, so only its wall and thread CPU time are
+    its own; the process-wide memory, I/O and child measurements are left 
+    out of its records
+    """
+
+    def __init__(self, per_thread=False):
+        self.running    = False
+        self.per_thread = per_thread
+
+    def cpuSeconds(self):
+        # CPU time of the calling thread, or of the whole process
+        if self.per_thread:
+            if hasattr(resource, 'RUSAGE_THREAD'):
+                usage = resource.getrusage(resource.RUSAGE_THREAD)
+                return usage.ru_utime + usage.ru_stime
+            return time.thread_time()
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return usage.ru_utime + usage.ru_stime
+
+    def start(self):
+        if not self.per_thread:
+            resetPeakRSS()
+            self.start_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+            self.start_io       = readProcIO()
+        self.start_time     = time.time()
+        self.start_wall     = time.monotonic()
+        self.start_cpu      = self.cpuSeconds()
+        self.rows           = 0
+        self.spans          = []
+        self.running        = True
+
+    def countRows(self, rows):
+        if self.running:
+            self.rows += int(rows)
+
+    def addSpan(self, span):
+        if self.running:
+            self.spans.append(span)
+
+    def stop(self):
+        """
+        Arguments Out:
+            record:     a dictionary with the measurements of the task, or
+                        None if no task was being measured
+        """
+        if not self.running:
+            return None
+        self.running = False
+        record = {  'start':            round(self.start_time, 3),
+                    'wall_seconds':     round(time.monotonic() - self.start_wall, 3),
+                    'cpu_seconds':      round(self.cpuSeconds() - self.start_cpu, 3),
+                    'rows':             self.rows,
+                    'pid':              os.getpid()}
+        if self.per_thread:
+            record['per_thread'] = True
+        else:
+            end_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+            end_io       = readProcIO()
+            child_cpu    = (end_children.ru_utime - self.start_children.ru_utime) + \
+                            (end_children.ru_stime - self.start_children.ru_stime)
+            record['child_cpu_seconds'] = round(child_cpu, 3)
+            record['peak_rss_mb']       = round(readPeakRSS(), 1)
+            record['read_bytes']        = end_io[0] - self.start_io[0]
+            record['write_bytes']       = end_io[1] - self.start_io[1]
+            # ru_maxrss of the children is the largest child seen so far; 
+            # only report it if a child of this task set a new peak
+            if end_children.ru_maxrss > self.start_children.ru_maxrss:
+                record['child_peak_rss_mb'] = round(end_children.ru_maxrss / 1024., 1)
+        if len(self.spans) > 0:
+            record['spans'] = self.spans
+        return record
+
+
+def commandOutput(command):
+    # the file a shell command writes - the first -o option or redirection
+    words = command.split()
+    for i, w in enumerate(words[:-1]):
+        if w in ('-o', '>'):
+            return words[i+1]
+    return None
+
+def commandName(command):
+    # names a shell command by the programs in its pipeline and the file it
+    # writes, e.g., 'gzip | tippecanoe | tee > county_0.2.mbtiles'
+    programs = []
+    for part in command.split('|'):
+        words = [w for w in part.split() if w != 'time']
+        if len(words) > 0:
+            programs.append(os.path.basename(words[0]))
+    name = ' | '.join(programs)
+    if commandOutput(command) is not None:
+        name += ' > %s' % os.path.basename(commandOutput(command))
+    return name
+
+def runCommand(output_queue, command, label=None):
+    """
+    runs a shell command with os.system and records it as a span of the task
+    the worker is running, so it shows up in the run trace
+
+    Arguments In:
+        output_queue:   the output queue of the worker (a RecordingQueue)
+        command:        a string variable that contains the shell command
+        label:          a string variable that describes the command (e.g., 
+                        the zoom levels and speed of a tippecanoe run)
+
+    Arguments Out:
+        exit_status:    the exit status returned by os.system
+    """
+    name = commandName(command)
+    if label is not None:
+        name += ' (%s)' % label
+    start_time = time.time()
+    start_wall = time.monotonic()
+    exit_status = os.system(command)
+    span = {'name':         name,
+            'start':        round(start_time, 3),
+            'wall_seconds': round(time.monotonic() - start_wall, 3),
+            'exit_status':  exit_status}
+    if hasattr(output_queue, 'addSpan'):
+        output_queue.addSpan(span)
+    return exit_status
+
+
+def readTelemetry(telemetry_file):
+    """
+    reads the JSON lines records written by the task ledger
+
+    Arguments In:
+        telemetry_file: the full path to the JSON lines file of the run
+
+    Arguments Out:
+        records:        a list of dictionaries, one per line
+    """
+    records = []
+    with open(telemetry_file, 'r') as my_file:
+        for line in my_file:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                pass
+    return records
+
+def splitWorker(worker):
+    # the ledger identifies workers as '<ip address>-<pid>'
+    ip_address, pid = str(worker).rsplit('-', 1)
+    return ip_address, int(pid) if pid.isdigit() else 0
+
+def writeChromeTrace(telemetry_file, trace_file):
+    """
+    writes the run in the Chrome trace event format (chrome://tracing, 
+    Perfetto).  Each servant is a process and each of its worker processes a
+    track holding a span for every task it ran, with the commands the task 
+    ran nested inside.  The master's steps and the distributed stages are
+    drawn on their own tracks above the servants
+
+    Arguments In:
+        telemetry_file: the full path to the JSON lines file of the run
+        trace_file:     the full path to the trace to be written
+
+    Arguments Out:
+        None
+    """
+    records = readTelemetry(telemetry_file)
+    starts = [r['start'] for r in records if r.get('start')]
+    if len(starts) == 0:
+        return
+    run_start = min(starts)
+
+    def microseconds(seconds):
+        return int(round((seconds - run_start) * 1000000))
+
+    events = [{ 'name': 'process_name', 'ph': 'M', 'pid': 0, 'tid': 0,
+                'args': {'name': 'master'}},
+              { 'name': 'process_sort_index', 'ph': 'M', 'pid': 0, 'tid': 0,
+                'args': {'sort_index': 0}},
+              { 'name': 'thread_name', 'ph': 'M', 'pid': 0, 'tid': 0,
+                'args': {'name': 'distributed stages'}}]
+    servants = {}
+    workers = set()
+    step_tracks = {}
+    for r in records:
+        if r['type'] == 'step':
+            if r['step'] not in step_tracks:
+                step_tracks[r['step']] = len(step_tracks) + 1
+                events.append({ 'name': 'thread_name', 'ph': 'M', 'pid': 0,
+                                'tid': step_tracks[r['step']],
+                                'args': {'name': r['step']}})
+            events.append({ 'name': r['step'], 'cat': 'step', 'ph': 'X',
+                            'pid': 0, 'tid': step_tracks[r['step']],
+                            'ts': microseconds(r['start']),
+                            'dur': int(r['wall_seconds'] * 1000000),
+                            'args': {'result': r['result']}})
+
+        elif r['type'] == 'stage':
+            events.append({ 'name': r['stage'], 'cat': 'stage', 'ph': 'X',
+                            'pid': 0, 'tid': 0, 
+                            'ts': microseconds(r['start']),
+                            'dur': int(r['wall_seconds'] * 1000000),
+                            'args': {'drained': r['drained']}})
+
+        elif r['type'] == 'task' and r.get('start'):
+            ip_address, worker_pid = splitWorker(r['worker'])
+            if ip_address not in servants:
+                servants[ip_address] = len(servants) + 1
+                events.append({ 'name': 'process_name', 'ph': 'M',
+                                'pid': servants[ip_address], 'tid': 0,
+                                'args': {'name': 'servant %s' % ip_address}})
+                events.append({ 'name': 'process_sort_index', 'ph': 'M',
+                                'pid': servants[ip_address], 'tid': 0,
+                                'args': {'sort_index': servants[ip_address]}})
+            if (ip_address, worker_pid) not in workers:
+                workers.add((ip_address, worker_pid))
+                events.append({ 'name': 'thread_name', 'ph': 'M',
+                                'pid': servants[ip_address], 'tid': worker_pid,
+                                'args': {'name': 'worker %s' % worker_pid}})
+            args = dict((k, r[k]) for k in r if k not in ('type', 'spans', 
+                                                        'run_id', 'start'))
+            event = {   'name':     '%s %s' % (r['stage'], r['key']),
+                        'cat':      r['stage'],
+                        'ph':       'X',
+                        'pid':      servants[ip_address],
+                        'tid':      worker_pid,
+                        'ts':       microseconds(r['start']),
+                        'dur':      int(r['wall_seconds'] * 1000000),
+                        'args':     args}
+            # retried, failed and abandoned speculative copies stand out from
+            # the completed tasks
+            if r['state'] == 'retried':
+                event['cname'] = 'bad'
+            elif r['state'] == 'failed':
+                event['cname'] = 'terrible'
+            elif r['state'] in ('cancelled', 'dropped'):
+                event['cname'] = 'grey'
+            events.append(event)
+            for span in r.get('spans', []):
+                events.append({ 'name':     span['name'],
+                                'cat':      'command',
+                                'ph':       'X',
+                                'pid':      servants[ip_address],
+                                'tid':      worker_pid,
+                                'ts':       microseconds(span['start']),
+                                'dur':      int(span['wall_seconds'] * 1000000),
+                                'args':     {'exit_status': span['exit_status']}})
+
+    with open(trace_file + '.tmp', 'w') as my_file:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, my_file)
+    os.replace(trace_file + '.tmp', trace_file)
+
+def formatSeconds(seconds):
+    return time.strftime("%H:%M:%S", time.gmtime(seconds))
+
+def writeRunReport(telemetry_file, report_file, task_count=25):
+    """
+    writes the run report: the steps and distributed stages ranked by how
+    long they ran, followed by the slowest individual tasks
+
+    Arguments In:
+        telemetry_file: the full path to the JSON lines file of the run
+        report_file:    the full path to the report to be written
+        task_count:     the number of slowest tasks to list
+
+    Arguments Out:
+        report:         a string variable that contains the report
+    """
+    records = readTelemetry(telemetry_file)
+    steps  = [r for r in records if r['type'] == 'step']
+    stages = [r for r in records if r['type'] == 'stage']
+    tasks  = [r for r in records if r['type'] == 'task']
+
+    lines = ['NBM2 RUN REPORT - %s' % os.path.basename(telemetry_file), '']
+
+    lines.append('STEPS (SLOWEST FIRST)')
+    lines.append('{0:<10} {1:>10} {2:<10}'.format('step', 'run time', 'result'))
+    for r in sorted(steps, key=lambda r: -r['wall_seconds']):
+        lines.append('{0:<10} {1:>10} {2:<10}'.format(r['step'],
+                    formatSeconds(r['wall_seconds']), r['result']))
+    lines.append('')
+
+    # summarize the tasks of each distributed stage
+    lines.append('DISTRIBUTED STAGES (SLOWEST FIRST)')
+    lines.append('{0:<30} {1:>10} {2:>6} {3:>12} {4:>12} {5:>12} {6:>10}'\
+        .format('stage', 'run time', 'tasks', 'task time', 'cpu time',
+                'longest', 'peak MB'))
+    for r in sorted(stages, key=lambda r: -r['wall_seconds']):
+        stage_tasks = [t for t in tasks if t['stage'] == r['stage']]
+        lines.append('{0:<30} {1:>10} {2:>6} {3:>12} {4:>12} {5:>12} {6:>10}'\
+            .format(r['stage'][:30], formatSeconds(r['wall_seconds']),
+                len(stage_tasks),
+                formatSeconds(sum(t['wall_seconds'] for t in stage_tasks)),
+                formatSeconds(sum(t['cpu_seconds'] + t.get('child_cpu_seconds', 0)
+                                for t in stage_tasks)),
+                formatSeconds(max([t['wall_seconds'] for t in stage_tasks] or [0])),
+                int(max([max(t.get('peak_rss_mb', 0), t.get('child_peak_rss_mb', 0))
+                        for t in stage_tasks] or [0]))))
+    lines.append('')
+
+    lines.append('SLOWEST %s TASKS' % task_count)
+    lines.append('{0:<30} {1:<30} {2:<24} {3:>10} {4:>10} {5:>10} {6:>10} {7:>10} {8:>12}'\
+        .format('stage', 'task', 'worker', 'run time', 'cpu time',
+                'peak MB', 'read MB', 'write MB', 'rows'))
+    for r in sorted(tasks, key=lambda r: -r['wall_seconds'])[:task_count]:
+        lines.append('{0:<30} {1:<30} {2:<24} {3:>10} {4:>10} {5:>10} {6:>10} {7:>10} {8:>12}'\
+            .format(r['stage'][:30], r['key'][:30], r['worker'][:24],
+                formatSeconds(r['wall_seconds']),
+                formatSeconds(r['cpu_seconds'] + r.get('child_cpu_seconds', 0)),
+                int(max(r.get('peak_rss_mb', 0), r.get('child_peak_rss_mb', 0))),
+                int(r.get('read_bytes', 0) / 1048576),
+                int(r.get('write_bytes', 0) / 1048576),
+                r['rows']))
+
+    report = '\n'.join(lines) + '\n'
+    with open(report_file, 'w') as my_file:
+        my_file.write(report)
+    return report
@@ -263,10 +263,10 @@ for sql in sql_files:
 ########################################
 
 
-print("COPYING geojson FILES")
-print("Moving geojson files from run", prev_run)
+print("COPYING county block FILES")
+print("Moving county block files from run", prev_run)
 
-gj_files = glob.glob("/data/efs/" + prev_run + "/temp/geo_geojson/county_block/*.geojson")
+gj_files = glob.glob("/data/efs/" + prev_run + "/temp/geo_geojson/county_block/*.fgb")
 
 for gj in gj_files:
     print("copying", gj.split("/")[-1])
@@ -1,15 +1,18 @@
 import NBM2_functions as nbmf
+import NBM2_bulk_load as nbbl
 import multiprocessing as mp
 import sqlalchemy as sal
 import geopandas as gpd
 import pandas as pd
 import traceback
 import psycopg2
+import shapely
 import socket
-import pickle
 import time
 import csv
 import re
+import io
+import os
 import gc
 
 
@@ -53,38 +56,29 @@ def loadComplexShapes(input_queue, output_queue, config, db_config):
                 config      = inputs[1]
                 db_config   = inputs[2]
                 table_name  = inputs[3]
-                action      = inputs[4]
-                file_name   = inputs[5]
-                shape_type  = inputs[6]
+                file_name   = inputs[4]
+                shape_type  = inputs[5]
 
                 # make the connection to the database
-                connection_string = 'postgresql://%s:%s@%s:%s/%s' %\
-                            (db_config['db_user'], db_config['db_password'], 
-                            db_config['db_host'], db_config['db_port'],
-                            db_config['db'])                
-                engine = sal.create_engine(connection_string)
-                # begin to process the file
-                with engine.connect() as conn, conn.begin():
-                    # wait until the first process finishes so we know the table exists
-                    if counter != 0:
-                        sql_string = """
-                            SELECT EXISTS (SELECT 1 FROM information_schema.tables 
-                            WHERE  table_schema = '%s'
-                            AND    table_name = '%s'
-                            );""" % (db_config['db_schema'], table_name)
-                        while True:
-                            results = conn.execute(sql_string).fetchall()
-                            if results[0][0] == True:
-                                break
-                            else:
-                                time.sleep(5)
-
-                    # process the file
-                    shape_df = gpd.read_file(file_name)
-                    shape_df['geometry'] = shape_df['geometry'].apply(nbmf.convertPolyToMulti)
-                    shape_df['geometry'] = shape_df['geometry'].apply(nbmf.wkb_hexer)
-                    shape_df.to_sql(table_name, con=conn, schema=db_config['db_schema'], \
-                                    if_exists=action, index=True,)
+                my_conn = psycopg2.connect( host=db_config['db_host'], 
+                                            user=db_config['db_user'], 
+                                            password=db_config['db_password'], 
+                                            database=db_config['db'])
+                my_cursor = my_conn.cursor()
+
+                # stream the file, a chunk of rows at a time, into the typed
+                # table the master created with a binary COPY
+                columns = nbbl.tableColumns(
+                                config['%s_table_columns' % shape_type],
+                                db_config['SRID'])
+                row_count = nbbl.copyShapeFile(my_cursor, 
+                                    db_config['db_schema'], table_name, 
+                                    file_name, columns, db_config['SRID'], 
+                                    config['bulk_load']['chunk_rows'])
+                my_conn.commit()
+                output_queue.countRows(row_count)
+                my_cursor.close()
+                my_conn.close()
 
                 # acknowledge done with file
                 my_message = """
@@ -108,7 +102,6 @@ def loadComplexShapes(input_queue, output_queue, config, db_config):
             # the queue is empty - wait and check for another entry
             time.sleep(1)
 
-    del shape_df
     gc.collect()
 
     return True
@@ -140,10 +133,15 @@ def makeAndLoadTables_shape(inputs, my_name, my_ip_address, output_queue, engine
             # process the data and load it into the database
             temp_time = time.localtime()
             shape_df = gpd.read_file(inputs[0])
-            shape_df['geometry'] = shape_df['geometry'].apply(nbmf.convertPolyToMulti)
-            shape_df['geometry'] = shape_df['geometry'].apply(nbmf.wkb_hexer)
+            # repair and promote the geometry for the whole file at once; the
+            # validity flag lets the overlays skip the ST_BUFFER repair
+            geometry, valid = nbbl.normalizeGeometry(shape_df['geometry'])
+            shape_df = pd.DataFrame(shape_df.drop(columns='geometry'))
+            shape_df['geometry'] = shapely.to_wkb(geometry, hex=True)
+            shape_df['GEOMETRY_VALID'] = valid
             shape_df.to_sql(inputs[1], con=conn, schema=inputs[3], \
                             if_exists='replace', index=True,)
+            output_queue.countRows(len(shape_df))
 
             # change the geometry types
             sql_string = """ALTER TABLE %s.%s ALTER COLUMN %s TYPE geometry(MULTIPOLYGON, %s) 
@@ -685,8 +683,12 @@ def loadOtherFiles(input_queue, output_queue, config, db_config):
 
 def parseBlockDF(input_queue, output_queue, config, db_config):
     """
-    parses the data in the block datatable into smaller coutnysized geojson
-    files so that dissolve processes can be run faster
+    parses the data in the block table into smaller county sized FlatGeobuf
+    files so that dissolve processes can be run faster.  Each queue element
+    is a state and its counties: the state's partition of the block table
+    is read once, sorted by county, and each county is written as it comes
+    off the query.  FlatGeobuf is a compact binary format with a spatial 
+    index, so the county files are smaller and faster to read than geojson
 
     Arguments In:
         input_queue:        a multiprocessing queue that can be shared across
@@ -708,43 +710,63 @@ def parseBlockDF(input_queue, output_queue, config, db_config):
     my_name = mp.current_process().name
     my_ip_address = socket.gethostbyname(socket.gethostname())
     continue_run = True
+    temp_time = time.localtime()
 
-    # read in the block pickle file since it is faster than reading the database
     try:
-        temp_time = time.localtime()
-        my_message = "INFO - STEP 0 (%s - %s): TASK 6 OF 13 - STARTING TO READ IN BLOCK_DF PICKLE FILE" % (my_ip_address, my_name)
-        output_queue.put((0,my_message, temp_time, time.localtime()))
-        with open(config['temp_pickles']+"block_df.pkl",'rb') as my_pickle:
-            block_df = pickle.load(my_pickle)
-        block_df['tract_id']=block_df['geoid%s' % config['census_vintage'][2:]].str[:11]
-        block_df['county_id']=block_df['geoid%s' % config['census_vintage'][2:]].str[:5]  
-        my_message = "INFO - STEP 0 (%s - %s) TASK 6 OF 13 - COMPLETED READING IN BLOCK_DF PICKLE" % (my_ip_address, my_name)
-        output_queue.put((0,my_message, temp_time, time.localtime()))
+        # create the database connection
+        my_conn = psycopg2.connect(database=db_config['db'], 
+                                    user=db_config['db_user'],
+                                    password=db_config['db_password'],
+                                    host=db_config['db_host'])
     except:
-        my_message = "ERROR - STEP 0 (%s - %s) TASK 6 OF 13 - FAILED READING IN BLOCK_DF PICKLE" % (my_ip_address, my_name)
-        my_message += '\n' + traceback.format_exc()
-        output_queue.put((2,my_message, temp_time, time.localtime()))
+        my_message = "ERROR - STEP 0 (%s - %s): TASK 6 OF 13 - FAILED CONNECTING TO THE DATABASE" % (my_ip_address, my_name) + '\n' + traceback.format_exc()
+        output_queue.put((0,my_message, temp_time, time.localtime()))
         return False
 
+    # the county files keep the columns they had when they were cut from the
+    # block pickle
+    sql_block = """
+        SELECT CAST("BLOCK_FIPS" AS TEXT) AS geoid{0}, "ALAND{0}", 
+            substr("BLOCK_FIPS", 1, 11) AS tract_id, 
+            CAST("COUNTY_FIPS" AS TEXT) AS county_id, "GEOMETRY" AS geom
+        FROM {1}.nbm2_block_{2}
+        WHERE "STATE_FIPS" = '{3}' AND "COUNTY_FIPS" IN ({4})
+        ORDER BY "COUNTY_FIPS", "BLOCK_FIPS"
+        """
+    starting_crs={'init':'epsg:%s' % db_config['SRID']}
+
     # iterate over the queue
     while True:
         try:
-            county_fips = input_queue.get()
+            input = input_queue.get()
             try:
                 temp_time = time.localtime()
-                if county_fips[0] is None: break
-                file_name = config['temp_geog_geojson_path']+'county_block/block_df_%s.geojson' % county_fips
-                temp_df = block_df.loc[block_df['county_id']==county_fips]
-                if temp_df.shape[0] > 0:
-                    nbmf.silentDelete(file_name)
-                    temp_df.to_file(file_name, driver='GeoJSON') 
-                    my_message = "INFO - STEP 0 (%s - %s): TASK 6 OF 13 - COMPLETED PROCESSING BLOCK FOR COUNTY %s" % (my_ip_address, my_name, county_fips)
-                    output_queue.put((1,my_message, temp_time, time.localtime()))
-                else:
-                    my_message = "WARNING - STEP 0 (%s - %s): TASK 6 OF 13 - MISSING DATA FOR COUNTY %s" % (my_ip_address, my_name, county_fips)
-                    output_queue.put((1,my_message, temp_time, time.localtime()))
+                if input[0] is None: break
+                state_fips, county_fips = input[0], input[1]
+                sql_string = sql_block.format(config['census_vintage'][2:], 
+                                db_config['db_schema'], config['census_vintage'],
+                                state_fips, 
+                                ', '.join("'%s'" % c for c in county_fips))
+                block_df = gpd.GeoDataFrame.from_postgis(sql_string, my_conn, 
+                                geom_col='geom', crs=starting_crs)
+                for county_id, county_df in block_df.groupby('county_id', 
+                                                                sort=False):
+                    file_name = config['temp_geog_geojson_path']+'county_block/block_df_%s.fgb' % county_id
+                    temp_name = nbmf.atomicName(file_name)
+                    nbmf.silentDelete(temp_name)
+                    county_df.to_file(temp_name, driver='FlatGeobuf')
+                    os.replace(temp_name, file_name)
+                missing = set(county_fips) - set(block_df['county_id'])
+                output_queue.countRows(len(block_df))
+                for c in sorted(missing):
+                    my_message = "WARNING - STEP 0 (%s - %s): TASK 6 OF 13 - MISSING DATA FOR COUNTY %s" % (my_ip_address, my_name, c)
+                    output_queue.put((0,my_message, temp_time, time.localtime()))
+                my_message = "INFO - STEP 0 (%s - %s): TASK 6 OF 13 - COMPLETED PROCESSING BLOCKS FOR %s COUNTIES IN STATE %s" % (my_ip_address, my_name, len(county_fips) - len(missing), state_fips)
+                output_queue.put((1,my_message, temp_time, time.localtime()))
+                del block_df
             except:
-                my_message = "ERROR - STEP 0 (%s - %s): TASK 6 OF 13 - FAILED PROCESSING DATA FOR COUNTY %s" % (my_ip_address, my_name, county_fips) + '\n' + traceback.format_exc()
+                my_message = "ERROR - STEP 0 (%s - %s): TASK 6 OF 13 - FAILED PROCESSING DATA FOR STATE %s" % (my_ip_address, my_name, input[0]) + '\n' + traceback.format_exc()
+                output_queue.put((2,my_message, temp_time, time.localtime()))
                 continue_run = False
                 break
             
@@ -753,8 +775,7 @@ def parseBlockDF(input_queue, output_queue, config, db_config):
     my_message = "INFO - STEP 0 (%s - %s): TASK 6 OF 13 - TERMINATING PROCESS - NO MORE BLOCK DATA" % (my_ip_address, my_name)
     output_queue.put((0, my_message,temp_time, time.localtime()))
 
-    del block_df
-    del temp_df
+    my_conn.close()
     gc.collect()
 
     return continue_run
@@ -762,7 +783,8 @@ def parseBlockDF(input_queue, output_queue, config, db_config):
 def basicSpatialIntersection(input_queue, output_queue, config, db_config):
     """
     conducts the initial spatial intersection for tribe, place, and 
-    congressional districts
+    congressional districts.  Each queue element is a county and the lists
+    of tribes, congressional districts and places that intersect it
 
     Arguments In:
         input_queue:        a multiprocessing queue that can be shared across
@@ -797,48 +819,93 @@ def basicSpatialIntersection(input_queue, output_queue, config, db_config):
         output_queue.put(2,traceback.format_exc())
         return False
 
-    # create the sql_strings used by the three processes
+    # create the sql_strings used by the three processes.  Each statement 
+    # overlays the blocks of one county with all of its candidate geographies
+    # ({4} is the list of GEOIDs).  Blocks inside one of the subdivided 
+    # pieces of a geography are inside the geography, so they are inserted 
+    # whole with a cheap containment test.  The exact intersection is only 
+    # computed for the blocks on the boundary (those that intersect a piece
+    # of the geography without being inside any of its pieces)
     try:
         sql_tribe = """
             INSERT INTO {0}.nbm2_tribe_block_overlay_stg_{2}
+                (block_fips, tribal_id, aianhhcc, area, geom, state_fips, county_fips)
+            SELECT a."BLOCK_FIPS" AS block_fips, p."GEOID" AS tribal_id, p."CLASSFP" AS aianhhcc,
+                a."GEODESIC_AREA" AS area, a."GEOMETRY" AS geom, 
+                a."STATE_FIPS", a."COUNTY_FIPS"
+            FROM {0}.nbm2_block_{1} AS a 
+            JOIN {0}.nbm2_tribe_subdivided_{2} AS p ON ST_WITHIN(a."GEOMETRY", p.geom)
+            WHERE a."STATE_FIPS" = '{5}' AND a."COUNTY_FIPS" = '{3}' AND p."GEOID" IN ({4})
+            UNION ALL
             SELECT a."BLOCK_FIPS" AS block_fips, b."GEOID" AS tribal_id, b."CLASSFP" AS aianhhcc,
-                (CASE WHEN ST_WITHIN(a."GEOMETRY", b."GEOMETRY") THEN ST_AREA(a."GEOMETRY"::geography) 
+                (CASE WHEN ST_WITHIN(a."GEOMETRY", b."GEOMETRY") THEN a."GEODESIC_AREA" 
                     ELSE NULL 
                 END) AS area,  
                 (CASE WHEN ST_WITHIN(a."GEOMETRY", b."GEOMETRY") THEN a."GEOMETRY" 
+                    WHEN a."GEOMETRY_VALID" AND b."GEOMETRY_VALID" THEN 
+                        ST_MULTI(ST_COLLECTIONEXTRACT(ST_INTERSECTION(a."GEOMETRY", b."GEOMETRY"), 3)) 
                     ELSE ST_MULTI(ST_BUFFER(ST_INTERSECTION(a."GEOMETRY", b."GEOMETRY"), 0.0)) 
-                END) as geom  
+                END) as geom, a."STATE_FIPS", a."COUNTY_FIPS"  
             FROM {0}.nbm2_block_{1} AS a, {0}.nbm2_tribe_{2} AS b 
-            WHERE ST_INTERSECTS(a."GEOMETRY", b."GEOMETRY") AND SUBSTR(a."BLOCK_FIPS", 1, 5) = '{3}' AND b."GEOID" = '{4}';
-            COMMIT;
+            WHERE a."STATE_FIPS" = '{5}' AND a."COUNTY_FIPS" = '{3}' AND b."GEOID" IN ({4})
+            AND EXISTS (SELECT 1 FROM {0}.nbm2_tribe_subdivided_{2} AS p 
+                WHERE p."GEOID" = b."GEOID" AND ST_INTERSECTS(a."GEOMETRY", p.geom))
+            AND NOT EXISTS (SELECT 1 FROM {0}.nbm2_tribe_subdivided_{2} AS p 
+                WHERE p."GEOID" = b."GEOID" AND ST_WITHIN(a."GEOMETRY", p.geom));
             """
 
         sql_congress = """
             INSERT INTO {0}.nbm2_congress_block_overlay_stg_{2} 
+                (block_fips, cdist_id, area, geom, state_fips, county_fips)
+            SELECT a."BLOCK_FIPS" AS block_fips, p."GEOID" AS cdist_id,
+                a."GEODESIC_AREA" AS area, a."GEOMETRY" AS geom, 
+                a."STATE_FIPS", a."COUNTY_FIPS"
+            FROM {0}.nbm2_block_{1} AS a 
+            JOIN {0}.nbm2_congress_subdivided_{2} AS p ON ST_WITHIN(a."GEOMETRY", p.geom)
+            WHERE a."STATE_FIPS" = '{5}' AND a."COUNTY_FIPS" = '{3}' AND p."GEOID" IN ({4})
+            UNION ALL
             SELECT a."BLOCK_FIPS" AS block_fips, b."GEOID" AS cdist_id,
-            (CASE WHEN ST_WITHIN(a."GEOMETRY", b."GEOMETRY") THEN ST_AREA(a."GEOMETRY"::geography) 
+            (CASE WHEN ST_WITHIN(a."GEOMETRY", b."GEOMETRY") THEN a."GEODESIC_AREA" 
                 ELSE NULL 
             END) AS area, 
             (CASE WHEN ST_WITHIN(a."GEOMETRY", b."GEOMETRY") THEN a."GEOMETRY" 
+                WHEN a."GEOMETRY_VALID" AND b."GEOMETRY_VALID" THEN 
+                    ST_MULTI(ST_COLLECTIONEXTRACT(ST_INTERSECTION(a."GEOMETRY", b."GEOMETRY"), 3)) 
                 ELSE ST_MULTI(ST_BUFFER(ST_INTERSECTION(a."GEOMETRY", b."GEOMETRY"), 0.0)) 
-            END) AS geom 
+            END) AS geom, a."STATE_FIPS", a."COUNTY_FIPS" 
             FROM {0}.nbm2_block_{1} AS a, {0}.nbm2_congress_{2} AS b 
-            WHERE ST_INTERSECTS(a."GEOMETRY", b."GEOMETRY") AND SUBSTR("BLOCK_FIPS", 1, 5) = '{3}' AND b."GEOID" = '{4}'; 
-            COMMIT; 
+            WHERE a."STATE_FIPS" = '{5}' AND a."COUNTY_FIPS" = '{3}' AND b."GEOID" IN ({4})
+            AND EXISTS (SELECT 1 FROM {0}.nbm2_congress_subdivided_{2} AS p 
+                WHERE p."GEOID" = b."GEOID" AND ST_INTERSECTS(a."GEOMETRY", p.geom))
+            AND NOT EXISTS (SELECT 1 FROM {0}.nbm2_congress_subdivided_{2} AS p 
+                WHERE p."GEOID" = b."GEOID" AND ST_WITHIN(a."GEOMETRY", p.geom));
             """
 
         sql_place = """
             INSERT INTO {0}.nbm2_place_block_overlay_stg_{2} 
+                (block_fips, cplace_id, area, geom, state_fips, county_fips)
+            SELECT a."BLOCK_FIPS" AS block_fips, p."GEOID" AS cplace_id,
+                a."GEODESIC_AREA" AS area, a."GEOMETRY" AS geom, 
+                a."STATE_FIPS", a."COUNTY_FIPS"
+            FROM {0}.nbm2_block_{1} AS a 
+            JOIN {0}.nbm2_place_subdivided_{2} AS p ON ST_WITHIN(a."GEOMETRY", p.geom)
+            WHERE a."STATE_FIPS" = '{5}' AND a."COUNTY_FIPS" = '{3}' AND p."GEOID" IN ({4})
+            UNION ALL
             SELECT a."BLOCK_FIPS" as block_fips, b."GEOID" AS cplace_id, 
-            (CASE WHEN ST_WITHIN(a."GEOMETRY", b."GEOMETRY") THEN ST_AREA(a."GEOMETRY"::geography) 
+            (CASE WHEN ST_WITHIN(a."GEOMETRY", b."GEOMETRY") THEN a."GEODESIC_AREA" 
                 ELSE NULL 
             END) AS area, 
             (CASE WHEN ST_WITHIN(a."GEOMETRY", b."GEOMETRY") THEN a."GEOMETRY" 
+                WHEN a."GEOMETRY_VALID" AND b."GEOMETRY_VALID" THEN 
+                    ST_MULTI(ST_COLLECTIONEXTRACT(ST_INTERSECTION(a."GEOMETRY", b."GEOMETRY"), 3)) 
                 ELSE ST_MULTI(ST_BUFFER(ST_INTERSECTION(a."GEOMETRY", b."GEOMETRY"), 0.0)) 
-            END) AS geom 
+            END) AS geom, a."STATE_FIPS", a."COUNTY_FIPS" 
             FROM {0}.nbm2_block_{1} AS a, {0}.nbm2_place_{2} AS b 
-            WHERE ST_INTERSECTS(a."GEOMETRY", b."GEOMETRY") AND SUBSTR(a."BLOCK_FIPS", 1, 5) = '{3}' AND b."GEOID" = '{4}'; 
-            COMMIT;
+            WHERE a."STATE_FIPS" = '{5}' AND a."COUNTY_FIPS" = '{3}' AND b."GEOID" IN ({4})
+            AND EXISTS (SELECT 1 FROM {0}.nbm2_place_subdivided_{2} AS p 
+                WHERE p."GEOID" = b."GEOID" AND ST_INTERSECTS(a."GEOMETRY", p.geom))
+            AND NOT EXISTS (SELECT 1 FROM {0}.nbm2_place_subdivided_{2} AS p 
+                WHERE p."GEOID" = b."GEOID" AND ST_WITHIN(a."GEOMETRY", p.geom));
             """
 
     except:
@@ -848,46 +915,42 @@ def basicSpatialIntersection(input_queue, output_queue, config, db_config):
     # iterate over the queue elements
     while True:
         try:
-            input = input_queue.get_nowait()
+            input = input_queue.get()
             if input[0] is None: break
             try:
                 temp_time = time.localtime()
-                county_id = input[0]
-                space_id  = input[1]
-                shape     = input[2]
-
-                if shape == 'tribe':
-                    sql_string = sql_tribe.format(db_config['db_schema'], 
-                                                    config['census_vintage'], 
-                                                    config['geometry_vintage'], 
-                                                    county_id, space_id)
-
-                elif shape == 'congress':
-                    sql_string = sql_congress.format(db_config['db_schema'], 
-                                                    config['census_vintage'], 
-                                                    config['geometry_vintage'], 
-                                                    county_id, space_id)
-                elif shape == 'place':
-                    sql_string = sql_place.format(db_config['db_schema'], 
-                                                    config['census_vintage'], 
-                                                    config['geometry_vintage'], 
-                                                    county_id, space_id)
-                else:
-                    output_queue.put((3,"UNEXPECTED VALUE IN QUEUE", shape))
-
-                my_cursor.execute(sql_string) 
+                county_id   = input[0]
+                geographies = (('tribe', sql_tribe, input[1]), 
+                                ('congress', sql_congress, input[2]),
+                                ('place', sql_place, input[3]))
+
+                # all three overlays of the county are one transaction, so a
+                # county is either completely in the staging tables or not
+                # at all
+                for shape, sql_template, space_ids in geographies:
+                    if len(space_ids) == 0:
+                        continue
+                    sql_string = sql_template.format(db_config['db_schema'], 
+                                    config['census_vintage'], 
+                                    config['geometry_vintage'], county_id, 
+                                    ', '.join("'%s'" % s for s in space_ids),
+                                    county_id[:2])
+                    my_cursor.execute(sql_string)
+                my_conn.commit()
 
                 my_message = """
                     INFO - STEP 0 (%s - %s): TASK 7 OF 13 - PROCESSED THE SPATIAL
-                    INTERSECTION BETWEEN %s AND %s GEOGRAPHY %s
-                    """ % (my_ip_address, my_name, county_id, shape.upper(), space_id)
+                    INTERSECTIONS OF %s WITH %s TRIBAL, %s CONGRESSIONAL AND %s
+                    PLACE GEOGRAPHIES
+                    """ % (my_ip_address, my_name, county_id, len(input[1]), 
+                            len(input[2]), len(input[3]))
                 my_message = ' '.join(my_message.split())
                 output_queue.put((1, my_message,temp_time, time.localtime()))
             except:
                 my_message = """
                     ERROR - STEP 0 (%s - %s): TASK 7 OF 13 - FAILED TO PROCESS
-                    THE SPATIAL INTERSECTION BETWEEN %s AND %s GEOGRAPHY %s
-                    """ % (my_ip_address, my_name, county_id, shape.upper(), space_id)
+                    THE SPATIAL INTERSECTIONS OF %s
+                    """ % (my_ip_address, my_name, county_id)
                 my_message = ' '.join(my_message.split()) + '\n%s' % traceback.format_exc()
                 output_queue.put((2, my_message,temp_time, time.localtime()))
                 my_conn.close()
@@ -942,7 +1005,7 @@ def assignWaterBlocks(input_queue, output_queue, config, db_config):
     # iterate over the queue elements
     while True:
         try:
-            input = input_queue.get_nowait()
+            input = input_queue.get()
             try:
                 if input[0] is None: break
                 try:
@@ -978,10 +1041,51 @@ def assignWaterBlocks(input_queue, output_queue, config, db_config):
     return True
 
 # used in step 0 task k+1
+def readFBDRange(fbd_file, start, end, config):
+    """
+    reads the lines of the fixed broadband data file between two byte 
+    offsets.  Both offsets are at the start of a line (see 
+    step0_task_13.fbdByteRanges)
+
+    Arguments In:
+        fbd_file:           the path to the fbd csv
+        start:              the byte offset of the first line to be read
+        end:                the byte offset after the last line to be read
+        config:			    the json variable that contains all configration
+    					    data required for the data processing
+
+    Arguments Out:
+        fbd_df:             a dataframe with the config['fbd_data_columns']
+                            of the lines, or None if the headers of the file
+                            are not the expected ones
+    """
+    fbd_columns = list(pd.read_csv(fbd_file, nrows=0))  # get the headers
+    with open(fbd_file, 'rb') as my_file:
+        my_file.seek(start)
+        data = io.BytesIO(my_file.read(end - start))
+
+    # the file either has the expected headers or the old headers that are
+    # renamed (see config['fbd_rename_columns'])
+    if all(c in fbd_columns for c in config['fbd_data_columns']):
+        return pd.read_csv(data, header=None, names=fbd_columns, 
+                            usecols=config['fbd_data_columns'], 
+                            dtype=config['fbd_data_types'])
+    old_names = list(config['fbd_rename_columns'].keys())
+    if all(c in fbd_columns for c in old_names):
+        return pd.read_csv(data, header=None, names=fbd_columns, 
+                            usecols=old_names, 
+                            dtype=config['fbd_data_types_old'])\
+                            .rename(columns=config['fbd_rename_columns'])\
+                            [config['fbd_data_columns']]
+    return None
+
 def parseFBD(input_queue, output_queue, config, db_config):
     """
     parses the data in the fixed broad band data file into smaller county 
-    sized geojson files so that dissolve processes can be run faster
+    sized csv files so that dissolve processes can be run faster.  Each 
+    queue element is a byte range of the file: the range is read once and 
+    its rows are split by county in one groupby, and each county's rows are
+    written to a part file that the master joins into the county file
 
     Arguments In:
         input_queue:        a multiprocessing queue that can be shared across
@@ -1003,83 +1107,52 @@ def parseFBD(input_queue, output_queue, config, db_config):
     continue_run = True
     my_name = mp.current_process().name
     my_ip_address = socket.gethostbyname(socket.gethostname())
-
-    # read in the fbd csv
     temp_time = time.localtime()
-    my_message = "INFO - STEP 0 (%s - %s): TASK 13 OF 13 - STARTING TO READ IN FBD CSV" % (my_ip_address, my_name)
-    output_queue.put((0,my_message, temp_time, time.localtime()))
- 
-    try:
-        temp_time = time.localtime()
-        fbd_file = config['input_csvs_path']+config['fbData']
-        fbd_columns = list(pd.read_csv(fbd_file, nrows=0))  # get the headers
-
-      
-        # check to see if all the expected headers are in the file
-        column_count = 0
-        for column_name in config['fbd_data_columns']:
-            if column_name in fbd_columns:
-                column_count += 1
-
-        # if all of the expected headers were not in the file, then check
-        # to confirm that we have properly prepared the change names config param
-        if column_count != len(config['fbd_data_columns']):
-            data_count = 0
-            for column_name in config['fbd_rename_columns']:
-                if column_name in fbd_columns:
-                    data_count += 1
-
-        # if headers are as we anticipated (either option), then load the data into the dataframe
-        if column_count == len(config['fbd_data_columns']):    
-            fbd_df = pd.read_csv(fbd_file, usecols=config['fbd_data_columns'], 
-                                dtype=config['fbd_data_types'])
-        
-        elif data_count == len(config['fbd_data_columns']):
-            old_names = config['fbd_rename_columns'].keys()
-            fbd_df = pd.read_csv(fbd_file, usecols=old_names, 
-                                dtype=config['fbd_data_types_old'])\
-                                .rename(columns=config['fbd_rename_columns'])
-
-        # headers are unexpected and we cannot proceed
-        else:
-            my_message = """
-                ERROR - STEP 1 (MASTER): TASK 13 OF 13 - UNEXPECTED COLUMN HEADERS
-                IN FBD FBD DATA FILE - MODIFY CONFIG FILE
-                """
-            my_message = ' '.join(my_message.split())
-            print(nbmf.logMessage(my_message, temp_time, time.localtime()))
-            return False 
-
-        # add county FIPS
-        fbd_df['county_id']=fbd_df.BlockCode.str[:5] 
-
-    except:
-        my_message = "ERROR - STEP 0 (%s - %s) TASK 13 OF 13 - FAILED READING IN FBD CSV" % (my_ip_address, my_name)
-        my_message += '\n' + traceback.format_exc()
-        output_queue.put((2,my_message, temp_time, time.localtime()))
+    fbd_file = config['input_csvs_path']+config['fbData']
+    part_path = config['temp_csvs_dir_path']+'county_fbd/parts/'
 
     # iterate over the queue
     while True:
         try:
-            county_fips = input_queue.get()
+            input = input_queue.get()
             try:
-                if county_fips is None: break
+                if input[0] is None: break
                 temp_time = time.localtime()
-                fbd_name = config['temp_csvs_dir_path']+'/county_fbd/fbd_df_%s.csv' % county_fips
-                fbd_df.loc[fbd_df['county_id']==county_fips].to_csv(fbd_name)
-                my_message = "INFO - STEP 0 (%s - %s): TASK 13 OF 13 - COMPLETED PROCESSING FBD FOR COUNTY %s" % (my_ip_address, my_name, county_fips)
+                start, end = input[0], input[1]
+                fbd_df = readFBDRange(fbd_file, start, end, config)
+                if fbd_df is None:
+                    my_message = """
+                        ERROR - STEP 0 (%s - %s): TASK 13 OF 13 - UNEXPECTED 
+                        COLUMN HEADERS IN FBD DATA FILE - MODIFY CONFIG FILE
+                        """ % (my_ip_address, my_name)
+                    my_message = ' '.join(my_message.split())
+                    output_queue.put((2,my_message, temp_time, time.localtime()))
+                    continue_run = False
+                    break
+
+                # the part files are named by the range's offset so the 
+                # master joins them in the order of the fbd file
+                for county_fips, county_df in fbd_df.groupby(
+                                fbd_df.BlockCode.str[:5], sort=False):
+                    part_name = part_path + 'fbd_df_%s_%012d.csv' % \
+                                (county_fips, start)
+                    county_df.to_csv(nbmf.atomicName(part_name), header=False,
+                                        index=False)
+                    os.replace(nbmf.atomicName(part_name), part_name)
+                output_queue.countRows(len(fbd_df))
+                my_message = "INFO - STEP 0 (%s - %s): TASK 13 OF 13 - COMPLETED PARSING BYTES %s TO %s OF THE FBD CSV" % (my_ip_address, my_name, start, end)
                 output_queue.put((1,my_message, temp_time, time.localtime()))
+                del fbd_df
             except:
-                my_message = "ERROR - STEP 0 (%s - %s): TASK 13 OF 13 - FAILED PROCESSING DATA FOR COUNTY %s" % (my_ip_address, my_name, county_fips) + '\n' + traceback.format_exc()
+                my_message = "ERROR - STEP 0 (%s - %s): TASK 13 OF 13 - FAILED PARSING BYTES %s TO %s OF THE FBD CSV" % (my_ip_address, my_name, input[0], input[1]) + '\n' + traceback.format_exc()
                 output_queue.put((2,my_message, temp_time, time.localtime()))
                 continue_run = False
                 break
         except:
             time.sleep(1)
 
-    my_message = "INFO - STEP 0 (%s - %s): TASK 13 OF 13 - TERMINATING PROCESS - NO MORE BLOCK DATA" % (my_ip_address, my_name)
+    my_message = "INFO - STEP 0 (%s - %s): TASK 13 OF 13 - TERMINATING PROCESS - NO MORE FBD DATA" % (my_ip_address, my_name)
     output_queue.put((0, my_message, temp_time, time.localtime()))
 
-    del fbd_df
     gc.collect()
     return continue_run
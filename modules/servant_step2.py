@@ -1,3 +1,5 @@
+import NBM2_functions as nbmf
+import NBM2_broadcast as nbbs
 import multiprocessing as mp
 import pandas as pd
 import numpy as np
@@ -5,6 +7,7 @@ import traceback
 import socket
 import pickle
 import time 
+import os
 import gc
 
 
@@ -90,6 +93,7 @@ def makeBlockNumprovFile(output_queue, workerSpeed, d_speed, u_speed,
         df_return.reset_index(inplace=True,drop=False)
         df_return = pd.merge(blockm_df[['BlockCode','h2only_undev']],
                             df_return,on='BlockCode', how='right')
+        output_queue.countRows(len(df_return))
         
         my_message = """
             INFO - STEP 2 (%s - %s): TASK 4 OF 5 - PROCESSED INITIAL NUMPROV 
@@ -213,7 +217,9 @@ def writeNumProvFile(output_queue, df_return, numprov_file_path,
     try:
         temp_time = time.localtime()
         df_return['h2only_undev']=df_return.h2only_undev.replace(0,np.nan)  
-        df_return.to_csv(numprov_file_path,index=False, float_format='%.0f')
+        df_return.to_csv(nbmf.atomicName(numprov_file_path),index=False, 
+                        float_format='%.0f')
+        os.replace(nbmf.atomicName(numprov_file_path), numprov_file_path)
 
         my_message = """
             INFO - STEP 2 (%s - %s): TASK 4 OF 5 - COMPLETED WRITING BLOCK 
@@ -227,7 +233,9 @@ def writeNumProvFile(output_queue, df_return, numprov_file_path,
         df_return.fillna(0, inplace=True)
         for col in df_return.columns[1:]:
             df_return[col]=df_return[col].astype('int8')
-        df_return.to_csv(numprov_zero_file_path, index=False) 
+        df_return.to_csv(nbmf.atomicName(numprov_zero_file_path), index=False) 
+        os.replace(nbmf.atomicName(numprov_zero_file_path), 
+                    numprov_zero_file_path)
         df_return['h2only_undev']=df_return.h2only_undev.replace(0,np.nan)  
         
         my_message = """
@@ -360,7 +368,10 @@ def createAreaTable(output_queue, df_return, big_df, area_table_cols, geog_dict,
                                     exectuted
     """
     try:
-        # Prep area table for appending
+        # Prep area table for appending.  The table is built under a 
+        # temporary name and moved into place once it is complete
+        area_table_path = temp_area_table_file_path
+        temp_area_table_file_path = nbmf.atomicName(area_table_path)
         out_df=pd.DataFrame(columns=area_table_cols)
         out_df.to_csv(temp_area_table_file_path, index=False)
 
@@ -418,6 +429,7 @@ def createAreaTable(output_queue, df_return, big_df, area_table_cols, geog_dict,
         my_message = ' '.join(my_message.split())
         response = (0, my_message, temp_time, time.localtime())
         output_queue.put(response)       
+        os.replace(temp_area_table_file_path, area_table_path)
 
         del out_df
         gc.collect()
@@ -481,7 +493,7 @@ def makeBlockNumProv(input_queue, output_queue, config, db_config):
                 u_speed                   = inputs[5]
                 column_names              = inputs[6]
                 fbd_path                  = inputs[7]
-                blockm_df                 = inputs[8]
+                blockm_df                 = nbbs.fetch(config, inputs[8])
                 start_time                = inputs[9]  
 
                 # get the config items
@@ -1,9 +1,12 @@
+import NBM2_functions as nbmf
+import NBM2_broadcast as nbbs
 import multiprocessing as mp
 import pandas as pd 
 import traceback 
 import pandas 
 import socket
 import time 
+import os
 
 def outputGeoData(out_df, out_df_path, my_name, my_ip_address, geo, worker_speed, 
                     start_time, output_queue):
@@ -35,7 +38,9 @@ def outputGeoData(out_df, out_df_path, my_name, my_ip_address, geo, worker_speed
     try:
         # output the files
         temp_time = time.localtime()
-        out_df.to_csv(out_df_path)
+        out_df.to_csv(nbmf.atomicName(out_df_path))
+        os.replace(nbmf.atomicName(out_df_path), out_df_path)
+        output_queue.countRows(len(out_df))
         my_message = """
             INFO - STEP 3 (%s - %s): COMPLETED PRINTING %s GEOMETRIES 
             FOR %s
@@ -353,11 +358,11 @@ def makeLargeTracts(input_queue, output_queue, config, db_config):
 
                 # extract the terms from the queue list
                 numprov_path        = inputs[0] 
-                blockm_df           = inputs[1]               
+                blockm_df           = nbbs.fetch(config, inputs[1])
                 out_tract_path      = inputs[2]                   
                 out_county_path     = inputs[3]                  
-                out_tract_df        = inputs[4]
-                out_county_df       = inputs[5]  
+                out_tract_df        = nbbs.fetch(config, inputs[4]).copy()
+                out_county_df       = nbbs.fetch(config, inputs[5]).copy()
                 start_time          = inputs[6] 
                 worker_speed        = inputs[7]
                 config              = inputs[8]
@@ -41,7 +41,7 @@ def genTractGeoJson(input_queue, output_queue,config, db_config):
             file_name = element[0]         
             config = element[1]
             start_time = element[2]
-            county = file_name.split('.geojson')[0][-5:]
+            county = file_name.split('.fgb')[0][-5:]
             try:
                 # dissolve the blocks into the tract level 
                 temp_time = time.localtime()
@@ -55,6 +55,7 @@ def genTractGeoJson(input_queue, output_queue,config, db_config):
                     COUNTY
                     """ % (my_IP_address, my_name, county)
                 my_message = ' '.join(my_message.split()) 
+                output_queue.countRows(len(temp_df))
                 output_queue.put((1, my_message, temp_time, time.localtime(), temp_df))
 
             except:
@@ -109,7 +110,7 @@ def genCountyHoCoNumGeoJson(input_queue, output_queue,config, db_config):
             fbd_name    = element[1]       
             config      = element[2]
             start_time  = element[3]
-            county = block_name.split('.geojson')[0][-5:]  
+            county = block_name.split('.fgb')[0][-5:]  
             try:
                 # get the fbd file for the given county
                 temp_time = time.localtime()
@@ -134,6 +135,7 @@ def genCountyHoCoNumGeoJson(input_queue, output_queue,config, db_config):
                 temp_footprint_df=temp_df[['hoconum','county_id','geometry']]\
                                     .dissolve(by=['hoconum','county_id'])
                 temp_footprint_df.reset_index(inplace=True)
+                output_queue.countRows(len(temp_df))
                 my_message = """
                     INFO - STEP 5 (%s - %s): COMPLETED DISSOLVING COUNTY AND 
                     HOCONUM FOR %s COUNTY
@@ -1,3 +1,5 @@
+import NBM2_telemetry as nbmt
+import NBM2_functions as nbmf
 import multiprocessing as mp
 import pandas as pd 
 import traceback 
@@ -5,6 +7,32 @@ import socket
 import time 
 import os
 
+def runTileCommand(output_queue, command):
+    """
+    runs a tippecanoe, tippecanoe-json-tool or tile-join command so that the
+    file it writes appears all at once.  The command writes to a temporary
+    name that is moved into place when the command succeeds, so a
+    speculative copy of the task running on another servant is harmless
+
+    Arguments In:
+        output_queue:   the output queue of the worker
+        command:        a string variable that contains the shell command
+
+    Arguments Out:
+        exit_status:    the exit status returned by the command
+    """
+    output_file = nbmt.commandOutput(command)
+    if output_file is None:
+        return nbmt.runCommand(output_queue, command)
+    temp_file = nbmf.atomicName(output_file)
+    exit_status = nbmt.runCommand(output_queue, 
+                                command.replace(output_file, temp_file, 1))
+    if exit_status == 0 and os.path.exists(temp_file):
+        os.replace(temp_file, output_file)
+    else:
+        nbmf.silentDelete(temp_file)
+    return exit_status
+
 # used in step 6 task 1
 def genInitialGeoJson(input_queue, output_queue, config, db_config):
     """
@@ -48,35 +76,35 @@ def genInitialGeoJson(input_queue, output_queue, config, db_config):
                 temp_time = time.localtime()
                 if file_type == 'county':
                     my_message = '%s - STEP 6 (%s - %s): %s CREATING COUNTY DATA (FOR ZOOM 0-4) FOR %s SPEED'
-                    os.system('time tippecanoe-json-tool -c '+\
+                    runTileCommand(output_queue, 'time tippecanoe-json-tool -c '+\
                         config['temp_csvs_dir_path']+'county_numprov/county_numprov_sort_round_%s_%s.csv ' % (speed, config['fbd_vintage']) +\
                         config['temp_speed_geojson_path']+'county_%s_500k_%s.sort.geojson | gzip > ' % (config['census_vintage'],db_config['SRID'])+\
                         config['temp_speed_geojson_path']+'counties_500k_%s.geojson.gz' % u_speed)
 
                 elif file_type == 'tract':
                     my_message = '%s - STEP 6 (%s - %s): %s CREATING TRACT DATA (FOR ZOOM 5-8) FOR %s SPEED'
-                    os.system('time tippecanoe-json-tool -c '+\
+                    runTileCommand(output_queue, 'time tippecanoe-json-tool -c '+\
                         config['temp_csvs_dir_path']+'tract_numprov/tract_numprov_sort_round_%s_%s.csv ' % (speed, config['fbd_vintage']) +\
                         config['temp_speed_geojson_path']+'tract_%s_500k_%s.sort.geojson | gzip > ' % (config['census_vintage'],db_config['SRID'])+\
                         config['temp_speed_geojson_path']+'tracts_500k_%s.geojson.gz' % u_speed)
 
                 elif file_type == 'not big':
                     my_message = '%s - STEP 6 (%s - %s): %s CREATING NOT-BIG TRACT DATA (FOR ZOOM 9) FOR %s SPEED'
-                    os.system('time tippecanoe-json-tool -c '+\
+                    runTileCommand(output_queue, 'time tippecanoe-json-tool -c '+\
                         config['temp_csvs_dir_path']+'tract_numprov/tract_numprov_sort_round_%s_%s.csv ' % (speed, config['fbd_vintage']) +\
                         config['temp_speed_geojson_path']+'notbig_tracts_5e8_%s_%s.sort.geojson | gzip > ' % (config['census_vintage'],db_config['SRID'])+\
                         config['temp_speed_geojson_path']+'tracts_%s.geojson.gz' % u_speed)
 
                 elif file_type == 'big':
                     my_message = '%s - STEP 6 (%s - %s): %s CREATING LARGE TRACT DATA (FOR ZOOM 9) FOR %s SPEED'
-                    os.system('time tippecanoe-json-tool -c '+\
+                    runTileCommand(output_queue, 'time tippecanoe-json-tool -c '+\
                         config['temp_csvs_dir_path']+'block_numprov/block_numprov_%s_%s.csv ' % (speed, config['fbd_vintage']) +\
                         config['temp_speed_geojson_path']+'bigtract_blocks_5e8_%s_%s.sort.geojson | gzip > ' % (config['census_vintage'],db_config['SRID'])+\
                         config['temp_speed_geojson_path']+'big_tract_blocks_%s.geojson.gz' % u_speed)
 
                 elif file_type == 'block':
                     my_message = '%s - STEP 6 (%s - %s): %s CREATING BLOCK DATA (FOR ZOOM 11) FOR %s SPEED'
-                    os.system('time tippecanoe-json-tool -c '+\
+                    runTileCommand(output_queue, 'time tippecanoe-json-tool -c '+\
                         config['temp_csvs_dir_path']+'block_numprov/block_numprov_%s_%s.csv ' % (speed, config['fbd_vintage']) +\
                         config['temp_speed_geojson_path']+'block_us_%s.sort.geojson| gzip > ' % config['census_vintage']+\
                         config['temp_speed_geojson_path']+'blocks_%s.geojson.gz' % u_speed)
@@ -142,26 +170,26 @@ def genZoomTiles(input_queue, output_queue, config, db_config):
                 temp_time = time.localtime()
                 if file_type == 'county':
                     my_message = '%s - STEP 6 (%s - %s): %s CREATING MAP BOX TILES FOR ZOOM 0-4 (COUNTIES) FOR %s SPEED'
-                    os.system('gzip -dc '+config['temp_speed_geojson_path']+'counties_500k_%s.geojson.gz ' % u_speed +\
+                    runTileCommand(output_queue, 'gzip -dc '+config['temp_speed_geojson_path']+'counties_500k_%s.geojson.gz ' % u_speed +\
                         '| time tippecanoe -P -Z 0 -z 4 --detect-shared-borders -l %s_%s -x geoid%s -f -o ' % (config['fbd_vintage'],u_speed,config['census_vintage'][2:]) +\
                         config['temp_mbtiles_path']+'county_%s.mbtiles 2>&1 | tee ../logs/county_%s.log' % (u_speed, u_speed))
 
                 elif file_type == 'tract_z5':
                     my_message = '%s - STEP 6 (%s - %s): %s CREATING MAP BOX TILES FOR ZOOM 5 (TRACTS, WITH COALESCE AS NEEDED) FOR %s SPEED'
-                    os.system('gzip -dc '+config['temp_speed_geojson_path']+'tracts_500k_%s.geojson.gz ' % u_speed +\
+                    runTileCommand(output_queue, 'gzip -dc '+config['temp_speed_geojson_path']+'tracts_500k_%s.geojson.gz ' % u_speed +\
                         '| time tippecanoe -P -Z 5 -z 5 -S 8 --detect-shared-borders --coalesce ' +\
                         '--coalesce-smallest-as-needed -l %s_%s -x tract_id -f -o ' % (config['fbd_vintage'],u_speed)+\
                         config['temp_mbtiles_path']+'tract_z5_%s.mbtiles 2>&1 | tee ../logs/tract_z5_%s.log' % (u_speed, u_speed))
 
                 elif file_type == 'tract_z6':
                     my_message = '%s - STEP 6 (%s - %s): %s CREATING MAP BOX TILES FOR ZOOM 6-8 (TRACTS) FOR %s SPEED'
-                    os.system('gzip -dc '+config['temp_speed_geojson_path']+'tracts_500k_%s.geojson.gz ' % u_speed +\
+                    runTileCommand(output_queue, 'gzip -dc '+config['temp_speed_geojson_path']+'tracts_500k_%s.geojson.gz ' % u_speed +\
                         '| time tippecanoe -P -Z 6 -z 8 --detect-shared-borders -l %s_%s -x tract_id -f -o ' % (config['fbd_vintage'],u_speed) +\
                         config['temp_mbtiles_path']+'tract_z6_8_%s.mbtiles 2>&1 | tee ../logs/tract_z6_8_%s.log' % (u_speed, u_speed))
                 
                 elif file_type == 'tract_z9':
                     my_message = '%s - STEP 6 (%s - %s): %s CREATING MAP BOX TILES FOR ZOOM 9 (SMALLER TRACTS IN BIG TRACTS) FOR %s SPEED'
-                    os.system('gzip -dc '+config['temp_speed_geojson_path']+'tracts_%s.geojson.gz ' % u_speed +\
+                    runTileCommand(output_queue, 'gzip -dc '+config['temp_speed_geojson_path']+'tracts_%s.geojson.gz ' % u_speed +\
                         '| time tippecanoe -P -Z 9 -z 9 --detect-shared-borders -l %s_%s -x tract_id -f -o ' % (config['fbd_vintage'],u_speed) +\
                         config['temp_mbtiles_path']+'tract_z9_%s.mbtiles 2>&1 | tee ../logs/tract_z9_%s.log' % (u_speed, u_speed))
 
@@ -225,20 +253,20 @@ def genLargeZoomTiles(input_queue, output_queue, config, db_config):
                 temp_time = time.localtime()
                 if file_type == 'block_z9':
                     my_message = '%s - STEP 6 (%s - %s): %s CREATING MAP BOX TILES FOR ZOOM 9 (BLOCKS IN BIG TRACTS) FOR %s SPEED'
-                    os.system('gzip -dc '+config['temp_speed_geojson_path']+'big_tract_blocks_%s.geojson.gz ' % u_speed +\
+                    runTileCommand(output_queue, 'gzip -dc '+config['temp_speed_geojson_path']+'big_tract_blocks_%s.geojson.gz ' % u_speed +\
                         '| time tippecanoe -P -Z 9 -z 9 --detect-shared-borders -l %s_%s -x geoid%s -f -o ' % (config['fbd_vintage'],u_speed,config['census_vintage'][2:]) +\
                         config['temp_mbtiles_path']+'block_z9_%s.mbtiles 2>&1 | tee ../logs/block_z9_%s.log' % (u_speed, u_speed))
 
                 elif file_type == 'block_z10':
                     my_message = '%s - STEP 6 (%s - %s): %s CREATING MAP BOX TILES FOR ZOOM 10 (BLOCKS, WITH SIMPLIFICATION AS NEEDED) FOR %s SPEED'
-                    os.system('gzip -dc '+config['temp_speed_geojson_path']+'blocks_%s.geojson.gz ' % u_speed +\
+                    runTileCommand(output_queue, 'gzip -dc '+config['temp_speed_geojson_path']+'blocks_%s.geojson.gz ' % u_speed +\
                         '| time tippecanoe -P -Z 10 -z 10 -S 8 --detect-shared-borders -l %s_%s --coalesce ' % (config['fbd_vintage'],u_speed) +\
                         '--coalesce-smallest-as-needed -x geoid%s -f -o ' % config['census_vintage'][2:] +\
                         config['temp_mbtiles_path']+'block_z10_%s.mbtiles 2>&1 | tee ../logs/block_z10_%s.log' % (u_speed, u_speed))
 
                 elif file_type == 'block_z11':
                     my_message = '%s - STEP 6 (%s - %s): %s CREATING MAP BOX TILES FOR ZOOM 11+ (BLOCKS, WITH HIGHER DETAIL AT HIGHEST ZOOM VIA -d) FOR %s SPEED'
-                    os.system('gzip -dc '+config['temp_speed_geojson_path']+'blocks_%s.geojson.gz ' % u_speed +\
+                    runTileCommand(output_queue, 'gzip -dc '+config['temp_speed_geojson_path']+'blocks_%s.geojson.gz ' % u_speed +\
                         '| time tippecanoe -P -Z 11 -z 14 -d 14 --detect-shared-borders -l %s_%s -f -o ' % (config['fbd_vintage'],u_speed) +\
                         config['temp_mbtiles_path']+'block_z11_14_%s.mbtiles 2>&1 | tee ../logs/block_z11_14_%s.log' % (u_speed, u_speed))
 
@@ -299,7 +327,7 @@ def genInterimTiles(input_queue, output_queue, config, db_config):
                 temp_time = time.localtime()
                 if file_type == 'interim':
                     my_message = '%s - STEP 6 (%s - %s): %s COMBINING FILES INTO ONE MBTILE FILE FOR SPEED %s'
-                    os.system('tile-join -n %s_%s -o ' % (config['fbd_vintage'],u_speed) +\
+                    runTileCommand(output_queue, 'tile-join -n %s_%s -o ' % (config['fbd_vintage'],u_speed) +\
                         config['output_mbtiles_path']+'%s_%s.mbtiles -f ' % (config['fbd_vintage'],u_speed) +\
                         config['temp_mbtiles_path']+'county_%s.mbtiles ' % u_speed +\
                         config['temp_mbtiles_path']+'tract_z5_%s.mbtiles ' % u_speed +\
@@ -367,28 +395,28 @@ def genPrepProviderTiles(input_queue, output_queue, config, db_config):
                 temp_time = time.localtime()
                 if file_type == 'large7':
                     my_message = '%s - STEP 6 (%s - %s): %s MAKING ZOOM 0 - 7 LARGE PROVIDER FILE'
-                    os.system('tippecanoe -P -Z 0 -z 7 -S 8 -x county_fips --preserve-input-order ' +\
+                    runTileCommand(output_queue, 'tippecanoe -P -Z 0 -z 7 -S 8 -x county_fips --preserve-input-order ' +\
                         '--coalesce --detect-shared-borders -l %s_prov_lg -f -o ' % config['fbd_vintage'] +\
                         config['temp_mbtiles_path']+'%s_prov_lg_z0_7.mbtiles ' % config['fbd_vintage'] +\
                         config['temp_speed_geojson_path']+'%s_prov_lg.geojson 2>&1 | tee ../logs/prov_large_z7.log' % config['fbd_vintage'])
 
                 elif file_type == 'large12':
                     my_message = '%s - STEP 6 (%s - %s): %s MAKING ZOOM 8 - 12 LARGE PROVIDER FILE'
-                    os.system('tippecanoe -P -Z 8 -z 12 -x county_fips --preserve-input-order ' +\
+                    runTileCommand(output_queue, 'tippecanoe -P -Z 8 -z 12 -x county_fips --preserve-input-order ' +\
                         '--coalesce -d 14 --detect-shared-borders -l %s_prov_lg -f -o ' % config['fbd_vintage'] +\
                         config['temp_mbtiles_path']+'%s_prov_lg_z8_12.mbtiles ' % config['fbd_vintage'] +\
                         config['temp_speed_geojson_path']+'%s_prov_lg.geojson 2>&1 | tee ../logs/prov_large.log' % config['fbd_vintage']) 
 
                 elif file_type == 'other8':
                     my_message = '%s - STEP 6 (%s - %s): %s MAKING ZOOM 0 - 8 OTHER PROVIDER FILE'
-                    os.system('tippecanoe -P -Z 0 -z 8 -S 8 -x county_fips --preserve-input-order ' +\
+                    runTileCommand(output_queue, 'tippecanoe -P -Z 0 -z 8 -S 8 -x county_fips --preserve-input-order ' +\
                         '--coalesce --detect-shared-borders -l %s_prov_other -f -o ' % config['fbd_vintage'] +\
                         config['temp_mbtiles_path']+'%s_prov_other_z0_8.mbtiles ' % config['fbd_vintage'] +\
                         config['temp_speed_geojson_path']+'%s_prov_other.geojson 2>&1 | tee ../logs/prov_other_z7.log' % config['fbd_vintage']) 
 
                 elif file_type == 'other12':
                     my_message = '%s - STEP 6 (%s - %s): %s MAKING ZOOM 9 - 12 OTHER PROVIDER FILE'
-                    os.system('tippecanoe -P -Z 9 -z 12 -x county_fips --preserve-input-order ' +\
+                    runTileCommand(output_queue, 'tippecanoe -P -Z 9 -z 12 -x county_fips --preserve-input-order ' +\
                         '--coalesce -d 14 --detect-shared-borders -l %s_prov_other -f -o ' % config['fbd_vintage'] +\
                         config['temp_mbtiles_path']+'%s_prov_other_z9_12.mbtiles ' % config['fbd_vintage'] +\
                         config['temp_speed_geojson_path']+'%s_prov_other.geojson 2>&1 | tee ../logs/prov_other.log' % config['fbd_vintage']) 
@@ -449,21 +477,21 @@ def genFinalTiles(input_queue, output_queue, config, db_config):
                 temp_time = time.localtime()
                 if file_type == 'other':
                     my_message = '%s - STEP 6 (%s - %s): %s MAKING FINAL OTHER PROVIDER MAP BOX TILE'
-                    os.system('tile-join -n other_prov -o '+\
+                    runTileCommand(output_queue, 'tile-join -n other_prov -o '+\
                         config['output_mbtiles_path']+'%s_prov_other.mbtiles -f ' % config['fbd_vintage'] +\
                         config['temp_mbtiles_path']+'%s_prov_other_z0_8.mbtiles ' % config['fbd_vintage'] +\
                         config['temp_mbtiles_path']+'%s_prov_other_z9_12.mbtiles' % config['fbd_vintage']) 
                 
                 elif file_type == 'large':
                     my_message = '%s - STEP 6 (%s - %s): %s MAKING FINAL LARGE PROVIDER MAP BOX TILE'
-                    os.system('tile-join -n large_prov -o '+\
+                    runTileCommand(output_queue, 'tile-join -n large_prov -o '+\
                         config['output_mbtiles_path']+'%s_prov_lg.mbtiles -f ' % config['fbd_vintage'] +\
                         config['temp_mbtiles_path']+'%s_prov_lg_z0_7.mbtiles ' % config['fbd_vintage'] +\
                         config['temp_mbtiles_path']+'%s_prov_lg_z8_12.mbtiles' % config['fbd_vintage'] )
                 
                 elif file_type == 'xlarge':
                     my_message = '%s - STEP 6 (%s - %s): %s MAKING INTERIM XLARGE BLOCKS MAP BOX TILE'
-                    os.system('tippecanoe -P -Z 5 -z 9 -d 14 -x min_zoom --detect-shared-borders -l '+\
+                    runTileCommand(output_queue, 'tippecanoe -P -Z 5 -z 9 -d 14 -x min_zoom --detect-shared-borders -l '+\
                         'xlarge_blocks_%s -f -o ' % config['census_vintage'] +\
                         config['output_mbtiles_path']+'xlarge_blocks_%s.mbtiles '  % config['census_vintage'] +\
                         config['temp_speed_geojson_path']+'xlarge_blocks_%s.geojson ' % config['census_vintage'] +\
@@ -1,7 +1,9 @@
+from concurrent.futures import ThreadPoolExecutor
 import NBM2_functions as nbmf 
 import sqlalchemy as sal
 import traceback
 import time
+import csv
 import os
 import gc 
 
@@ -35,7 +37,7 @@ def processWork(config, input_queue, output_queue, file_count, start_time):
     # continue until all speed files have been created
     while counter < file_count:
         try:
-            message = output_queue.get_nowait()
+            message = output_queue.get(timeout=config['queue_timeouts']['result_seconds'])
             # message[0] is the type of message received
             # message[1] is the message
             # message[2] is the temp_time value
@@ -86,45 +88,112 @@ def processWork(config, input_queue, output_queue, file_count, start_time):
                 break
 
         except:
-            # there is no message so wait and try again
-            time.sleep(1)
+            # no message arrived before the timeout - wait again
+            pass
 
+    # close the stage and wait for the workers still running to finish
+    nbmf.closeStage(config, input_queue, start_time)
+    gc.collect()
+    return continue_run
 
-    # flush the queue with sentinals (poison pills)
-    for _ in range(1000):
-        input_queue.put_nowait((None,None))
+def readCountyBlockCounts(config):
+    """
+    reads the number of blocks in each county from the county fips file
+    written in task 5.  Used to queue the largest counties first
 
-    # clear out the output queue just for good bookeeping nothing
-    for _ in range(output_queue.qsize()):
-        try:
-            output_queue.get_nowait()
-        except:
-            pass
+    Arguments In:
+        config:         the json variable that contains all configration
+                        data required for the data processing
 
-    # clear out any remaining tasks in the input queue that are not sentinals
-    while input_queue.qsize() > 1000:
-        try:
-            input_queue.get_nowait()
-        except:
-            pass
-    
-    # wait a few seconds while the servants process the sentinals
-    time.sleep(10)
+    Arguments Out:
+        block_counts:   a dictionary keyed by county FIPS that contains the
+                        number of blocks in the county
+    """
+    block_counts = {}
+    with open(config['temp_csvs_dir_path']+'county_fips.csv','r') as my_file:
+        for row in csv.reader(my_file):
+            if len(row) > 1:
+                block_counts[row[0]] = int(row[1])
+    return block_counts
+
+def readStateFips(config):
+    """
+    reads the state FIPS codes of the counties in the county fips file 
+    written in task 5
 
+    Arguments In:
+        config:         the json variable that contains all configration
+                        data required for the data processing
 
-    # clear the input queue of any remaining sentinals
-    for _ in range(input_queue.qsize()):
-        try:
-            input_queue.get_nowait()
-        except:
-            pass
-    gc.collect()
-    return continue_run
+    Arguments Out:
+        state_fips:     a sorted list of the two digit state FIPS codes
+    """
+    state_fips = set()
+    with open(config['temp_csvs_dir_path']+'county_fips.csv','r') as my_file:
+        for row in csv.reader(my_file):
+            if len(row) > 0:
+                state_fips.add(row[0][:2])
+    return sorted(state_fips)
+
+def statePartitionsSQL(table_name, state_fips):
+    """
+    creates the partitions of a table that is list partitioned by state
+    FIPS: one partition per state and a default partition for anything 
+    else, so statements that filter on a single state only read its 
+    partition
+
+    Arguments In:
+        table_name:     the schema qualified name of the partitioned table
+        state_fips:     a list of the two digit state FIPS codes
+
+    Arguments Out:
+        sql_string:     the statements that create the partitions
+    """
+    sql_string = ''
+    for s in state_fips:
+        sql_string += """
+            CREATE TABLE {0}_{1} PARTITION OF {0} FOR VALUES IN ('{1}'); 
+            """.format(table_name, s)
+    sql_string += """
+        CREATE TABLE {0}_default PARTITION OF {0} DEFAULT; COMMIT;
+        """.format(table_name)
+    return sql_string
+
+def subdivideSQL(config, db_config, shape_type):
+    """
+    creates the statements that split a geography (tribe, place or congress)
+    into small pieces with ST_Subdivide and index them.  Step 0 task 7 uses
+    the pieces for the interior test of the overlays and step 0 task 8 for 
+    the KNN search of the congressional districts
+
+    Arguments In:
+        config:         the json variable that contains all configration
+                        data required for the data processing
+        db_config:      a dictionary that contains the configuration
+                        information for the database and queue
+        shape_type:     the geography to subdivide (e.g., 'congress')
+
+    Arguments Out:
+        subdivided_table:   the schema qualified name of the subdivided table
+        sql_string:         the statements that create the table
+    """
+    with open(config['sql_files_path']+'subdivide.sql', 'r' ) as my_file:
+        sql_string = my_file.read().replace('\n','')
+    subdivided_table = "{0}.nbm2_{1}_subdivided_{2}"\
+                .format(db_config['db_schema'], shape_type, 
+                        config['geometry_vintage'])
+    shape_table = "{0}.nbm2_{1}_{2}"\
+                .format(db_config['db_schema'], shape_type, 
+                        config['geometry_vintage'])
+    columns = ', '.join(config['spatial_subdivide']['columns'][shape_type])
+    sql_string = sql_string.format(subdivided_table, shape_table, columns, 
+                        config['spatial_subdivide']['max_vertices'])
+    return subdivided_table, sql_string
 
 def modifyGeoTables(config, db_config, data_type, index_list, start_time):
     """
-    modifies the structure of the geomoetry tables so they are consistent
-    with each other and can be used in later processes
+    indexes the block and place geometry tables once they are loaded so they
+    can be used in later processes
 
     Arguments In:
         config:			the json variable that contains all configration
@@ -177,117 +246,41 @@ def modifyGeoTables(config, db_config, data_type, index_list, start_time):
                 time.mktime(time.localtime()) - time.mktime(start_time)))
         return False
 
-    with engine.connect() as conn, conn.begin():
-        try:
-            # change the data type in the table from text to multipolygon
-            sql_string = """
-                ALTER TABLE {0}.nbm2_{1}_{2} ALTER COLUMN {3} 
-                TYPE Geometry(MULTIPOLYGON, {4}) 
-                USING ST_SetSRID({3}::Geometry, {4}); COMMIT;
-                """.format(db_config['db_schema'], data_type, vintage, 
-                            "geometry", db_config['SRID'])
-            conn.execute(sql_string)
-
-            my_message = """
-                INFO - STEP 0 (MASTER): TASK 4 OF 13 - SUCCESSFULLY CHANGED 
-                GEOMETRY TO MULTIPOLYGON FOR {0}
-                """.format(data_type.upper())
-            my_message = ' '.join(my_message.split())
-            print(nbmf.logMessage(my_message,temp_time, time.localtime(), 
-                    time.mktime(time.localtime()) - time.mktime(start_time)))
-        except:
-            my_message = """
-                ERROR - STEP 0 (MASTER): TASK 4 OF 13 - FAILED CHANGING 
-                GEOMETRY TO MULTIPOLYGON FOR {0}
-                """.format(data_type.upper())
-            my_message += '\n%s' % traceback.format_exc()
-            print(nbmf.logMessage(my_message,temp_time, time.localtime(), 
-                    time.mktime(time.localtime()) - time.mktime(start_time)))
-            return False
-
-        try:
-            pass
-            # rename the auto increment field from 'index" to '"GID"'
-            sql_string = """
-                ALTER TABLE {0}.nbm2_{1}_{2} RENAME COLUMN {3} TO {4}; COMMIT;
-                """.format(db_config['db_schema'], data_type, vintage, 
-                            'index', '"GID"')
-            conn.execute(sql_string)
-
-            my_message = """
-                INFO - STEP 0 (MASTER): TASK 4 OF 13 - SUCCESSFULLY CHANGED
-                "index" TO "GID" FOR {0}
-                """.format(data_type.upper())
-            my_message = ' '.join(my_message.split())
-            print(nbmf.logMessage(my_message,temp_time, time.localtime(), 
-                    time.mktime(time.localtime()) - time.mktime(start_time)))
-
-        except: 
-            my_message = """
-                ERROR - STEP 0 (MASTER): TASK 4 OF 13 - FAILED CHANGING
-                "index" TO "GID" FOR {0}
-                """.format(data_type.upper())
-            my_message += '\n%s' % traceback.format_exc()
-            print(nbmf.logMessage(my_message,temp_time, time.localtime(), 
-                    time.mktime(time.localtime()) - time.mktime(start_time)))
-            return False
-
-        try:
-            pass
-            # rename the 'geometry' field to '"GEOMETRY"'.  The shape files 
-            # have all capital letters in them.  This routine just makes all
-            # fields have a consistent naming convention
-            sql_string = """
-                ALTER TABLE {0}.nbm2_{1}_{2} RENAME COLUMN {3} TO {4}; COMMIT;
-                """.format( db_config['db_schema'], data_type, vintage, 
-                            'geometry', '"GEOMETRY"')
+    # the geometry column is typed (MULTIPOLYGON) and the "GID" and 
+    # "GEOMETRY" columns are named when the shape files are loaded (see
+    # NBM2_bulk_load), so only the indexes are left to be built.  Each index
+    # is built on its own connection so they are built at the same time
+    def createIndex(idx):
+        if idx == '"GEOMETRY"':
+            idx_type = 'gist'
+        else:
+            idx_type = 'btree'
+        sql_string = """
+            CREATE INDEX ON {0}.nbm2_{1}_{2} USING {4}({3}); COMMIT;
+            """.format(db_config['db_schema'], data_type, vintage, 
+                        idx, idx_type)
+        with engine.connect() as conn, conn.begin():
             conn.execute(sql_string)
-            my_message = """
-                INFO - STEP 0 (MASTER): TASK 4 OF 13 - SUCCESSFULLY CHANGED 
-                "geometry" TO "GEOMETRY" FOR {0}
-                """.format(data_type.upper())
-            my_message = ' '.join(my_message.split())
-            print(nbmf.logMessage(my_message,temp_time, time.localtime(), 
-                    time.mktime(time.localtime()) - time.mktime(start_time)))
 
-        except:
-            my_message = """
-                ERROR - STEP 0 (MASTER): TASK 4 OF 13 - FAILED CHANGING 
-                "geometry" TO "GEOMETRY" FOR {0}
-                """.format(data_type.upper())
-            my_message += '\n%s' % traceback.format_exc()
-            print(nbmf.logMessage(my_message,temp_time, time.localtime(), 
-                    time.mktime(time.localtime()) - time.mktime(start_time)))
-            return False
-
-        try:
-            # create the index on columns specific to the two tables
-            for idx in index_list:
-                if idx == '"GEOMETRY"':
-                    idx_type = 'gist'
-                else:
-                    idx_type = 'btree'
-                sql_string = """
-                    CREATE INDEX ON {0}.nbm2_{1}_{2} USING {4}({3}); COMMIT;
-                    """.format(db_config['db_schema'], data_type, vintage, 
-                                idx, idx_type)
-                conn.execute(sql_string)
-            my_message = """
-                INFO - STEP 0 (MASTER): TASK 4 OF 13 - SUCCESSFULLY CREATED 
-                INDEX FOR {0}
-                """.format(data_type.upper())
-            my_message = ' '.join(my_message.split())
-            print(nbmf.logMessage(my_message,temp_time, time.localtime(), 
-                    time.mktime(time.localtime()) - time.mktime(start_time)))
-        except:
-            my_message = """
-                ERROR - STEP 0 (MASTER): TASK 4 OF 13 - FAILED CREATING INDEX 
-                FOR {0}
-                """.format(data_type.upper())
-            my_message += '\n%s' % traceback.format_exc()
-            print(nbmf.logMessage(my_message,temp_time, time.localtime(), 
-                    time.mktime(time.localtime()) - time.mktime(start_time)))
-            return False
+    try:
+        with ThreadPoolExecutor(max(1, len(index_list))) as pool:
+            list(pool.map(createIndex, index_list))
+        my_message = """
+            INFO - STEP 0 (MASTER): TASK 4 OF 13 - SUCCESSFULLY CREATED 
+            INDEX FOR {0}
+            """.format(data_type.upper())
+        my_message = ' '.join(my_message.split())
+        print(nbmf.logMessage(my_message,temp_time, time.localtime(), 
+                time.mktime(time.localtime()) - time.mktime(start_time)))
+    except:
+        my_message = """
+            ERROR - STEP 0 (MASTER): TASK 4 OF 13 - FAILED CREATING INDEX 
+            FOR {0}
+            """.format(data_type.upper())
+        my_message += '\n%s' % traceback.format_exc()
+        print(nbmf.logMessage(my_message,temp_time, time.localtime(), 
+                time.mktime(time.localtime()) - time.mktime(start_time)))
+        return False
 
     my_message = """
         INFO - STEP 0 (MASTER): TASK 4 OF 13 - COMPLETED CHANGING STRUCTURE FOR
@@ -2,7 +2,6 @@ import NBM2_functions as nbmf
 import traceback
 import psycopg2
 import time
-import csv
 import gc 
 
 def createDBConnections(config, db_config, start_time):
@@ -150,28 +149,16 @@ def saveBlockMasterCSV(my_cursor, config, db_config, start_time):
     try:
         temp_time = time.localtime()
 
-        # get header names
+        # stream the table straight into the csv file.  The rows are never
+        # held by the master, so its memory stays flat however large the 
+        # table is
         sql_string = """
-            SELECT column_name
-            FROM information_schema.columns
-            WHERE table_schema = '%s' AND table_name = 'nbm2_block_master_%s'
-            """ % ( db_config['db_schema'], config['fbd_vintage'] )
-        my_cursor.execute(sql_string)
-        header = [str(x[0]) for x in my_cursor.fetchall()]
-
-        # get data from table
-        sql_string = "SELECT * FROM %s.nbm2_block_master_%s" %\
-                    (db_config['db_schema'],config['fbd_vintage'])
-
-        my_cursor.execute(sql_string)
-        result = my_cursor.fetchall()
-
-        # write data to csv file
+            COPY (SELECT * FROM %s.nbm2_block_master_%s) 
+            TO STDOUT WITH CSV HEADER
+            """ % (db_config['db_schema'],config['fbd_vintage'])
         with open(config['input_csvs_path']+"blockmaster_%s.csv" %\
-                    config['fbd_vintage'], 'w') as my_file:
-            block_master_file = csv.writer(my_file)
-            block_master_file.writerow(header)
-            block_master_file.writerows(result)
+                    config['fbd_vintage'], 'w', encoding='utf-8') as my_file:
+            my_cursor.copy_expert(sql_string, my_file, size=1 << 20)
         
         # close out work
         my_message = """
@@ -181,7 +168,6 @@ def saveBlockMasterCSV(my_cursor, config, db_config, start_time):
         my_message = ' '.join(my_message.split())
         print(nbmf.logMessage(my_message.strip(),temp_time,time.localtime(), 
                 time.mktime(time.localtime()) - time.mktime(start_time)))
-        del block_master_file
         gc.collect()
         return True
 
@@ -153,43 +153,61 @@ def updateBoundingBox(my_cursor, config, db_config, start_time):
                 time.mktime(time.localtime()) - time.mktime(start_time))) 
         return False
 
+def floatText(expression):
+    """
+    formats a numeric sql expression the way python writes a float (e.g., 
+    -88.0 rather than -88), so the lookup file keeps the format it had when
+    the values were converted in python
+
+    Arguments In:
+        expression:     a sql expression of a numeric value
+
+    Arguments Out:
+        sql_string:     a sql expression of the text of the value
+    """
+    return """(CASE WHEN {0} = trunc({0}) THEN trunc({0})::text || '.0' 
+                ELSE ({0})::float8::text END)""".format(expression)
+
 def writeLookupCSV(my_conn, my_cursor, config, db_config, start_time):
     try:
         temp_time = time.localtime()
-        # read in data from nbm2_lookup_xxxx table
-        sql_string = "SELECT * FROM {0}.nbm2_lookup_{1}".\
-                    format(db_config['db_schema'],config['geometry_vintage'])
-        my_cursor.execute(sql_string)
-        result = my_cursor.fetchall()
-        data = []
-        for r in result:
-            year = str(r[0])
-            lng = float(str(r[4]))
-            lat = float(str(r[5]))
-            hold = list(r[6])       
-            hold = '{'+",".join([str(float(str(x))) for x in hold])+'}'
-            data.append((year,r[1],r[2],r[3],lng,lat,hold))
-        headers = ['year','geoid','type','name','centroid_lng','centroid_lat','bbox_arr']
-        lookup_new = pd.DataFrame.from_records(data,columns=headers)
-
+        # the rows of this vintage are formatted and sorted by the database
+        # and streamed straight into the file.  The bounding box is written
+        # as {xmin,ymin,xmax,ymax}
+        type_order = ['state','place','county','cd','cbsa','tribal']
+        sql_string = """
+            COPY (
+                SELECT year::text AS year, geoid, type, name, 
+                    {2} AS centroid_lng, {3} AS centroid_lat,
+                    '{{' || array_to_string(ARRAY(SELECT {4} 
+                        FROM unnest(bbox_arr) WITH ORDINALITY AS b(x, i) 
+                        ORDER BY i), ',') || '}}' AS bbox_arr
+                FROM {0}.nbm2_lookup_{1}
+                ORDER BY year DESC, array_position(ARRAY[{5}]::text[], 
+                    type::text), geoid COLLATE "C"
+            ) TO STDOUT WITH CSV HEADER
+            """.format(db_config['db_schema'], config['geometry_vintage'],
+                        floatText('centroid_lng'), floatText('centroid_lat'),
+                        floatText('b.x'), 
+                        ','.join("'%s'" % t for t in type_order))
+        file_name = config['output_dir_path']+'%s_Geography_Lookup_Table.csv' %\
+                    config['geometry_vintage']
+        with open(file_name, 'w', encoding='utf-8') as my_file:
+            my_cursor.copy_expert(sql_string, my_file)
 
         try:
-            # read in data from the previous geometry vintage
+            # read in data from the previous geometry vintage.  Its years
+            # come before this vintage, so its rows follow the new ones
             lookup_old = pd.read_csv(config['input_csvs_path']+config['previous_lookup_table'])
-            # concatenate the two dataframes together
-            lookup_df = pd.concat([lookup_new,lookup_old])
+            lookup_old['type'] = pd.Categorical(lookup_old['type'],type_order)
+            lookup_old.sort_values(['year','type','geoid'],
+                                    ascending = [False, True, True], inplace = True)
+            lookup_old.to_csv(file_name, mode='a', header=False, 
+                                encoding='utf-8', index=False)
         except:
             # there was an issue ingesting the previous data frame, by design
             # it may be a place holder and does not really exist
-            lookup_df = lookup_new
-
-        lookup_df['type'] = pd.Categorical(lookup_df['type'],['state','place','county','cd','cbsa','tribal'])
-        lookup_df.sort_values(['year','type','geoid'],ascending = [False, True, True], inplace = True)
-
-        # write out file using uft-8 format
-        file_name = config['output_dir_path']+'%s_Geography_Lookup_Table.csv' %\
-                    config['geometry_vintage']
-        lookup_df.to_csv(file_name, encoding='utf-8',index=False)
+            pass
 
         my_message = """
             INFO - STEP 0 (MASTER): TASK 12 OF 13 - SUCCESSFULLY WROTE  
@@ -1,9 +1,13 @@
+from concurrent.futures import ThreadPoolExecutor
 import NBM2_functions as nbmf
 import step0_functions as s0f
 import traceback
 import psycopg2
+import shutil
 import time
+import re
 import csv
+import os
 import gc 
 
 def getCounty_fips(config, start_time):
@@ -50,17 +54,44 @@ def getCounty_fips(config, start_time):
             time.mktime(time.localtime()) - time.mktime(start_time)))
         return False, None
 
-def loadFBDQueue(input_queue, county_fips, config, start_time):
+def fbdByteRanges(fbd_file, range_bytes):
     """
-    loads the input queue with the county information so the distributed 
-    workers can access the information
+    splits the fixed broadband data file into byte ranges of about 
+    range_bytes.  Each range starts at the beginning of a line (the first
+    one right after the header) and ends at the beginning of the next range,
+    so the ranges can be read independently and together hold every line 
+    once
+
+    Arguments In:
+        fbd_file:       the path to the fbd csv
+        range_bytes:    the approximate size of a range in bytes
+
+    Arguments Out:
+        byte_ranges:    a list of (start, end) byte offsets
+    """
+    file_size = os.path.getsize(fbd_file)
+    with open(fbd_file, 'rb') as my_file:
+        my_file.readline()
+        boundaries = [my_file.tell()]
+        while boundaries[-1] + range_bytes < file_size:
+            my_file.seek(boundaries[-1] + range_bytes)
+            my_file.readline()
+            if my_file.tell() >= file_size:
+                break
+            boundaries.append(my_file.tell())
+    boundaries.append(file_size)
+    return [(boundaries[i], boundaries[i+1]) for i in range(len(boundaries)-1)
+            if boundaries[i+1] > boundaries[i]]
+
+def loadFBDQueue(input_queue, config, start_time):
+    """
+    loads the input queue with the byte ranges of the fbd file so the 
+    distributed workers read the file once between them
 
     Arguments In:
         input_queue:    a multiprocessing queue that can be shared across
                         multiple servers and cores.  All information to be
                         processed is loaded into the queue
-        county_fips:    a list of county FIPS codes used to parse large
-                        data objects into smaller county level packages                            
         config:         a dictionary that contains the configuration
                         information of various steps of NMB2 data 
                         processing
@@ -77,14 +108,26 @@ def loadFBDQueue(input_queue, county_fips, config, start_time):
     """
     try:
         temp_time = time.localtime()
+
+        # part files left by an earlier run would be joined into the county
+        # files, unless this run resumes the stage and keeps them
+        part_path = config['temp_csvs_dir_path']+'county_fbd/parts/'
+        if not (config['task_ledger']['resume_run'] and 
+                input_queue.completedTasks('parse_fbd') > 0):
+            shutil.rmtree(part_path, ignore_errors=True)
+        os.makedirs(part_path, exist_ok=True)
+
+        fbd_file = config['input_csvs_path']+config['fbData']
+        byte_ranges = fbdByteRanges(fbd_file, 
+                                config['fbd_partition']['range_mb'] << 20)
         file_count = 0
-        for c in county_fips:
-            input_queue.put((c))
+        for r in byte_ranges:
+            input_queue.put(r)
             file_count += 1
         my_message = """
             INFO - STEP 0 (MASTER): TASK 13 OF 13 - COMPLETED LOADING INPUT 
-            QUEUE WITH COUNTY DATA
-            """
+            QUEUE WITH %s BYTE RANGES OF THE FBD DATA
+            """ % file_count
         my_message = ' '.join(my_message.split())
         print(nbmf.logMessage(my_message,temp_time, time.localtime(), 
             time.mktime(time.localtime()) - time.mktime(start_time)))
@@ -93,13 +136,80 @@ def loadFBDQueue(input_queue, county_fips, config, start_time):
     except:
         my_message = """
             ERROR - STEP 0 (MASTER): TASK 13 OF 13 - FAILED LOADING QUEUE WITH
-            COUNTY DATA
+            FBD DATA
             """
         my_message = ' '.join(my_message.split()) + '\n' + traceback.format_exc()
         print(nbmf.logMessage(my_message,temp_time, time.localtime(), 
             time.mktime(time.localtime()) - time.mktime(start_time)))
         return False, None
 
+def joinFBDParts(county_fips, config, start_time):
+    """
+    joins the part files the workers wrote for each county into the county 
+    fbd csv.  The parts are already in csv form, so they are copied byte for
+    byte after the header.  Every county gets a file, even if it has no fbd
+    data
+
+    Arguments In:
+        county_fips:    a list of county FIPS codes used to parse large
+                        data objects into smaller county level packages                            
+        config:         a dictionary that contains the configuration
+                        information of various steps of NMB2 data 
+                        processing
+        start_time:     a time structure variable that indicates when 
+                        the current step started
+
+    Arguments Out:
+        continue_run:   a boolean variable that indicates if the routine
+                        successfully completed and whether the next steps
+                        should be exectuted
+    """
+    try:
+        temp_time = time.localtime()
+        part_path = config['temp_csvs_dir_path']+'county_fbd/parts/'
+        header = (','.join(config['fbd_data_columns']) + '\n').encode('utf-8')
+
+        # the part names end with the byte offset of their range, so sorting
+        # them keeps the rows in the order of the fbd file.  A worker that 
+        # was stopped before it renamed its part leaves a temporary file 
+        # behind - it is removed rather than joined
+        parts = {}
+        for part_name in sorted(os.listdir(part_path)):
+            if re.fullmatch(r'fbd_df_\d{5}_\d{12}\.csv', part_name):
+                parts.setdefault(part_name[7:12], []).append(part_name)
+            elif '.tmp' in part_name:
+                nbmf.silentDelete(part_path + part_name)
+
+        def joinCounty(c):
+            fbd_name = config['temp_csvs_dir_path']+'county_fbd/fbd_df_%s.csv' % c
+            with open(nbmf.atomicName(fbd_name), 'wb') as my_file:
+                my_file.write(header)
+                for part_name in parts.get(c, []):
+                    with open(part_path + part_name, 'rb') as part_file:
+                        shutil.copyfileobj(part_file, my_file, 1 << 20)
+            os.replace(nbmf.atomicName(fbd_name), fbd_name)
+
+        with ThreadPoolExecutor(config['fbd_partition']['join_threads']) as pool:
+            list(pool.map(joinCounty, county_fips))
+
+        my_message = """
+            INFO - STEP 0 (MASTER): TASK 13 OF 13 - COMPLETED JOINING THE FBD
+            DATA OF %s COUNTIES
+            """ % len(county_fips)
+        my_message = ' '.join(my_message.split())
+        print(nbmf.logMessage(my_message,temp_time, time.localtime(), 
+            time.mktime(time.localtime()) - time.mktime(start_time)))
+        return True
+
+    except:
+        my_message = """
+            ERROR - STEP 0 (MASTER): TASK 13 OF 13 - FAILED JOINING THE COUNTY
+            FBD DATA
+            """
+        my_message = ' '.join(my_message.split()) + '\n' + traceback.format_exc()
+        print(nbmf.logMessage(my_message,temp_time, time.localtime(), 
+            time.mktime(time.localtime()) - time.mktime(start_time)))
+        return False
 
 def parseFBData(input_queue, output_queue, message_queue, config, db_config, 
                 start_time):
@@ -143,19 +253,25 @@ def parseFBData(input_queue, output_queue, message_queue, config, db_config,
 
     continue_run, county_fips = getCounty_fips(config, start_time) 
 
+    # start the distributed workers
+    if continue_run:
+        nbmf.startServants(config, input_queue, message_queue, 'parse_fbd', 
+                            True)
+
     # load queue
     if continue_run:
-        continue_run, file_count = loadFBDQueue(input_queue, county_fips, 
-                                        config, start_time)
+        continue_run, file_count = loadFBDQueue(input_queue, config, 
+                                        start_time)
 
     # process data
     if continue_run:
-        for _ in range(config['number_servers']):
-            message_queue.put('parse_fbd')
-
         continue_run = s0f.processWork(config, input_queue, output_queue, 
                         file_count, start_time)
 
+    # join the parts of each county
+    if continue_run:
+        continue_run = joinFBDParts(county_fips, config, start_time)
+
     # close out 
     if continue_run:
         my_message = """
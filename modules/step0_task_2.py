@@ -1,12 +1,14 @@
+import NBM2_input_manifest as nbim
 import NBM2_functions as nbmf
 from pathlib import Path
 import geopandas as gpd
 import traceback 
-import zipfile 
 import glob
 import time 
+import os
 
-def unzipCriticalFiles(glob_path, target_list, splitter, shape_type, start_time):
+def unzipCriticalFiles(glob_path, target_list, splitter, shape_type, config,
+                        start_time):
     """
     checks for the existence of shape files or their zipped archives and if 
     it identifies the archive, it unzips it
@@ -20,6 +22,8 @@ def unzipCriticalFiles(glob_path, target_list, splitter, shape_type, start_time)
                             splitting the path string so files can be found
         shape_type:         a string variable indicating what type of shape
                             file is being checked
+        config:			    the json variable that contains all configration
+    					    data required for the data processing
     	start_time:	        the clock time that the step began using the 
     					    time.clock() format
 
@@ -39,38 +43,47 @@ def unzipCriticalFiles(glob_path, target_list, splitter, shape_type, start_time)
         except:
             pass
 
-    # determine if the zip file exists for the missing shapes and unzip them
-    zip_files = glob.glob(glob_path.split('.')[0]+'.zip')
-    for z in zip_files:
-        temp_time = time.localtime()
+    # determine if the zip file exists for the missing shapes.  The block and
+    # place shape files are read straight out of their archives (see 
+    # config['shape_archives']), the others are extracted several at a time
+    zip_files = []
+    for z in glob.glob(glob_path.split('.')[0]+'.zip'):
         zip_id = z.split(splitter)[1]
         zip_id = zip_id.split('_')[0]
-
-        z = z.replace("\\","/") #<-- this is used in case we are running in windows
-        shape_dir = '/'.join(z.split('/')[:-1])+'/'
-
         if zip_id in target_list:
-            try:
-                zip_ref = zipfile.ZipFile(z)                       
-                zip_ref.extractall(shape_dir)    
-                zip_ref.close() 
+            zip_files.append((zip_id, z.replace("\\","/"))) #<-- this is used in case we are running in windows
+
+    try:
+        temp_time = time.localtime()
+        if shape_type in ('block', 'places') and \
+                config['shape_archives']['read_from_zip']:
+            for zip_id, z in zip_files:
+                if len(nbmf.archiveMembers(z, '.shp')) > 0:
+                    target_list.remove(zip_id)
+            action = 'FOUND'
+        else:
+            nbmf.extractArchives([z for zip_id, z in zip_files], 
+                                config['shape_archives']['extract_threads'])
+            for zip_id, z in zip_files:
                 target_list.remove(zip_id)
-                my_message = """
-                    INFO - STEP 0 (MASTER): TASK 2 OF 13 - UNZIPPED %s SHAPE
-                    FILE FOR %s
-                    """ % (shape_type.upper(), zip_id)
-                my_message = ' '.join(my_message.split())
-                print(nbmf.logMessage(my_message,temp_time, time.localtime(), 
-                    time.mktime(time.localtime())-time.mktime(start_time)))
-            except:
-                my_message = """
-                    ERROR - STEP 0 (MASTER): TASK 2 of 13 - FAILED TO UNZIP %s 
-                    SHAPE FILE FOR %s
-                    """ % (shape_type.upper(), zip_id)
-                my_message = ' '.join(my_message.split())+'\n'+traceback.format_exc()
-                print(nbmf.logMessage(my_message,temp_time, time.localtime(), 
-                    time.mktime(time.localtime())-time.mktime(start_time)))
-                return False
+            action = 'UNZIPPED'
+        if len(zip_files) > 0:
+            my_message = """
+                INFO - STEP 0 (MASTER): TASK 2 OF 13 - %s %s %s SHAPE FILE 
+                ARCHIVES
+                """ % (action, len(zip_files), shape_type.upper())
+            my_message = ' '.join(my_message.split())
+            print(nbmf.logMessage(my_message,temp_time, time.localtime(), 
+                time.mktime(time.localtime())-time.mktime(start_time)))
+    except:
+        my_message = """
+            ERROR - STEP 0 (MASTER): TASK 2 of 13 - FAILED TO UNZIP %s 
+            SHAPE FILES
+            """ % shape_type.upper()
+        my_message = ' '.join(my_message.split())+'\n'+traceback.format_exc()
+        print(nbmf.logMessage(my_message,temp_time, time.localtime(), 
+            time.mktime(time.localtime())-time.mktime(start_time)))
+        return False
 
     # see if there are any missing shape and zip files
     if len(target_list) > 0:
@@ -115,8 +128,10 @@ def checkShapeFiles(config,start_time):
 
         # get the list of state ids and then prepare for each of the different
         # shape files.  Tracts shape file does not have all of the states and
-        # territories.  Assumes the state file has already been unzipped
-        state_ids = gpd.read_file(config['shape_files_path']+config['state_shape_file_name'] )
+        # territories.  Assumes the state file has already been unzipped.  
+        # Only the attributes (the dbf) are read, not the geometry
+        state_ids = gpd.read_file(config['shape_files_path']+config['state_shape_file_name'],
+                                ignore_geometry=True)
         bl_ids = state_ids['GEOID'].tolist() 
         pl_ids = bl_ids[:]
         tr_ids = bl_ids[:]
@@ -134,7 +149,7 @@ def checkShapeFiles(config,start_time):
             glob_path = config['shape_files_path']+shape_dict[shp][0]
             splitter  = shape_dict[shp][0].split("/")[1]
             splitter  = "_".join(splitter.split("_")[:2])+'_'
-            continue_run = unzipCriticalFiles(glob_path, shape_dict[shp][1], splitter, shp, start_time)
+            continue_run = unzipCriticalFiles(glob_path, shape_dict[shp][1], splitter, shp, config, start_time)
             if not continue_run:
                 flag = False
         if flag:
@@ -162,6 +177,24 @@ def checkShapeFiles(config,start_time):
 
     return flag        
 
+def inputCSVFiles(config):
+    """
+    Arguments In: 
+        config:			    the json variable that contains all configration
+    					    data required for the data processing
+
+    Arguments Out:
+        csv_dict:           a dictionary with the path of each input csv
+    """
+    return {'fbd':config['input_csvs_path']+config['fbData'],
+            'cnty2cbsa': config['input_csvs_path']+config['county_to_cbsa'][0],
+            'bms':config['input_csvs_path']+config['block_master_static'][0],
+            'hhp':config['input_csvs_path']+config['hu_hh_pop'][0],
+            'tracts':config['input_csvs_path']+config['tract_area_file'],
+            'blocks':config['input_csvs_path']+config['large_blocks_file'],
+            'lookup':config['input_csvs_path']+config['previous_lookup_table'],
+            'prov_lookup':config['input_csvs_path']+config['previous_provider_lookup_table']}
+
 def checkCSVFiles(config,start_time):
     """
     subroutine that checks to ensure the required CSV files are present 
@@ -182,14 +215,7 @@ def checkCSVFiles(config,start_time):
         flag = True 
         missing_files = []
         temp_time = time.localtime()
-        csv_dict = {'fbd':config['input_csvs_path']+config['fbData'],
-                    'cnty2cbsa': config['input_csvs_path']+config['county_to_cbsa'][0],
-                    'bms':config['input_csvs_path']+config['block_master_static'][0],
-                    'hhp':config['input_csvs_path']+config['hu_hh_pop'][0],
-                    'tracts':config['input_csvs_path']+config['tract_area_file'],
-                    'blocks':config['input_csvs_path']+config['large_blocks_file'],
-                    'lookup':config['input_csvs_path']+config['previous_lookup_table'],
-                    'prov_lookup':config['input_csvs_path']+config['previous_provider_lookup_table']}
+        csv_dict = inputCSVFiles(config)
         for c in csv_dict:
             my_csv = Path(csv_dict[c])
             if not my_csv.exists():
@@ -225,6 +251,93 @@ def checkCSVFiles(config,start_time):
 
     return flag
 
+def inputFileNames(config):
+    """
+    Arguments In: 
+        config:			    the json variable that contains all configration
+    					    data required for the data processing
+
+    Arguments Out:
+        file_names:         a list of the paths of the input csvs and of every
+                            file in the shape file directory that exist
+    """
+    file_names = list(inputCSVFiles(config).values())
+    for root, dirs, files in os.walk(config['shape_files_path']):
+        file_names += [os.path.join(root, f) for f in files 
+                        if f != 'unzip_manifest.json']
+    return [f for f in file_names if os.path.isfile(f)]
+
+def inputsUnchanged(config):
+    """
+    compares the input files with the manifest recorded the last time they
+    passed the checks.  Only the directory listing and the size and 
+    modification time of each file are read
+
+    Arguments In: 
+        config:			    the json variable that contains all configration
+    					    data required for the data processing
+
+    Arguments Out:
+        unchanged:          a boolean variable that indicates if the same 
+                            files are present and none of them has changed
+    """
+    manifest = nbim.readManifest(config['input_manifest']['manifest_file'])
+    file_names = inputFileNames(config)
+    return len(manifest) > 0 and set(file_names) == set(manifest) and \
+            len(nbim.changedFiles(manifest, file_names)) == 0
+
+def recordInputManifest(config, start_time):
+    """
+    records the size, modification time and hash of every input file in the
+    input manifest (see NBM2_input_manifest) once the files pass the checks.
+    Only files that are new or changed since the last manifest are read, and
+    the next run skips the checks if the inputs are unchanged (see 
+    inputsUnchanged)
+
+    Arguments In: 
+        config:			    the json variable that contains all configration
+    					    data required for the data processing
+    	start_time:	        the clock time that the step began using the 
+    					    time.clock() format
+
+    Arguments Out:
+        continue_run:       a boolean variable that indicates if the routine
+                            successfully completed and whether the next steps
+                            should be executed
+    """
+    try:
+        temp_time = time.localtime()
+        manifest_file = config['input_manifest']['manifest_file']
+        file_names = inputFileNames(config)
+
+        previous = nbim.readManifest(manifest_file)
+        manifest, hashed = nbim.buildManifest(file_names, previous, 
+                                config['input_manifest']['hash_threads'])
+        changed = [f for f in hashed if f in previous and 
+                    previous[f].get('sha256') != manifest[f]['sha256']]
+        nbim.writeManifest(manifest_file, manifest)
+
+        my_message = """
+            INFO - STEP 0 (MASTER): TASK 2 OF 13 - RECORDED %s INPUT FILES IN 
+            THE INPUT MANIFEST - HASHED %s, %s CHANGED SINCE THE LAST RUN
+            """ % (len(manifest), len(hashed), len(changed))
+        my_message = ' '.join(my_message.split())
+        for f in changed:
+            my_message += '\n\t%s' % f
+        print(nbmf.logMessage(my_message,temp_time, time.localtime(), 
+            time.mktime(time.localtime())-time.mktime(start_time)))
+        return True
+
+    except:
+        my_message = """
+            ERROR - STEP 0 (MASTER): TASK 2 OF 13 - FAILED TO RECORD THE INPUT
+            MANIFEST
+            """            
+        my_message = ' '.join(my_message.split())+'\n'+traceback.format_exc()
+        print(nbmf.logMessage(my_message,temp_time, time.localtime(), 
+            time.mktime(time.localtime())-time.mktime(start_time)))
+        return False
+
 def checkFiles(config, start_time):
     """
     subroutine used to manage all file checking and extracting processes
@@ -242,11 +355,25 @@ def checkFiles(config, start_time):
     """
     try:
         temp_time = time.localtime()
+        # nothing has to be checked again if the inputs are the ones that
+        # passed the checks last time
+        if inputsUnchanged(config):
+            my_message = """
+                INFO - STEP 0 (MASTER): TASK 2 of 13 - INPUT FILES ARE UNCHANGED
+                SINCE THEY WERE LAST CHECKED - SKIPPING THE CHECKS
+                """
+            print(nbmf.logMessage(' '.join(my_message.split()),temp_time, time.localtime(),
+                time.mktime(time.localtime())-time.mktime(start_time)))
+            return True
+
         continue_run = checkShapeFiles(config, start_time)
 
         # if continue_run:
         #     continue_run = checkCSVFiles(config, start_time)
 
+        if continue_run:
+            continue_run = recordInputManifest(config, start_time)
+
         if continue_run:
             my_message = """
                 INFO - STEP 0 (MASTER): TASK 2 of 13 - CONFIRMED PRESENCE OF REQUIRED
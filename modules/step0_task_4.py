@@ -1,10 +1,11 @@
 import NBM2_functions as nbmf 
+import NBM2_bulk_load as nbbl
 import step0_functions as s0f
-import sqlalchemy as sal
 import traceback
 import psycopg2
 import time
-import glob
+import re
+import os
 import gc 
 
 def loadPlaceQueue(input_queue, config, db_config, start_time):
@@ -29,10 +30,12 @@ def loadPlaceQueue(input_queue, config, db_config, start_time):
     """
     try:
         temp_time = time.localtime()
-        # unzip all the files in the directory if necessary
+        # the shape files are read straight out of their archives or, if 
+        # that is turned off, the archives are extracted if necessary
         dir_name = config['shape_files_path'] + config['place_shape_dir_name']
-        if len(glob.glob(dir_name +"/*.shp")) == 0:
-            nbmf.unzip_archives(dir_name,'.zip')
+        if not config['shape_archives']['read_from_zip']:
+            nbmf.unzip_archives(dir_name, '.zip', 
+                                config['shape_archives']['extract_threads'])
 
         # drop the table before processing
         my_conn = psycopg2.connect( host=db_config['db_host'], 
@@ -40,26 +43,31 @@ def loadPlaceQueue(input_queue, config, db_config, start_time):
                                     password=db_config['db_password'], 
                                     database=db_config['db'])
         my_cursor = my_conn.cursor()
+        table_name = "nbm2_place_%s" % (config['geometry_vintage'])
         sql_string = """
-            DROP TABLE IF EXISTS {0}.nbm2_place_{1}; COMMIT;
-            """.format(db_config['db_schema'],config['geometry_vintage'])
+            DROP TABLE IF EXISTS {0}.{1}; COMMIT;
+            """.format(db_config['db_schema'], table_name)
         my_cursor.execute(sql_string)
 
+        # create the table from the declared columns so every file can be
+        # loaded at the same time
+        columns = nbbl.tableColumns(config['place_table_columns'], 
+                                    db_config['SRID'])
+        my_cursor.execute(nbbl.createTableSQL(db_config['db_schema'], 
+                                            table_name, columns))
+        my_conn.commit()
+
         my_cursor.close()
         my_conn.close()
 
         # build the queue with the shape file data
         dir_name = config['shape_files_path'] + config['place_shape_dir_name'] 
-        my_shapes = glob.glob(dir_name +"/*.shp")
-        table_name = "nbm2_place_%s" % (config['geometry_vintage'])
+        my_shapes = nbmf.shapeFilePaths(dir_name, 
+                                    config['shape_archives']['read_from_zip'])
         c = 0
         for shp in my_shapes: 
-            if c == 0:
-                action = "replace"
-            else:
-                action = "append"
-            input_queue.put((c, config, db_config, table_name, action, shp, 
-                            'place'))
+            input_queue.put((c, config, db_config, table_name, 
+                            shp, 'place'))
             c += 1
 
         my_message = """
@@ -105,10 +113,12 @@ def loadBlockQueue(input_queue, config, db_config, start_time):
     """
     try:
         temp_time = time.localtime()
-        # unzip all the files in the directory if necessary
+        # the shape files are read straight out of their archives or, if 
+        # that is turned off, the archives are extracted if necessary
         dir_name = config['shape_files_path'] + config['block_shape_dir_name']
-        if len(glob.glob(dir_name +"/*.shp")) == 0:
-            nbmf.unzip_archives(dir_name,'.zip')
+        if not config['shape_archives']['read_from_zip']:
+            nbmf.unzip_archives(dir_name, '.zip', 
+                                config['shape_archives']['extract_threads'])
 
         # drop the table before processing otherwise
         my_conn = psycopg2.connect( host=db_config['db_host'], 
@@ -116,25 +126,36 @@ def loadBlockQueue(input_queue, config, db_config, start_time):
                                     password=db_config['db_password'], 
                                     database=db_config['db'])
         my_cursor = my_conn.cursor()
+        table_name = "nbm2_block_%s" % (config['census_vintage'])
         sql_string = """
-            DROP TABLE IF EXISTS {0}.nbm2_block_{1}; COMMIT;
-            """.format(db_config['db_schema'],config['census_vintage'])
+            DROP TABLE IF EXISTS {0}.{1}; COMMIT;
+            """.format(db_config['db_schema'], table_name)
         my_cursor.execute(sql_string)
+
+        # create the table from the declared columns so every file can be
+        # loaded at the same time.  The table is partitioned by state; the
+        # state of each file is taken from its name (tl_<year>_<state>_...)
+        dir_name = config['shape_files_path'] + config['block_shape_dir_name'] 
+        my_shapes = nbmf.shapeFilePaths(dir_name, 
+                                    config['shape_archives']['read_from_zip'])
+        state_fips = sorted(set(m.group(1) for m in 
+                        [re.search(r'_(\d{2})_', os.path.basename(shp)) 
+                        for shp in my_shapes] if m is not None))
+        columns = nbbl.tableColumns(config['block_table_columns'], 
+                                    db_config['SRID'])
+        my_cursor.execute(nbbl.createTableSQL(db_config['db_schema'], 
+                                            table_name, columns, '"STATE_FIPS"'))
+        my_cursor.execute(s0f.statePartitionsSQL('%s.%s' % 
+                        (db_config['db_schema'], table_name), state_fips))
+        my_conn.commit()
         my_cursor.close()
         my_conn.close()
 
         # build the queue with the shape file data
-        dir_name = config['shape_files_path'] + config['block_shape_dir_name'] 
-        my_shapes = glob.glob(dir_name +"/*.shp")
-        table_name = "nbm2_block_%s" % (config['census_vintage'])
         c = 0
         for shp in my_shapes: 
-            if c == 0:
-                action = "replace"
-            else:
-                action = "append"
-            input_queue.put((c, config, db_config, table_name, action, shp, 
-                            'block'))
+            input_queue.put((c, config, db_config, table_name, 
+                            shp, 'block'))
             c += 1
 
         my_message = """
@@ -158,202 +179,6 @@ def loadBlockQueue(input_queue, config, db_config, start_time):
                 time.mktime(time.localtime()) - time.mktime(start_time)))       
         return False, None 
 
-def modifyBlockTable(config, db_config, start_time):
-    """
-    Function makes modifications to the block table to get it in the format 
-    required for the rest of the processing used through out the STEP 0 
-    functions and queries
-
-    Arguments In:   
-    	config:			the json variable that contains all configration
-    					data required for the data processing
-        db_config:      a dictionary that contains the configuration
-                        information for the database and queue
-    	start_time:	the clock time that the step began using the 
-    					time.clock() format
-
-    Arguments Out:
-        continue_run    a boolean that indicates if the process completed
-    					the entire task
-    """
-    # connect to the database
-    try:
-        temp_time = time.localtime()
-        connection_string = 'postgresql://%s:%s@%s:%s/%s' %\
-                (db_config['db_user'], db_config['db_password'], 
-                db_config['db_host'], db_config['db_port'],db_config['db'])                
-        engine = sal.create_engine(connection_string)
-    except:
-        my_message = """
-            ERROR - STEP 0 (MASTER): TASK 4 of 13 - FAILED TO CONNECT TO 
-            DATABASE TO MAKE CHANGES TO BLOCK TABLE
-            """
-        my_message = ' '.join(my_message.split())
-        my_message += '\n' + traceback.format_exc()
-        print(nbmf.logMessage(my_message.strip(),temp_time,time.localtime(), 
-                time.mktime(time.localtime()) - time.mktime(start_time)))
-        return False
-
-    with engine.connect() as conn, conn.begin():
-        try:
-            temp_time = time.localtime()
-            # create the county_fips column
-            sql_string = """
-                ALTER TABLE {0}.nbm2_block_{1} 
-                ADD COLUMN "COUNTY_FIPS" varchar(5); COMMIT;
-                """.format(db_config['db_schema'], config['census_vintage'])
-            conn.execute(sql_string)
-            my_message = """
-                INFO - STEP 0 (MASTER): TASK 4 OF 13 - ADDED COUNTY_FIPS COLUMN 
-                TO BLOCK TABLE
-                """
-            my_message = ' '.join(my_message.split())                
-            print(nbmf.logMessage(my_message.strip(),temp_time,time.localtime(), 
-                    time.mktime(time.localtime()) - time.mktime(start_time)))
-        except:
-            my_message = """
-                ERROR - STEP 0 (MASTER): TASK 4 OF 13 - FAILED TO ADD 
-                COUNTY_FIPS COLUMN TO BLOCK TABLE
-                """
-            my_message = ' '.join(my_message.split())
-            my_message += '\n' + traceback.format_exc()
-            print(nbmf.logMessage(my_message,temp_time,time.localtime(), 
-                    time.mktime(time.localtime()) - time.mktime(start_time)))
-            return False
-        
-        try:
-            temp_time = time.localtime()
-            # populate the county_fips column
-            sql_string = """
-                UPDATE {0}.nbm2_block_{1} set "COUNTY_FIPS" = ( 
-                (CASE WHEN LENGTH("STATEFP{2}") = 1 THEN ('0' || "STATEFP{2}") 
-                    ELSE "STATEFP{2}" 
-                END) || 
-                (CASE WHEN LENGTH("COUNTYFP{2}") = 1 then ('00' || "COUNTYFP{2}") 
-                    WHEN LENGTH("COUNTYFP{2}") = 2 THEN ('0' || "COUNTYFP{2}") 
-                    ELSE "COUNTYFP{2}" 
-                END)); COMMIT;
-                """.format(db_config['db_schema'], config['census_vintage'],
-                        config['census_vintage'][2:])
-            conn.execute(sql_string)
-            my_message = """
-                INFO - STEP 0 (MASTER):  TASK 4 OF 13 - ADDED COUNTY_FIPS DATA 
-                TO BLOCK TABLE
-                """
-            my_message = ' '.join(my_message.split())
-            print(nbmf.logMessage(my_message.strip(),temp_time,time.localtime(), 
-                    time.mktime(time.localtime()) - time.mktime(start_time)))
-        except:
-            my_message = """
-                ERROR - STEP 0 (MASTER): TASK 4 OF 13 - FAILED TO ADD 
-                COUNTY_FIPS DATA TO BLOCK TABLE
-                """
-            my_message = ' '.join(my_message.split())
-            my_message += '\n' + traceback.format_exc()
-            print(nbmf.logMessage(my_message,temp_time,time.localtime(), 
-                    time.mktime(time.localtime()) - time.mktime(start_time)))
-            return False
-
-        try:
-            # change intpt to centroid_
-            sql_string = """
-                ALTER TABLE {0}.nbm2_block_{1} 
-                RENAME COLUMN "INTPTLAT{2}" TO "CENTROID_LAT"; COMMIT;
-                ALTER TABLE {0}.nbm2_block_{1} 
-                RENAME COLUMN "INTPTLON{2}" TO "CENTROID_LON"; COMMIT;
-                ALTER TABLE {0}.nbm2_block_{1} 
-                RENAME COLUMN "GEOID{2}" TO "BLOCK_FIPS"; COMMIT;
-                """.format(db_config['db_schema'], config['census_vintage'],
-                        config['census_vintage'][2:])
-            conn.execute(sql_string)
-            my_message = """
-                INFO - STEP 0 (MASTER): TASK 4 OF 13 - CHANGED NAMES OF 
-                CENTROID POINTS IN BLOCK TABLE
-                """
-            my_message = ' '.join(my_message.split())
-            print(nbmf.logMessage(my_message.strip(),temp_time,time.localtime(), 
-                    time.mktime(time.localtime()) - time.mktime(start_time)))        
-        except:
-            my_message = """
-                ERROR - STEP 0 (MASTER): TASK 4 OF 13 - FAILED TO CHANGE NAMES 
-                OF CENTROIDS IN BLOCK TABLE
-                """
-            my_message = ' '.join(my_message.split())
-            my_message += '\n' + traceback.format_exc()
-            print(nbmf.logMessage(my_message.strip(),temp_time,time.localtime(), 
-                    time.mktime(time.localtime()) - time.mktime(start_time)))
-            return False
-
-        try:
-            # change the data types for columns
-            sql_string = """
-                ALTER TABLE {0}.nbm2_block_{1} 
-                    ALTER COLUMN "BLOCK_FIPS" TYPE varchar(15),
-                    ALTER COLUMN "ALAND{2}" TYPE double precision,
-                    ALTER COLUMN "AWATER{2}" TYPE double precision,
-                    ALTER COLUMN "CENTROID_LAT" TYPE numeric(10,7) 
-                        USING "CENTROID_LAT"::numeric(10,7),
-                    ALTER COLUMN "CENTROID_LON" TYPE numeric(10,7) 
-                        USING "CENTROID_LON"::numeric(10,7); COMMIT;
-            """.format(db_config['db_schema'], config['census_vintage'],
-                        config['census_vintage'][2:])
-            conn.execute(sql_string)
-            my_message = """
-                INFO - STEP 0 (MASTER): TASK 4 OF 13 - CHANGED DATA TYPES IN 
-                BLOCK TABLE
-                """
-            my_message = ' '.join(my_message.split())                
-            print(nbmf.logMessage(my_message.strip(),temp_time,time.localtime(), 
-                    time.mktime(time.localtime()) - time.mktime(start_time)))               
-        except:
-            my_message = """
-                ERROR - STEP 0 (MASTER): TASK 4 OF 13 - FAILED TO CHANGE DATA 
-                TYPES IN BLOCK TABLE
-                """
-            my_message = ' '.join(my_message.split())
-            my_message += '\n' + traceback.format_exc()
-            print(nbmf.logMessage(my_message.strip(),temp_time,time.localtime(), 
-                    time.mktime(time.localtime()) - time.mktime(start_time)))
-            return False
-
-        try:
-            # drop the unnecessary columns   
-            sql_string = """
-                ALTER TABLE {0}.nbm2_block_{1} 
-                DROP COLUMN "STATEFP{2}", 
-                DROP COLUMN "COUNTYFP{2}",
-                DROP COLUMN "TRACTCE{2}",
-                DROP COLUMN "BLOCKCE{2}",
-                DROP COLUMN "NAME{2}",
-                DROP COLUMN "MTFCC{2}",
-                DROP COLUMN "UR{2}",
-                DROP COLUMN "UACE{2}",
-                DROP COLUMN "UATYP{2}",
-                DROP COLUMN "FUNCSTAT{2}"; COMMIT;
-            """.format(db_config['db_schema'], config['census_vintage'],
-                        config['census_vintage'][2:])
-            conn.execute(sql_string)
-            my_message = """
-                INFO - STEP 0 (MASTER): TASK 4 OF 13 - DROPPED UNNECCESARY 
-                COLUMNS OF DATA FROM BLOCK TABLE
-                """
-            my_message = ' '.join(my_message.split())
-            print(nbmf.logMessage(my_message.strip(),temp_time,time.localtime(), 
-                    time.mktime(time.localtime()) - time.mktime(start_time)))      
-        except:
-            my_message = """
-                ERROR - STEP 0 (MASTER): TASK 4 OF 13 - FAILED TO DROP 
-                UNNECESSARY COLUMNS OF DATA FROM BLOCK TABLE
-                """
-            my_message = ' '.join(my_message.split())
-            my_message += '\n' + traceback.format_exc()
-            print(nbmf.logMessage(my_message.strip(),temp_time,time.localtime(), 
-                    time.mktime(time.localtime()) - time.mktime(start_time)))
-            return False
-    del engine
-    gc.collect()
-    return True
-
 def loadComplexShapeFiles(input_queue, output_queue, message_queue, config, 
                             db_config, start_time):
     """
@@ -387,8 +212,8 @@ def loadComplexShapeFiles(input_queue, output_queue, message_queue, config,
 
     # start the worker processes if the block and/or place shape files need to be loaded
     if config['step0']['census_block_shape'] or config['step0']['census_place_shape']:
-        for _ in range(config['number_servers']):
-            message_queue.put('load_complex_shape')
+        nbmf.startServants(config, input_queue, message_queue, 
+                            'load_complex_shape')
 
     # load the block file data into the queue
     if continue_run and config['step0']['census_block_shape']:
@@ -405,12 +230,8 @@ def loadComplexShapeFiles(input_queue, output_queue, message_queue, config,
         continue_run = s0f.processWork(config, input_queue, output_queue, 
                         file_count, start_time)
 
-    # add additional columns to the tables and changes geometry
-    if continue_run and config['step0']['census_block_shape']:
-        # modify block table to get the fields we need
-        continue_run = modifyBlockTable(config, db_config, start_time)
-
-    # adjust indexes and columns names
+    # the tables were created with their final columns and types (see
+    # config['block_table_columns']), so they only need to be indexed
     for shape_type in ['block', 'place']:
         if continue_run and config['step0']['census_%s_shape' % shape_type]:
             index_list = config['%s_indexes' % shape_type]       
@@ -220,11 +220,14 @@ def makeCountyFIPsFile(config, db_config, start_time):
         # there is an inconsistency between the county cb file and the county
         # FIPS in the block file.  We choose to use the block table as the 
         # basis for making the county list.  This ensures we have all possible
-        # counties listed in the block file
+        # counties listed in the block file.  The number of blocks in each 
+        # county is kept to order the county level tasks by size
         engine = sal.create_engine(connection_string)
         sql_string = """
-            SELECT DISTINCT CAST(SUBSTR("BLOCK_FIPS",1,5) AS TEXT) AS "GEOID" 
-            FROM  {0}.nbm2_block_{1};
+            SELECT CAST(SUBSTR("BLOCK_FIPS",1,5) AS TEXT) AS "GEOID",
+                COUNT(*) AS block_count
+            FROM  {0}.nbm2_block_{1}
+            GROUP BY 1;
             """.format( db_config['db_schema'], config['census_vintage'])
 
         # load the data into a dataframe, get it in the order we want, and then
@@ -292,8 +295,8 @@ def loadRemainingFiles(input_queue, output_queue, message_queue, config,
         continue_run = buildHH_HU_POP_sql(config, start_time)
 
     if config['step0']['census_shape'] or config['step0']['census_csv']:
-        for _ in range(config['number_servers']):
-            message_queue.put('load_other_files')
+        nbmf.startServants(config, input_queue, message_queue, 
+                            'load_other_files')
 
     if continue_run and config['step0']['census_shape']:
             continue_run, build_list = loadSimpleShapeFiles(config, db_config, 
@@ -2,7 +2,6 @@ import NBM2_functions as nbmf
 import step0_functions as s0f
 import sqlalchemy as sal
 import geopandas as gpd
-import operator
 import traceback
 import psycopg2 
 import time
@@ -12,7 +11,8 @@ def createSpatialTables(config, db_config, start_time):
     """
     Function loads the queue with the SQL statements that will perform 
     the spatial intersections for tribe, congress, and place tables
-    and creates the staging and final overlay tables 
+    and creates the staging and final overlay tables and the subdivided 
+    copies of the tribe, congress, and place tables
 
     Arguments In:
     	config:			the json variable that contains all configration
@@ -62,7 +62,17 @@ def createSpatialTables(config, db_config, start_time):
                             .format(db_config['db_schema'], sql_file, 
                                     config['geometry_vintage'])
                 SRID = db_config['SRID']
-                sql_string_1 = sql_string.format(stage_table,final_table,SRID)
+                # the staging table is partitioned by state so each county's
+                # statements only touch its state's partition
+                partitions = s0f.statePartitionsSQL(stage_table, 
+                                                    s0f.readStateFips(config))
+                sql_string_1 = sql_string.format(stage_table,final_table,SRID,
+                                                partitions)
+            my_cursor.execute(sql_string_1)
+
+            # split the geography into small pieces for the interior test
+            subdivided_table, sql_string_1 = s0f.subdivideSQL(config, 
+                                                db_config, sql_file)
             my_cursor.execute(sql_string_1)
         my_conn.close()
 
@@ -113,7 +123,8 @@ def findIntersectingCounties(input_queue, config, db_config, start_time):
                             successfully completed and whether the next 
                             steps should be exectuted        
         file_count:         an integer variable that contains the total number of
-                            items to be processed in the distributed environment
+                            counties to be processed in the distributed 
+                            environment
     """
     try:
         # make the connection with the database
@@ -253,10 +264,26 @@ def findIntersectingCounties(input_queue, config, db_config, start_time):
         print(nbmf.logMessage(my_message, process_time, time.localtime(),
         time.mktime(time.localtime())-time.mktime(start_time)))
 
-        # load data into distributed queue
+        # group the intersections by county - each county is one task that
+        # overlays its blocks with all of its tribes, congressional districts
+        # and places
         temp_time = time.localtime()
-        intersections.sort(key=operator.itemgetter(2,0,1))
-        [input_queue.put(i) for i in intersections]
+        county_tasks = {}
+        geography_index = {'tribe': 1, 'congress': 2, 'place': 3}
+        for county_id, space_id, shape in intersections:
+            if county_id not in county_tasks:
+                county_tasks[county_id] = (county_id, [], [], [])
+            county_tasks[county_id][geography_index[shape]].append(space_id)
+        county_tasks = [county_tasks[c] for c in sorted(county_tasks)]
+        for task in county_tasks:
+            for space_ids in task[1:]:
+                space_ids.sort()
+
+        # load data into distributed queue, largest counties first
+        block_counts = s0f.readCountyBlockCounts(config)
+        county_tasks = nbmf.orderByCost(input_queue, county_tasks,
+                                [block_counts.get(t[0]) for t in county_tasks])
+        [input_queue.put(t) for t in county_tasks]
         my_message = """
             INFO - STEP 0 (MASTER): TASK 7 OF 13 - COMPLETED LOADING SPATIAL 
             INTERSECTION TASKS INTO QUEUE
@@ -265,7 +292,7 @@ def findIntersectingCounties(input_queue, config, db_config, start_time):
         print(nbmf.logMessage(my_message, temp_time, time.localtime(),
         time.mktime(time.localtime())-time.mktime(start_time)))
 
-        file_count = len(intersections)
+        file_count = len(county_tasks)
 
         del tribes
         del congress
@@ -275,6 +302,7 @@ def findIntersectingCounties(input_queue, config, db_config, start_time):
         del place_intersects
         del congress_intersects
         del intersections
+        del county_tasks
         gc.collect()
 
         return True, file_count
@@ -320,19 +348,27 @@ def startSpatialIntersections(input_queue, output_queue, message_queue, config,
     """
     try:
         temp_time = time.localtime()
-        # create the staging tables for all three geographies
-        continue_run = createSpatialTables(config, db_config, start_time)
+        # create the staging tables for all three geographies.  When resuming
+        # a run the staging tables already hold the completed intersections
+        if config['task_ledger']['resume_run'] and \
+                input_queue.completedTasks('initial_spatial_intersection') > 0:
+            continue_run = True
+        else:
+            continue_run = createSpatialTables(config, db_config, start_time)
+
+        # start the distributed workers before loading the queue so the 
+        # tasks are recorded against this stage in the task ledger
+        if continue_run:
+            nbmf.startServants(config, input_queue, message_queue, 
+                                'initial_spatial_intersection', True)
 
         # identify which counties intersect with each tribe, place, congress, geom
         if continue_run:
             continue_run, task_count = findIntersectingCounties(input_queue, 
                                         config, db_config, start_time)
 
-        # start the distributed worker tasks and process results
+        # process the results from the distributed workers
         if continue_run:
-            for _ in range(config['number_servers']):
-                message_queue.put('initial_spatial_intersection')
-
             continue_run = s0f.processWork(config, input_queue, output_queue, 
                             task_count, start_time)
 
@@ -154,8 +154,15 @@ def loadWaterBlocksQueue(input_queue, my_cursor, config, db_config, start_time):
                 sql_string = my_file.read().replace('\n','')
         final_table = '%s.nbm2_congress_block_overlay_%s' %\
                     (db_config['db_schema'], config['geometry_vintage'])
-        congress_table = '%s.nbm2_congress_%s' %\
-                    (db_config['db_schema'], config['geometry_vintage'])
+        # the nearest districts are found with a KNN search of the gist index
+        # of the subdivided districts; the geodesic distance is only computed
+        # for those few candidates.  The subdivided districts are made by step
+        # 0 task 7 and are built here if that task was not run
+        congress_table, sql_string2 = s0f.subdivideSQL(config, db_config,
+                                                        'congress')
+        my_cursor.execute('SELECT to_regclass(%s)', (congress_table,))
+        if my_cursor.fetchone()[0] is None:
+            my_cursor.execute(sql_string2)
         block_table = '%s.nbm2_block_%s' %\
                     (db_config['db_schema'], config['census_vintage'])
         
@@ -166,9 +173,9 @@ def loadWaterBlocksQueue(input_queue, my_cursor, config, db_config, start_time):
         state_list = my_cursor.fetchall()
 
         for s in state_list:
-            sql_string = sql_string.format(final_table, congress_table, 
-                        block_table, s[0])
-            input_queue.put((s,sql_string))
+            input_queue.put((s, sql_string.format(final_table, congress_table, 
+                        block_table, s[0], 
+                        config['water_block_assignment']['knn_candidates'])))
 
         my_message = """
             INFO - STEP 0 (MASTER): TASK 8 OF 13 - COMPLETED TRANSFERRING 
@@ -248,6 +255,12 @@ def updateSpatialIntersections(input_queue, output_queue, message_queue, config,
     if continue_run:
         continue_run = transferData(my_cursor, config, db_config, start_time)
 
+    # start the distributed workers before loading the queue so the tasks
+    # are recorded against this stage in the task ledger
+    if continue_run:
+        nbmf.startServants(config, input_queue, message_queue, 
+                            'assign_water_blocks')
+
     # load queue for water blocks
     if continue_run:
         continue_run, file_count = loadWaterBlocksQueue(input_queue, my_cursor, config, 
@@ -255,9 +268,6 @@ def updateSpatialIntersections(input_queue, output_queue, message_queue, config,
 
     # process the results coming from the distributed workers
     if continue_run:
-        for _ in range(config['number_servers']):
-            message_queue.put('assign_water_blocks')
-
         continue_run = s0f.processWork(config, input_queue, output_queue, 
                         file_count, start_time)
 
@@ -89,8 +89,11 @@ def countyChangeArea(my_cursor, config, db_config, start_time):
                         (db_config['db_schema'], config['census_vintage'])          #2
             county_fips = ",".join([ "'%s'" %\
                         i for i in config['county_changes_substantial']])           #3
+            partitions = s0f.statePartitionsSQL(staging_table,
+                                            s0f.readStateFips(config))          #4
             sql_string_1 = sql_string.format(staging_table, county_shape, 
-                                            block_table, county_fips)
+                                            block_table, county_fips, 
+                                            partitions)
 
         my_cursor.execute(sql_string_1)
 
@@ -155,9 +158,12 @@ def countyChangeNames(my_cursor, config, db_config, start_time):
                 different_county_fips += 'ELSE SUBSTR("BLOCK_FIPS", 1, 5) END) '#3
             else:
                 different_county_fips = 'substr("BLOCK_FIPS", 1, 5) '
+            partitions = s0f.statePartitionsSQL(county_block,
+                                            s0f.readStateFips(config))        #4
             sql_string_1 = sql_string.format(county_block, block_table, 
                                             change_county_fips, 
-                                            different_county_fips)
+                                            different_county_fips, 
+                                            partitions)
 
         my_cursor.execute(sql_string_1)
 
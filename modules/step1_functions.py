@@ -1,35 +1,56 @@
 import NBM2_functions as nbmf
-import pandas as pd 
-import numpy as np 
+import pandas as pd
+import numpy as np
 
 
 
-def speeds_vectorized(dfgroup, val_arr, column_list, speed_type):
+def speedTiers(df, group_columns, speed_column, val_arr, column_list):
     """
-    Calculates the population above the relevant down/up-load speeds for a given 
-    hoconum & transtech combination. Population is multiplied by the boolean
-    (max_download_speed >= download_speed_threshold) then summed over all 
-    block FIPS for a given hoconum and transtech.  This routine is only 
-    called by the apply function in pandas.
+    Calculates the population at or above each of the relevant down/up-load
+    speeds for every group (e.g., hoconum & transtech combination) at once.
+    The maximum speed of each row is bucketed into a tier with searchsorted,
+    the population of each (group, tier) is summed with a weighted bincount
+    and a reverse cumulative sum over the tiers gives the population at or
+    above each speed.  A row without a speed is not counted in any tier.
 
     Arguments In:
-        dfgroup:        an implicit variable passed in by the datafram 
-                        calling the function
-        val_arr:        a list of float upload/download speeds that are used
-                        to aggregate the reported provider speeds
+        df:             a pandas dataframe with the group columns, the 'pop'
+                        column and the speed column
+        group_columns:  a list of the columns the population is aggregated
+                        over (e.g., ['HocoNum','TechCode'])
+        speed_column:   the column with the maximum speed of each row (e.g.,
+                        'max_download_speed')
+        val_arr:        a sorted list of float upload/download speeds that
+                        are used to aggregate the reported provider speeds
         column_list:    a list of strings that provide the column names for
                         the upload and download speeds
-        speed_type:     a string variable that indicates whether the call
-                        to the function is for upload or download speeds.  
-                        Can only take the value of "up" or "down"
 
     Arguments Out:
-        result:         a numpy vector of the aggregated results 
+        result:         a pandas dataframe indexed by the group columns with
+                        one column of aggregated population per speed
     """
-    pop_mat=np.array(dfgroup['pop'].repeat(len(val_arr))).\
-                reshape((len(dfgroup),len(val_arr)))
-    speed_mat=eval("np.array(dfgroup.max_%sload_speed.repeat(len(val_arr))).\
-                reshape((len(dfgroup),len(val_arr)))" % speed_type)
-    result = pd.Series(list(np.sum(np.multiply(speed_mat>=val_arr,pop_mat),\
-                        axis=0)),index=column_list) 
-    return result
\ No newline at end of file
+    val_arr = np.asarray(val_arr, dtype=float)
+    grouped = df.groupby(group_columns, sort=True)
+    group_index = grouped.size().index
+
+    # rows in a dropped (null) group are numbered NaN and are left out
+    group_id = grouped.ngroup().values.astype(float)
+    keep = ~np.isnan(group_id)
+    group_id = group_id[keep].astype(np.int64)
+
+    # tier k holds the rows that meet the first k speeds
+    speed = df[speed_column].values[keep].astype(float)
+    tier = np.searchsorted(val_arr, speed, side='right')
+    tier[np.isnan(speed)] = 0
+    number_tiers = len(val_arr) + 1
+
+    pop = df['pop'].values
+    totals = np.bincount(group_id * number_tiers + tier,
+                        weights=pop[keep],
+                        minlength=len(group_index) * number_tiers).\
+                        reshape((len(group_index), number_tiers))
+    totals = np.cumsum(totals[:, ::-1], axis=1)[:, ::-1][:, 1:]
+    if np.issubdtype(pop.dtype, np.integer):
+        totals = totals.astype(np.int64)
+
+    return pd.DataFrame(totals, index=group_index, columns=column_list)
@@ -1,7 +1,6 @@
 import NBM2_functions as nbmf
 import step1_functions as s1f
 import pandas as pd
-import numpy as np
 import traceback
 import time 
 
@@ -36,12 +35,9 @@ def consolidateUsersByTech(merged_df, config, start_time):
 
     try:
         temp_time = time.localtime()
-        df_hocotrans=merged_df[['HocoNum','TechCode','pop','max_download_speed']].\
-                    groupby(['HocoNum','TechCode']).\
-                    apply(  s1f.speeds_vectorized, 
-                            val_arr=np.array(config['d_val_arr']), 
-                            column_list=config['d_column_list'],
-                            speed_type='down')
+        df_hocotrans=s1f.speedTiers(merged_df, ['HocoNum','TechCode'], 
+                            'max_download_speed', config['d_val_arr'], 
+                            config['d_column_list'])
 
         my_message = """
             INFO - STEP 1 (MASTER): TASK 3 OF 7 - COMPLETED AGGREGATING USERS 
@@ -61,12 +57,9 @@ def consolidateUsersByTech(merged_df, config, start_time):
                 time.mktime(time.localtime())-time.mktime(start_time)))
         return False, None
     try:
-        df_i=merged_df[['HocoNum','TechCode','pop','max_upload_speed']].\
-                groupby(['HocoNum','TechCode']).\
-                apply(s1f.speeds_vectorized, 
-                val_arr=np.array(config['u_val_arr']), 
-                column_list=config['u_column_list'],
-                speed_type='up')
+        df_i=s1f.speedTiers(merged_df, ['HocoNum','TechCode'], 
+                            'max_upload_speed', config['u_val_arr'], 
+                            config['u_column_list'])
         my_message = """
             INFO - STEP 1 (MASTER): TASK 3 OF 7 - COMPLETED AGGREGATING USERS 
             AND TECHNOLOGIES FOR UPLOAD SPEEDS
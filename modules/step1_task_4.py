@@ -45,18 +45,10 @@ def aggregate_tech_collection(merged_df,techlist,code_string, config, start_time
 
         # Calculate the population above a given download/upload speed 
         # for a given hoconum
-        df_down=df_i[['HocoNum','pop','max_download_speed']].\
-                    groupby(['HocoNum']).\
-                    apply(  s1f.speeds_vectorized, 
-                            val_arr=np.array(config['d_val_arr']), 
-                            column_list=config['d_column_list'], 
-                            speed_type='down')
-        df_up=df_i[['HocoNum','pop','max_upload_speed']].\
-                    groupby(['HocoNum']).\
-                    apply(  s1f.speeds_vectorized, 
-                            val_arr=np.array(config['u_val_arr']), 
-                            column_list=config['u_column_list'], 
-                            speed_type='up')
+        df_down=s1f.speedTiers(df_i, ['HocoNum'], 'max_download_speed', 
+                            config['d_val_arr'], config['d_column_list'])
+        df_up=s1f.speedTiers(df_i, ['HocoNum'], 'max_upload_speed', 
+                            config['u_val_arr'], config['u_column_list'])
         df_i=df_down.merge(df_up,left_index=True,right_index=True)
 
         # Create a column with name of the technology being processed
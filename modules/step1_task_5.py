@@ -43,16 +43,10 @@ def aggregateHoCoNum(merged_df, config, start_time):
 
         # Calculate the population above a given download/upload speed for
         # a given hoconum
-        df_hoco=merged_df[['HocoNum','pop','max_download_speed']].\
-                groupby(['HocoNum']).apply(s1f.speeds_vectorized,
-                            val_arr=np.array(config['d_val_arr']), 
-                            column_list=config['d_column_list'], 
-                            speed_type='down')
-        df_i=merged_df[['HocoNum','pop','max_upload_speed']].\
-                groupby(['HocoNum']).apply(s1f.speeds_vectorized,
-                            val_arr=np.array(config['u_val_arr']), 
-                            column_list=config['u_column_list'], 
-                            speed_type='up')
+        df_hoco=s1f.speedTiers(merged_df, ['HocoNum'], 'max_download_speed', 
+                            config['d_val_arr'], config['d_column_list'])
+        df_i=s1f.speedTiers(merged_df, ['HocoNum'], 'max_upload_speed', 
+                            config['u_val_arr'], config['u_column_list'])
         df_hoco=df_hoco.merge(df_i,left_index=True,right_index=True)
 
         # Create a column with transtech = 'all'
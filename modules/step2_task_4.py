@@ -1,5 +1,6 @@
 from itertools import chain, combinations 
 import NBM2_functions as nbmf 
+import NBM2_broadcast as nbbs
 import traceback 
 import time
  
@@ -76,6 +77,10 @@ def queueLoader(input_queue, blockm_df, config, start_time):
         append_list = []
         try:
             temp_time = time.localtime()
+
+            # publish the block master data once - the queue elements only
+            # carry a handle to it
+            blockm_handle = nbbs.publish(config, blockm_df, 'blockm_df')
             for i in range(len(config['speedList'])):
                 numprov_file_path = config['temp_csvs_dir_path']\
                                 + 'block_numprov/block_numprov_%s_%s.csv'\
@@ -89,11 +94,14 @@ def queueLoader(input_queue, blockm_df, config, start_time):
                 fbd_df = config['temp_pickles'] + 'enhanced_fbd_df.pkl'
                 d_speed, u_speed  = config['down_speed'][i], config['up_speed'][i]
                 
-                # insert the information into the queue
+                # insert the information into the queue.  The files the task
+                # writes are declared so step 3 can start on the speed as 
+                # soon as they are written
                 temp_tuple = (numprov_file_path, numprov_zero_file_path, 
                             temp_area_table_file_path, workerSpeed, d_speed, 
-                            u_speed, column_names, fbd_df, blockm_df, start_time)
-                input_queue.put(temp_tuple)  
+                            u_speed, column_names, fbd_df, blockm_handle, start_time)
+                input_queue.put(temp_tuple, writes=[numprov_file_path, 
+                                numprov_zero_file_path, temp_area_table_file_path])
                 append_list.append(temp_area_table_file_path)
 
             my_message = """
@@ -126,7 +134,7 @@ def processWork(config, input_queue, output_queue, start_time):
     # continue until all speed files have been created
     while counter < speed_count:
         try:
-            message = output_queue.get_nowait()
+            message = output_queue.get(timeout=config['queue_timeouts']['result_seconds'])
             # message[0] is the type of message received
             # message[1] is the message
             # message[2] is the temp_time value
@@ -168,36 +176,11 @@ def processWork(config, input_queue, output_queue, start_time):
                 break
 
         except:
-            # there is no message so wait and try again
-            time.sleep(1)
-
-    # flush the queue with sentinals (poison pills)
-    for _ in range(1000):
-        input_queue.put_nowait((None,None))
-
-    # clear out the output queue just for good bookeeping nothing
-    for _ in range(output_queue.qsize()):
-        try:
-            output_queue.get_nowait()
-        except:
+            # no message arrived before the timeout - wait again
             pass
 
-    # clear out any remaining tasks in the input queue that are not sentinals
-    while input_queue.qsize() > 1000:
-        try:
-            input_queue.get_nowait()
-        except:
-            pass
-    
-    # wait a few seconds while the servants process the sentinals
-    time.sleep(10)
-
-    # flush the queue
-    for _ in range(input_queue.qsize()):
-        try:
-            input_queue.get_nowait()
-        except:
-            pass
+    # close the stage and wait for the workers still running to finish
+    nbmf.closeStage(config, input_queue, start_time)
 
     return continue_run
 
@@ -227,8 +210,8 @@ def createBlockNumprovFiles(input_queue, output_queue, message_queue, config,
     try:    
         temp_time = time.localtime()
 
-        for _ in range(config['number_servers']):
-            message_queue.put('create_block_numprov')
+        nbmf.startServants(config, input_queue, message_queue, 
+                            'create_block_numprov', True)
 
         # load the input_queue
         continue_run, append_list = queueLoader(input_queue, blockm_df, config, 
@@ -1,4 +1,5 @@
 import NBM2_functions as nbmf 
+import NBM2_broadcast as nbbs
 import pandas as pd 
 import traceback
 import time 
@@ -31,7 +32,13 @@ def queueLoader(input_queue, config, blockm_df, tract_df, county_df, start_time)
     try:
         # load the queue with the information used by the parallel processes
         temp_time = time.localtime()
-        
+
+        # publish the data frames once - the queue elements only carry 
+        # handles to them
+        blockm_handle = nbbs.publish(config, blockm_df, 'blockm_df')
+        tract_handle = nbbs.publish(config, tract_df, 'tract_df')
+        county_handle = nbbs.publish(config, county_df, 'county_df')
+
         for t in config['speedList']:
             numprovPath = config['temp_csvs_dir_path'] +\
                 'block_numprov/block_numprov_%s_with_zero_%s.csv'\
@@ -42,9 +49,11 @@ def queueLoader(input_queue, config, blockm_df, tract_df, county_df, start_time)
             outCountyPath = config['temp_csvs_dir_path'] +\
                 'county_numprov/county_numprov_sort_round_%s_%s.csv'\
                 % (t, config['fbd_vintage'])
-            tempTuple = (numprovPath, blockm_df, outTractPath, outCountyPath, 
-                        tract_df, county_df, start_time, t, config)
-            input_queue.put(tempTuple)
+            tempTuple = (numprovPath, blockm_handle, outTractPath, outCountyPath, 
+                        tract_handle, county_handle, start_time, t, config)
+            # the task waits until step 2 has written the file of its speed
+            input_queue.put(tempTuple, reads=[numprovPath], 
+                            writes=[outTractPath, outCountyPath])
 
         my_message = """
             INFO - STEP 3 (MASTER): COMPLETED LOADING QUEUE WITH SPEEDS AND 
@@ -95,7 +104,7 @@ def processWork(config, input_queue, output_queue, start_time):
     while counter < speed_count:
 
         try:
-            message = output_queue.get_nowait()
+            message = output_queue.get(timeout=config['queue_timeouts']['result_seconds'])
             # message[0] is the type of message received
             # message[1] is the message
             # message[2] is the temp_time value
@@ -137,36 +146,11 @@ def processWork(config, input_queue, output_queue, start_time):
                 break
 
         except:
-            # there is no message so wait and try again
-            time.sleep(1)
-
-    # flush the queue with sentinals (poison pills)
-    for i in range(1000):
-        input_queue.put_nowait((None,None))
-
-    # clear out the output queue just for good bookeeping nothing
-    for i in range(output_queue.qsize()):
-        try:
-            output_queue.get_nowait()
-        except:
+            # no message arrived before the timeout - wait again
             pass
 
-    # clear out any remaining tasks in the queue that are not sentinals
-    while input_queue.qsize() > 1000:
-        try:
-            input_queue.get_nowait()
-        except:
-            pass
-    
-    # wait a few seconds while the servants process the sentinals
-    time.sleep(10)
-
-    # flush the queue
-    for i in range(input_queue.qsize()):
-        try:
-            input_queue.get_nowait()
-        except:
-            pass
+    # close the stage and wait for the workers still running to finish
+    nbmf.closeStage(config, input_queue, start_time)
 
     return continue_run
 
@@ -206,8 +190,8 @@ def createNumProvs(config, db_config, input_queue, output_queue, message_queue,
 
     temp_time = time.localtime()
 
-    for _ in range(config['number_servers']):
-        message_queue.put('create_tract_numprov')
+    nbmf.startServants(config, input_queue, message_queue, 
+                        'create_tract_numprov', True)
 
     continue_run = queueLoader(input_queue, config, blockm_df, tract_df, 
                                     county_df, start_time)
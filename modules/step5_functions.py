@@ -43,7 +43,8 @@ def dissolve(config, county_counter, input_queue, output_queue, start_time):
     while counter < county_counter:
         try:
             # check for messages in the queue
-            message = output_queue.get_nowait()
+            message = output_queue.get(
+                        timeout=config['queue_timeouts']['result_seconds'])
             my_message = message[1]
 
             counter += 1
@@ -59,22 +60,12 @@ def dissolve(config, county_counter, input_queue, output_queue, start_time):
             except:
                 print(message+'\n'+traceback.format_exc())
         except:
-            # queue is empty, wait to check queue again
-            # output_queue.put(traceback.format_exc())
-            time.sleep(1)
+            # no message arrived before the timeout - wait again
+            pass
 
-    # place sentinal in the queue to flush it
+    # close the stage so the queues are ready for the next distributed process
     temp_time = time.localtime()
-    for i in range(county_counter):
-        input_queue.put((None,None))
-
-    # clear the queue to get ready for the next distributed process
-    time.sleep(5)
-    for i in range(county_counter):
-        try:
-            input_queue.get_nowait()
-        except:
-            pass
+    nbmf.closeStage(config, input_queue, start_time)
 
     my_message = """
         INFO - STEP 5 (MASTER): COMPLETED FLUSHING THE QUEUE
@@ -5,6 +5,7 @@ import pandas as pd
 import traceback 
 import time
 import glob
+import os
 
 
 def concat_list(minx,miny,maxx,maxy):
@@ -318,10 +319,16 @@ def loadCountyHoCoNumQueue(config, input_queue, start_time):
     county_counter = 0
 
     try:
-        block_files = glob.glob(config['temp_geog_geojson_path']+'/county_block/block_df_*.geojson')
-        for b in block_files:
+        # the counties with the most blocks and fbd records are queued first
+        tasks = []
+        estimates = []
+        for b in glob.glob(config['temp_geog_geojson_path']+'/county_block/block_df_*.fgb'):
             county_id = b.split('.')[0][-5:]
             f = config['temp_csvs_dir_path']+'county_fbd/fbd_df_%s.csv' % county_id
+            tasks.append((b, f))
+            estimates.append(os.path.getsize(b) + 
+                            (os.path.getsize(f) if os.path.exists(f) else 0))
+        for b, f in nbmf.orderByCost(input_queue, tasks, estimates):
             county_counter += 1
             input_queue.put((b, f, config, start_time))
 
@@ -374,8 +381,8 @@ def makeProviderFiles(config, input_queue, output_queue, message_queue,
                             geometries
 
     """
-    for _ in range(config['number_servers']):
-        message_queue.put('provider_files')
+    nbmf.startServants(config, input_queue, message_queue, 'provider_files', 
+                        True)
 
     continue_run, county_counter = loadCountyHoCoNumQueue(config, input_queue,
                                     start_time)
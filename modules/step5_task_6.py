@@ -7,6 +7,7 @@ import traceback
 import pickle
 import glob
 import time 
+import os
 
 def readTractDF(config, db_config, start_time):
     """
@@ -136,7 +137,10 @@ def loadTractQueue(config, input_queue, start_time):
 
     # create the input queue data values that will be processed at the county
     # level
-    files = glob.glob(config['temp_geog_geojson_path']+'/county_block/block_df_*.geojson')
+    # the largest counties are queued first
+    files = glob.glob(config['temp_geog_geojson_path']+'/county_block/block_df_*.fgb')
+    files = nbmf.orderByCost(input_queue, files, 
+                            [os.path.getsize(f) for f in files])
     for f in files:
         county_counter += 1
         input_queue.put((f, config, start_time))
@@ -185,8 +189,8 @@ def createTractsSort(config, db_config, connection_string, input_queue,
                         tract level information used by later routines
     """
     if config['step5']['tracts.sort.geojson']:
-        for _ in range(config['number_servers']):
-            message_queue.put('tract_sort')
+        nbmf.startServants(config, input_queue, message_queue, 'tract_sort', 
+                            True)
             
         continue_run = s5f.changeTogeom(db_config, config, connection_string, 
                                         start_time)
@@ -104,12 +104,15 @@ def loadInterimFileQueue(file_list, input_queue, config, start_time):
             time.mktime(time.localtime())-time.mktime(start_time)))
         return False, None
 
-def processWorkerResults(output_queue, file_count, start_time):
+def processWorkerResults(config, output_queue, file_count, start_time):
     """
     outputs the results of the distributed processes to the screen and keeps
     track of how many processes have been completed
 
     Arguments In:
+        config:         a dictionary that contains the configuration
+                        information of various steps of NMB2 data 
+                        processing
         output_queue:   a multiprocessing queue that can be shared 
                         across multiple servers and cores.  All results 
                         from the various processes are loaded into the 
@@ -130,7 +133,11 @@ def processWorkerResults(output_queue, file_count, start_time):
 
     while counter < file_count:
         try:
-            result = output_queue.get_nowait()
+            result = output_queue.get(
+                        timeout=config['queue_timeouts']['result_seconds'])
+            if isinstance(result[0], int):
+                # a (type, message, start, end) report from the task ledger
+                result = result[1:]
             counter += 1
             my_message = result[0] + ' %s of %s PROCESSED' % (counter, file_count)
             try:
@@ -143,7 +150,8 @@ def processWorkerResults(output_queue, file_count, start_time):
                 break
 
         except:
-            time.sleep(5)
+            # no message arrived before the timeout - wait again
+            pass
 
     return continue_run
 
@@ -174,19 +182,7 @@ def flushQueue(input_queue, output_queue, config, start_time):
 
     """
     temp_time = time.localtime()
-    for _ in range(1000):
-        input_queue.put((None,None))
-
-    for i in range(output_queue.qsize()):
-        output_queue.get_nowait()
-
-    time.sleep(10)
-
-    for i in range(1000):
-        try:
-            input_queue.get_nowait()
-        except:
-            pass
+    nbmf.closeStage(config, input_queue, start_time)
 
     my_message = """
         INFO - STEP 6 (MASTER): COMPLETED FLUSHING THE QUEUE
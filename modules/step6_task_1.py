@@ -39,8 +39,8 @@ def joinDataFiles(input_queue, output_queue, message_queue, config, start_time):
         temp_time = time.localtime()
 
         # indicate to the servant servers which service is required
-        for i in range(config['number_servers']):
-            message_queue.put('initial_geojson')
+        nbmf.startServants(config, input_queue, message_queue, 
+                            'initial_geojson', True)
         
         # load the queue with the file types and parameters to be processed
         if continue_run:
@@ -49,7 +49,7 @@ def joinDataFiles(input_queue, output_queue, message_queue, config, start_time):
 
         # process the results of the output from each worker
         if continue_run:
-            continue_run = s6f.processWorkerResults(output_queue, file_counter, start_time)
+            continue_run = s6f.processWorkerResults(config, output_queue, file_counter, start_time)
 
         # flush the queue so the next process can run
         if continue_run:        
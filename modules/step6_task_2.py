@@ -39,8 +39,8 @@ def createTractCountyZoomFiles(input_queue, output_queue, message_queue,
         temp_time = time.localtime()
 
         # indicate to the servant servers which service is required
-        for _ in range(config['number_servers']):
-            message_queue.put('zoom_mbtiles')
+        nbmf.startServants(config, input_queue, message_queue, 
+                            'zoom_mbtiles', True)
         
         # load the queue with the file types and parameters to be processed
         if continue_run:
@@ -50,7 +50,7 @@ def createTractCountyZoomFiles(input_queue, output_queue, message_queue,
 
         # process the results of the output from each worker
         if continue_run:
-            continue_run = s6f.processWorkerResults(output_queue, file_counter, 
+            continue_run = s6f.processWorkerResults(config, output_queue, file_counter, 
                             start_time)
 
         # flush the queue so the next process can run
@@ -113,8 +113,8 @@ def createBlockZoomFiles(input_queue, output_queue, message_queue,
         temp_time = time.localtime()
 
         # indicate to the servant servers which service is required
-        for _ in range(config['number_servers']):
-            message_queue.put('large_zoom_mbtiles')
+        nbmf.startServants(config, input_queue, message_queue, 
+                            'large_zoom_mbtiles', True)
 
         # load the queue with the file types and parameters to be processed
         if continue_run:
@@ -124,7 +124,7 @@ def createBlockZoomFiles(input_queue, output_queue, message_queue,
 
         # process the results of the output from each worker
         if continue_run:
-            continue_run = s6f.processWorkerResults(output_queue, file_counter, 
+            continue_run = s6f.processWorkerResults(config, output_queue, file_counter, 
                             start_time)
 
         # flush the queue so the next process can run
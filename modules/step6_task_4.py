@@ -40,8 +40,8 @@ def prepProviderFiles(input_queue, output_queue, message_queue, config,
         temp_time = time.localtime()
 
         # indicate to the servant servers which service is required
-        for _ in range(config['number_servers']):
-            message_queue.put('prep_providers')
+        nbmf.startServants(config, input_queue, message_queue, 
+                            'prep_providers', True)
 
         # load the queue with the file types and parameters to be processed
         if continue_run:
@@ -51,7 +51,7 @@ def prepProviderFiles(input_queue, output_queue, message_queue, config,
 
         # process the results of the output from each worker
         if continue_run:
-            continue_run = s6f.processWorkerResults(output_queue, file_counter, 
+            continue_run = s6f.processWorkerResults(config, output_queue, file_counter, 
                                                     start_time)
 
         # flush the queue so the next process can run
@@ -41,8 +41,8 @@ def makeProviderTiles(input_queue, output_queue, message_queue, config,
         temp_time = time.localtime()
 
         # indicate to the servant servers which service is required
-        for _ in range(config['number_servers']):
-            message_queue.put('make_providers')
+        nbmf.startServants(config, input_queue, message_queue, 
+                            'make_providers', True)
 
         # load the queue with the file types and parameters to be processed
         if continue_run:
@@ -52,7 +52,7 @@ def makeProviderTiles(input_queue, output_queue, message_queue, config,
             
         # process the results of the output from each worker
         if continue_run:
-            continue_run = s6f.processWorkerResults(output_queue, file_counter, 
+            continue_run = s6f.processWorkerResults(config, output_queue, file_counter, 
                                                     start_time)
 
         # flush the queue so the next process can run
@@ -0,0 +1,126 @@
+from decimal import Decimal
+import numpy as np
+import pandas as pd
+import pytest
+import struct
+
+# the bulk loader reads shape files with geopandas, fiona and shapely
+gpd = pytest.importorskip('geopandas')
+pytest.importorskip('fiona')
+shapely = pytest.importorskip('shapely')
+
+import NBM2_bulk_load as nbbl
+
+# run from the modules directory with:  python -m pytest test_NBM2_bulk_load.py
+
+
+def decodeNumeric(field):
+    # reads a binary COPY numeric field back into a Decimal
+    length, ndigits, weight, sign, scale = struct.unpack('>ihhHH', field[:12])
+    assert length == len(field) - 4
+    digits = struct.unpack('>%sh' % ndigits, field[12:])
+    value = sum(Decimal(d) * Decimal(10000) ** (weight - i)
+                for i, d in enumerate(digits))
+    return (-value if sign == 0x4000 else value), scale
+
+
+def test_fixed_width_fields():
+    fields = nbbl.encodeFields(pd.Series([1, -2, 3]), 'bigint')
+    assert fields == [struct.pack('>iq', 8, v) for v in [1, -2, 3]]
+    fields = nbbl.encodeFields(np.array([1.5, np.nan]), 'double precision')
+    assert fields == [struct.pack('>id', 8, 1.5), nbbl.NULL_FIELD]
+
+def test_text_and_boolean_fields():
+    fields = nbbl.encodeFields(pd.Series(['01', None, 'Cañon']), 'text')
+    assert fields == [struct.pack('>i', 2) + b'01', nbbl.NULL_FIELD,
+                    struct.pack('>i', 6) + 'Cañon'.encode('utf-8')]
+    fields = nbbl.encodeFields([True, False, None], 'boolean')
+    assert fields == [b'\x00\x00\x00\x01\x01', b'\x00\x00\x00\x01\x00',
+                    nbbl.NULL_FIELD]
+
+@pytest.mark.parametrize('value, scale, expected', [
+    ('+38.1234567', 7,  Decimal('38.1234567')),
+    ('-0.5',        1,  Decimal('-0.5')),
+    (10000,         0,  Decimal('10000')),
+    (123456789.25,  2,  Decimal('123456789.25')),
+    ('0.00005',     4,  Decimal('0.0001')),
+    ('-0.00004',    4,  Decimal('0')),
+    (0,             3,  Decimal('0'))])
+def test_numeric_round_trip(value, scale, expected):
+    decoded, decoded_scale = decodeNumeric(nbbl.encodeNumeric(value, scale))
+    assert decoded == expected
+    assert decoded_scale == scale
+
+def test_numeric_layout():
+    # 38.1234567 is stored as the base 10000 digits 38 . 1234 5670
+    field = nbbl.encodeNumeric('38.1234567', 7)
+    assert field == struct.pack('>ihhHHhhh', 14, 3, 0, 0, 7, 38, 1234, 5670)
+    # trailing zero digits are left out and the weight keeps the magnitude
+    field = nbbl.encodeNumeric(10000, 0)
+    assert field == struct.pack('>ihhHHh', 10, 1, 1, 0, 0, 1)
+    assert nbbl.encodeFields([None, 1], 'numeric(5,2)')[0] == nbbl.NULL_FIELD
+
+def test_geometry_fields_carry_srid():
+    square = shapely.from_wkt('MULTIPOLYGON (((0 0, 1 0, 1 1, 0 1, 0 0)))')
+    field = nbbl.encodeFields([square], 'geometry(MULTIPOLYGON, 4326)',
+                            '4326')[0]
+    geometry = shapely.from_wkb(field[4:])
+    assert struct.unpack('>i', field[:4])[0] == len(field) - 4
+    assert shapely.get_srid(geometry) == 4326
+    assert shapely.equals(geometry, square)
+
+def test_normalizeGeometry():
+    square = shapely.from_wkt('POLYGON ((0 0, 1 0, 1 1, 0 1, 0 0))')
+    bowtie = shapely.from_wkt('POLYGON ((0 0, 2 2, 2 0, 0 2, 0 0))')
+    geometry, valid = nbbl.normalizeGeometry(np.array([square, bowtie]))
+    assert list(shapely.get_type_id(geometry)) == [6, 6]
+    assert list(valid) == [True, True]
+    assert shapely.equals(geometry[0], square)
+    assert shapely.area(geometry[1]) == pytest.approx(2.)
+
+def test_binary_copy_stream():
+    stream = nbbl.BinaryCopyStream([b'abc', b'', b'defg', b'h'])
+    assert stream.read(2) == b'ab'
+    assert stream.read(4) == b'cdef'
+    assert stream.read() == b'gh'
+    assert stream.read(8) == b''
+
+def test_copyRows():
+    chunk = gpd.GeoDataFrame(
+                {'GEOID10': ['010010201001000', '010010201001001']},
+                geometry=[shapely.from_wkt('POLYGON ((0 0, 1 0, 1 1, 0 0))'),
+                        shapely.from_wkt('POLYGON ((0 0, 2 0, 2 2, 0 0))')])
+    columns = nbbl.tableColumns([['BLOCK_FIPS', 'text', 'GEOID10']], 4326)
+    data = b''.join(nbbl.copyRows([chunk], columns, 4326, first_id=5))
+    assert data.startswith(nbbl.COPY_HEADER)
+    assert data.endswith(nbbl.COPY_TRAILER)
+
+    offset = len(nbbl.COPY_HEADER)
+    rows = []
+    for row in range(2):
+        assert struct.unpack('>h', data[offset:offset + 2])[0] == 4
+        offset += 2
+        fields = []
+        for column in columns:
+            length = struct.unpack('>i', data[offset:offset + 4])[0]
+            fields.append(data[offset + 4:offset + 4 + length])
+            offset += 4 + length
+        rows.append(fields)
+    assert data[offset:] == nbbl.COPY_TRAILER
+    assert [struct.unpack('>q', r[0])[0] for r in rows] == [5, 6]
+    assert [r[1] for r in rows] == [b'010010201001000', b'010010201001001']
+    assert [shapely.get_type_id(shapely.from_wkb(r[2])) for r in rows] == [6, 6]
+    assert [r[3] for r in rows] == [b'\x01', b'\x01']
+
+def test_shapeChunks(tmp_path):
+    squares = [shapely.box(i, 0, i + 1, 1) for i in range(5)]
+    shape_df = gpd.GeoDataFrame({'GEOID10': ['%02d' % i for i in range(5)]},
+                                geometry=squares, crs='EPSG:4269')
+    shape_file = str(tmp_path / 'blocks.shp')
+    shape_df.to_file(shape_file)
+    chunks = list(nbbl.shapeChunks(shape_file, chunk_rows=2))
+    assert [len(c) for c in chunks] == [2, 2, 1]
+    assert list(chunks[0].columns) == ['GEOID10', 'geometry']
+    assert chunks[2].crs == shape_df.crs
+    assert [g for c in chunks for g in c['GEOID10']] == \
+            list(shape_df['GEOID10'])
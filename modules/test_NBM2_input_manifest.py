@@ -0,0 +1,71 @@
+import NBM2_input_manifest as nbim
+import hashlib
+import os
+
+# run from the modules directory with:  python -m pytest test_NBM2_input_manifest.py
+
+
+def writeFile(file_name, data, mtime=None):
+    with open(file_name, 'wb') as my_file:
+        my_file.write(data)
+    if mtime is not None:
+        os.utime(file_name, (mtime, mtime))
+    return file_name
+
+
+def test_fileHash_reads_in_chunks(tmp_path):
+    data = os.urandom(10000)
+    file_name = writeFile(str(tmp_path / 'a.csv'), data)
+    assert nbim.fileHash(file_name, chunk_bytes=999) == \
+            hashlib.sha256(data).hexdigest()
+
+def test_buildManifest_skips_missing_files(tmp_path):
+    a = writeFile(str(tmp_path / 'a.csv'), b'a')
+    manifest, hashed = nbim.buildManifest([a, a, str(tmp_path / 'b.csv')])
+    assert list(manifest) == [a]
+    assert hashed == [a]
+    assert manifest[a] == { 'size':     1,
+                            'mtime':    os.stat(a).st_mtime,
+                            'sha256':   hashlib.sha256(b'a').hexdigest()}
+
+def test_unchanged_files_keep_their_hash(tmp_path):
+    a = writeFile(str(tmp_path / 'a.csv'), b'a', mtime=1000)
+    b = writeFile(str(tmp_path / 'b.csv'), b'b', mtime=1000)
+    previous, hashed = nbim.buildManifest([a, b])
+    # a hash of the previous manifest is trusted while size and mtime match
+    previous[a]['sha256'] = 'kept'
+    writeFile(b, b'bb', mtime=1000)
+    manifest, hashed = nbim.buildManifest([a, b], previous, threads=2)
+    assert hashed == [b]
+    assert manifest[a]['sha256'] == 'kept'
+    assert manifest[b]['sha256'] == hashlib.sha256(b'bb').hexdigest()
+    # a file touched without a change in size is hashed again
+    os.utime(a, (2000, 2000))
+    manifest, hashed = nbim.buildManifest([a, b], manifest)
+    assert hashed == [a]
+    assert manifest[a]['sha256'] == hashlib.sha256(b'a').hexdigest()
+
+def test_changedFiles(tmp_path):
+    a = writeFile(str(tmp_path / 'a.csv'), b'a', mtime=1000)
+    b = writeFile(str(tmp_path / 'b.csv'), b'b', mtime=1000)
+    c = writeFile(str(tmp_path / 'c.csv'), b'c', mtime=1000)
+    manifest, hashed = nbim.buildManifest([a, b, c])
+    assert nbim.changedFiles(manifest, [a, b, c]) == []
+    writeFile(a, b'aa', mtime=1000)
+    os.utime(b, (2000, 2000))
+    os.remove(c)
+    d = writeFile(str(tmp_path / 'd.csv'), b'd')
+    assert nbim.changedFiles(manifest, [a, b, c, d]) == [a, b, c, d]
+
+def test_manifest_round_trip(tmp_path):
+    manifest_file = str(tmp_path / 'input_manifest.json')
+    assert nbim.readManifest(manifest_file) == {}
+    a = writeFile(str(tmp_path / 'a.csv'), b'a')
+    manifest, hashed = nbim.buildManifest([a])
+    nbim.writeManifest(manifest_file, manifest)
+    assert nbim.readManifest(manifest_file) == manifest
+    # no temporary file is left next to the manifest
+    assert sorted(os.listdir(str(tmp_path))) == ['a.csv', 'input_manifest.json']
+    # a damaged manifest is treated as missing, so every file is hashed
+    writeFile(manifest_file, b'{"a.csv": ')
+    assert nbim.readManifest(manifest_file) == {}
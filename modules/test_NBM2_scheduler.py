@@ -0,0 +1,55 @@
+import pytest
+
+# the scheduler imports NBM2_functions, which needs the database libraries
+pytest.importorskip('sqlalchemy')
+pytest.importorskip('geopandas')
+
+from NBM2_process_config import config
+import NBM2_scheduler as nbsc
+
+# run from the modules directory with:  python -m pytest test_NBM2_scheduler.py
+
+
+def test_write_then_read_conflicts():
+    step_a = {'reads': ['/in/'], 'writes': ['/temp/block_numprov/']}
+    step_b = {'reads': ['/temp/block_numprov/b_10.csv'], 'writes': ['/out/']}
+    assert nbsc.stepsConflict(step_a, step_b)
+
+def test_read_then_write_conflicts():
+    step_a = {'reads': ['/temp/a.csv'], 'writes': ['/out/a/']}
+    step_b = {'reads': ['/in/'], 'writes': ['/temp/']}
+    assert nbsc.stepsConflict(step_a, step_b)
+
+def test_write_then_write_conflicts():
+    step_a = {'reads': [], 'writes': ['master_memory:fbd_df']}
+    step_b = {'reads': [], 'writes': ['master_memory:fbd_df']}
+    assert nbsc.stepsConflict(step_a, step_b)
+
+def test_shared_reads_do_not_conflict():
+    step_a = {'reads': ['/in/fbd.csv'], 'writes': ['/out/a/']}
+    step_b = {'reads': ['/in/fbd.csv'], 'writes': ['/out/b/']}
+    assert not nbsc.stepsConflict(step_a, step_b)
+    # a prefix only overlaps at a path boundary it names
+    step_c = {'reads': ['/out/ab/'], 'writes': []}
+    assert not nbsc.stepsConflict(step_a, step_c)
+
+def test_task_reads_do_not_conflict():
+    step_a = {'reads': [], 'writes': ['/temp/block_numprov/']}
+    step_b = {'reads': ['/temp/block_numprov/'], 'writes': ['/temp/tract/'],
+            'task_reads': ['/temp/block_numprov/']}
+    assert not nbsc.stepsConflict(step_a, step_b)
+    # task_reads only cover the reads, not a file both steps write
+    step_b['writes'].append('/temp/block_numprov/b_10.csv')
+    assert nbsc.stepsConflict(step_a, step_b)
+
+def test_step_graph():
+    step_names = ['step%s' % i for i in range(7)]
+    depends_on = nbsc.buildStepGraph(config, step_names)
+    assert depends_on == {  'step0':    set(),
+                            'step1':    {'step0'},
+                            'step2':    {'step0', 'step1'},
+                            'step3':    {'step0'},
+                            'step4':    {'step0'},
+                            'step5':    {'step0', 'step4'},
+                            'step6':    {'step0', 'step2', 'step3', 'step4',
+                                        'step5'}}
@@ -0,0 +1,313 @@
+import NBM2_task_ledger as nbtl
+import pytest
+import queue
+import time
+
+# run from the modules directory with:  python -m pytest test_NBM2_task_ledger.py
+
+
+def ledgerConfig(tmp_path, lease_seconds=100, max_retries=1):
+    return {'ledger_file':          str(tmp_path / 'task_ledger.db'),
+            'lease_seconds':        lease_seconds,
+            'heartbeat_seconds':    0.01,
+            'max_retries':          max_retries,
+            'speculation':          {'stages':          [],
+                                    'lease_seconds':    10,
+                                    'min_samples':      3,
+                                    'straggler_factor': 3,
+                                    'min_seconds':      1}}
+
+def message(text):
+    return (1, text, None, None)
+
+
+################################################################################
+# task keys
+################################################################################
+def test_taskKey_ignores_config_and_time():
+    config = {'step': 0}
+    first = ('tl_2017_01_tabblock10.shp', '01', config, time.localtime())
+    second = ('tl_2017_01_tabblock10.shp', '01', {'step': 1},
+                time.localtime(0))
+    assert nbtl.taskKey(first) == 'tl_2017_01_tabblock10.shp|01'
+    assert nbtl.taskKey(first) == nbtl.taskKey(second)
+
+def test_taskKey_keeps_simple_values_apart():
+    # different speeds and FIPS codes of the same file are different tasks
+    keys = {nbtl.taskKey(('block_numprov', speed, '01'))
+            for speed in ['0.2', '4', '10', '25']}
+    keys.add(nbtl.taskKey(('block_numprov', '0.2', '02')))
+    assert len(keys) == 5
+    assert nbtl.taskKey('file.csv') == 'file.csv'
+    assert nbtl.taskKey((True, 'a')) == 'a'
+
+def test_taskKey_collision_replays_first_task(tmp_path):
+    # elements that only differ in ignored values share a key, so in a
+    # resumed stage the second one is treated as already done
+    output_queue = queue.Queue()
+    ledger = nbtl.TaskLedger(ledgerConfig(tmp_path), output_queue)
+    ledger.beginStage('collide', resumable=True)
+    assert ledger.put(('a.csv', {'run': 1}))
+    task_id, stage, item = ledger.lease('w1', block=False)
+    ledger.ack(task_id, [message('a done')], worker_id='w1')
+    output_queue.get(timeout=1)
+    ledger.beginStage('collide', resumable=True)
+    assert not ledger.put(('a.csv', {'run': 2}))
+    assert output_queue.get(timeout=1)[1] == 'a done'
+
+
+################################################################################
+# lease, ack, retry and fail
+################################################################################
+def test_lease_and_ack_forwards_messages(tmp_path):
+    output_queue = queue.Queue()
+    ledger = nbtl.TaskLedger(ledgerConfig(tmp_path), output_queue)
+    ledger.beginStage('stage_a')
+    ledger.put(('a.csv', '01'))
+    assert ledger.qsize() == 1
+    task_id, stage, item = ledger.lease('w1', block=False)
+    assert (stage, item) == ('stage_a', ('a.csv', '01'))
+    assert ledger.qsize() == 0
+    assert ledger.leasedTasks() == 1
+    assert ledger.heartbeat(task_id, 'w1')
+    assert not ledger.heartbeat(task_id, 'w2')
+    assert ledger.ack(task_id, [message('done')], worker_id='w1')
+    assert output_queue.get(timeout=1)[1] == 'done'
+    assert ledger.leasedTasks() == 0
+    assert ledger.completedTasks('stage_a') == 1
+    # a task is acknowledged once
+    assert not ledger.ack(task_id, [message('again')], worker_id='w1')
+    assert output_queue.empty()
+
+def test_fail_retries_then_reports(tmp_path):
+    output_queue = queue.Queue()
+    ledger = nbtl.TaskLedger(ledgerConfig(tmp_path, max_retries=1),
+                            output_queue)
+    ledger.beginStage('stage_a')
+    ledger.put(('a.csv',))
+    task_id, stage, item = ledger.lease('w1', block=False)
+    assert ledger.fail(task_id, 'boom', worker_id='w1')
+    # the retry goes back to the front of the queue
+    assert ledger.qsize() == 1
+    assert output_queue.empty()
+    retry_id, stage, item = ledger.lease('w2', block=False)
+    assert retry_id == task_id
+    assert ledger.fail(task_id, 'boom again', worker_id='w2')
+    assert ledger.qsize() == 0
+    error = output_queue.get(timeout=1)
+    assert error[0] == 2
+    assert nbtl.isErrorMessage(error)
+    assert 'FAILED 2 TIMES' in error[1] and 'boom again' in error[1]
+
+def test_fail_without_retry_forwards_task_messages(tmp_path):
+    output_queue = queue.Queue()
+    ledger = nbtl.TaskLedger(ledgerConfig(tmp_path), output_queue)
+    ledger.beginStage('stage_a')
+    ledger.put(('a.csv',))
+    task_id, stage, item = ledger.lease('w1', block=False)
+    ledger.fail(task_id, 'bad input', retry=False, worker_id='w1',
+                messages=[(2, 'ERROR - bad input', None, None)])
+    assert output_queue.get(timeout=1)[1] == 'ERROR - bad input'
+    assert output_queue.empty()
+    assert ledger.qsize() == 0
+
+def test_releaseWorker_keeps_retries_of_stopped_worker(tmp_path):
+    output_queue = queue.Queue()
+    ledger = nbtl.TaskLedger(ledgerConfig(tmp_path, max_retries=0),
+                            output_queue)
+    ledger.beginStage('stage_a')
+    ledger.put(('a.csv',))
+    task_id, stage, item = ledger.lease('w1', block=False)
+    # a worker stopped by its servant does not use up a retry
+    assert ledger.releaseWorker('w1', count_attempt=False) == 1
+    assert ledger.qsize() == 1
+    task_id, stage, item = ledger.lease('w2', block=False)
+    # a worker that died does
+    assert ledger.releaseWorker('w2') == 1
+    assert ledger.qsize() == 0
+    assert nbtl.isErrorMessage(output_queue.get(timeout=1))
+
+def test_expired_lease_is_requeued(tmp_path):
+    output_queue = queue.Queue()
+    ledger = nbtl.TaskLedger(ledgerConfig(tmp_path, lease_seconds=0.05),
+                            output_queue)
+    ledger.beginStage('stage_a')
+    ledger.put(('a.csv',))
+    task_id, stage, item = ledger.lease('w1', block=False)
+    time.sleep(0.1)
+    retry_id, stage, item = ledger.lease('w2', timeout=1)
+    assert retry_id == task_id
+    # the worker that lost the lease can no longer finish the task
+    assert not ledger.heartbeat(task_id, 'w1')
+    assert not ledger.ack(task_id, [message('late')], worker_id='w1')
+    assert ledger.ack(task_id, [message('done')], worker_id='w2')
+    assert output_queue.get(timeout=1)[1] == 'done'
+    assert output_queue.empty()
+
+def test_closed_stage_hands_out_sentinels(tmp_path):
+    ledger = nbtl.TaskLedger(ledgerConfig(tmp_path), queue.Queue())
+    ledger.beginStage('stage_a')
+    ledger.put(('a.csv',))
+    ledger.put(('b.csv',))
+    task_id, stage, item = ledger.lease('w1', block=False)
+    ledger.closeStage()
+    assert not ledger.isOpen('stage_a')
+    # the task that was never started is discarded
+    assert ledger.lease('w2', block=False) == (None, 'stage_a', (None, None))
+    # the leased task keeps the stage from draining until it times out
+    assert not ledger.drainStage(0.05)
+    assert ledger.lease('w2', 'stage_a', block=False)[0] is None
+    with pytest.raises(queue.Empty):
+        ledger.get(block=False, stage='stage_a')
+
+def test_messages_of_drained_stage_are_dropped(tmp_path):
+    output_queue = queue.Queue()
+    ledger = nbtl.TaskLedger(ledgerConfig(tmp_path), output_queue)
+    ledger.beginStage('stage_a')
+    ledger.put(('a.csv',))
+    task_id, stage, item = ledger.lease('w1', block=False)
+    ledger.closeStage()
+    ledger.drainStage(0)
+    assert not ledger.putResult('stage_a', message('late'))
+    ledger.ack(task_id, [message('late')], worker_id='w1')
+    assert output_queue.empty()
+
+
+################################################################################
+# resume from the ledger file
+################################################################################
+def test_resumable_stage_skips_completed_tasks(tmp_path):
+    output_queue = queue.Queue()
+    ledger = nbtl.TaskLedger(ledgerConfig(tmp_path), output_queue)
+    ledger.beginStage('stage_a', resumable=True)
+    ledger.put(('a.csv',))
+    ledger.put(('b.csv',))
+    task_id, stage, item = ledger.lease('w1', block=False)
+    ledger.ack(task_id, [message('a done')], worker_id='w1')
+    output_queue.get(timeout=1)
+    # the run is killed before b.csv finishes
+    ledger.db.close()
+
+    output_queue = queue.Queue()
+    resumed = nbtl.TaskLedger(ledgerConfig(tmp_path), output_queue)
+    assert resumed.run_id == ledger.run_id
+    resumed.beginStage('stage_a', resumable=True)
+    assert not resumed.put(('a.csv',))
+    assert output_queue.get(timeout=1)[1] == 'a done'
+    assert resumed.put(('b.csv',))
+    assert resumed.qsize() == 1
+    assert resumed.lease('w2', block=False)[2] == ('b.csv',)
+
+def test_stage_that_is_not_resumable_runs_again(tmp_path):
+    ledger = nbtl.TaskLedger(ledgerConfig(tmp_path), queue.Queue())
+    ledger.beginStage('stage_a', resumable=True)
+    ledger.put(('a.csv',))
+    task_id, stage, item = ledger.lease('w1', block=False)
+    ledger.ack(task_id, [], worker_id='w1')
+    ledger.db.close()
+
+    resumed = nbtl.TaskLedger(ledgerConfig(tmp_path), queue.Queue())
+    resumed.beginStage('stage_a')
+    assert resumed.put(('a.csv',))
+    # reset forgets the completed tasks as well
+    resumed.reset()
+    resumed.beginStage('stage_a', resumable=True)
+    assert resumed.put(('a.csv',))
+    assert resumed.completedTasks('stage_a') == 0
+
+def test_checkpoints_survive_restart(tmp_path):
+    ledger = nbtl.TaskLedger(ledgerConfig(tmp_path), queue.Queue())
+    ledger.checkpoint('step0')
+    ledger.db.close()
+    resumed = nbtl.TaskLedger(ledgerConfig(tmp_path), queue.Queue())
+    assert resumed.isCheckpointed('step0')
+    assert not resumed.isCheckpointed('step1')
+
+
+################################################################################
+# stages of steps that run at the same time
+################################################################################
+def test_stages_of_two_steps_stay_apart(tmp_path):
+    output_queue = queue.Queue()
+    ledger = nbtl.TaskLedger(ledgerConfig(tmp_path), output_queue)
+    queue_a = nbtl.StageQueue(ledger, 'step_a')
+    queue_b = nbtl.StageQueue(ledger, 'step_b')
+    results_a = nbtl.StageResults(queue_a)
+    results_b = nbtl.StageResults(queue_b)
+    queue_a.beginStage('stage_a')
+    queue_b.beginStage('stage_b')
+    queue_a.put(('a.csv',))
+    assert (queue_a.qsize(), queue_b.qsize()) == (1, 0)
+    # a worker of stage_b is never handed a task of stage_a
+    with pytest.raises(queue.Empty):
+        ledger.lease('w1', 'stage_b', block=False)
+    task_id, stage, item = ledger.lease('w1', 'stage_a', block=False)
+    ledger.ack(task_id, [message('a done')], worker_id='w1')
+    assert results_a.get(timeout=1)[1] == 'a done'
+    assert results_b.empty()
+    assert output_queue.empty()
+
+def test_task_waits_for_promised_file(tmp_path):
+    ledger = nbtl.TaskLedger(ledgerConfig(tmp_path), queue.Queue())
+    ledger.promiseResources('step2', ['/temp/block_numprov/'])
+    queue_2 = nbtl.StageQueue(ledger, 'step2')
+    queue_3 = nbtl.StageQueue(ledger, 'step3')
+    queue_2.beginStage('block_numprov')
+    queue_3.beginStage('tract_numprov')
+    for speed in ['0.2', '10']:
+        queue_3.put(('tract', speed), 
+                    reads=['/temp/block_numprov/b_%s.csv' % speed])
+    # step 2's own tasks are not held up by its promise
+    for speed in ['0.2', '10']:
+        queue_2.put(('block', speed), 
+                    writes=['/temp/block_numprov/b_%s.csv' % speed])
+    assert (queue_2.qsize(), queue_3.qsize()) == (2, 0)
+
+    task_id, stage, item = ledger.lease('w1', 'block_numprov', block=False)
+    ledger.ack(task_id, [], worker_id='w1')
+    # only the task that reads the written speed can run
+    assert queue_3.qsize() == 1
+    assert ledger.lease('w2', 'tract_numprov', block=False)[2] == \
+            ('tract', item[1])
+
+    ledger.keepPromise('step2')
+    assert queue_3.qsize() == 1
+
+def test_broken_promise_fails_waiting_tasks(tmp_path):
+    ledger = nbtl.TaskLedger(ledgerConfig(tmp_path), queue.Queue())
+    ledger.promiseResources('step2', ['/temp/block_numprov/'])
+    queue_3 = nbtl.StageQueue(ledger, 'step3')
+    results_3 = nbtl.StageResults(queue_3)
+    queue_3.beginStage('tract_numprov')
+    queue_3.put(('tract', '10'), reads=['/temp/block_numprov/b_10.csv'])
+    queue_3.put(('county', '10'), reads=['/temp/other/c_10.csv'])
+    assert queue_3.qsize() == 1
+    ledger.breakPromise('step2', 'STEP 2 FAILED')
+    error = results_3.get(timeout=1)
+    assert nbtl.isErrorMessage(error)
+    assert 'STEP2' in error[1] and 'STEP 2 FAILED' in error[1]
+    assert queue_3.qsize() == 1
+    assert ledger.stages['tract_numprov']['waiting'] == []
+
+def test_resumed_writes_release_waiting_tasks(tmp_path):
+    ledger = nbtl.TaskLedger(ledgerConfig(tmp_path), queue.Queue())
+    ledger.beginStage('block_numprov', resumable=True)
+    ledger.put(('block', '10'))
+    task_id, stage, item = ledger.lease('w1', block=False)
+    ledger.ack(task_id, [message('block 10')], worker_id='w1')
+    ledger.db.close()
+
+    resumed = nbtl.TaskLedger(ledgerConfig(tmp_path), queue.Queue())
+    resumed.promiseResources('step2', ['/temp/block_numprov/'])
+    queue_2 = nbtl.StageQueue(resumed, 'step2')
+    queue_3 = nbtl.StageQueue(resumed, 'step3')
+    results_2 = nbtl.StageResults(queue_2)
+    queue_3.beginStage('tract_numprov')
+    queue_3.put(('tract', '10'), reads=['/temp/block_numprov/b_10.csv'])
+    assert queue_3.qsize() == 0
+    # the completed step 2 task is skipped, but its file counts as written
+    queue_2.beginStage('block_numprov', resumable=True)
+    assert not queue_2.put(('block', '10'), 
+                            writes=['/temp/block_numprov/b_10.csv'])
+    assert results_2.get(timeout=1)[1] == 'block 10'
+    assert queue_3.qsize() == 1
@@ -0,0 +1,88 @@
+import pytest
+import time
+import os
+
+# step 0 imports NBM2_functions and psycopg2, which need the database libraries
+pytest.importorskip('sqlalchemy')
+pytest.importorskip('geopandas')
+pytest.importorskip('psycopg2')
+
+import step0_task_13 as s0t13
+
+# run from the modules directory with:  python -m pytest test_step0_task_13.py
+
+
+def writeFBD(tmp_path, lines, end=b'\n'):
+    fbd_file = str(tmp_path / 'fbd.csv')
+    with open(fbd_file, 'wb') as my_file:
+        my_file.write(b'LogRecNo,Provider_Id\n' + b'\n'.join(lines) + end)
+    return fbd_file
+
+def readRanges(fbd_file, byte_ranges):
+    lines = []
+    with open(fbd_file, 'rb') as my_file:
+        for start, end in byte_ranges:
+            my_file.seek(start)
+            lines.extend(my_file.read(end - start).splitlines())
+    return lines
+
+
+@pytest.mark.parametrize('range_bytes', [1, 7, 20, 64, 1000])
+def test_ranges_hold_every_line_once(tmp_path, range_bytes):
+    lines = [b'%d,%s' % (i, b'x' * (i % 13)) for i in range(50)]
+    fbd_file = writeFBD(tmp_path, lines)
+    byte_ranges = s0t13.fbdByteRanges(fbd_file, range_bytes)
+    assert readRanges(fbd_file, byte_ranges) == lines
+    # the ranges follow each other and each starts at the start of a line
+    assert byte_ranges[0][0] == len(b'LogRecNo,Provider_Id\n')
+    assert byte_ranges[-1][1] == os.path.getsize(fbd_file)
+    with open(fbd_file, 'rb') as my_file:
+        data = my_file.read()
+    for (start, end), (next_start, next_end) in zip(byte_ranges,
+                                                    byte_ranges[1:]):
+        assert end == next_start
+        assert data[next_start - 1:next_start] == b'\n'
+
+def test_range_size(tmp_path):
+    lines = [b'%06d,provider' % i for i in range(1000)]
+    fbd_file = writeFBD(tmp_path, lines)
+    byte_ranges = s0t13.fbdByteRanges(fbd_file, 1000)
+    assert len(byte_ranges) == 16
+    assert all(1000 <= end - start < 1000 + 16 for start, end in
+                byte_ranges[:-1])
+
+def test_last_line_without_newline(tmp_path):
+    lines = [b'%d,a' % i for i in range(20)]
+    fbd_file = writeFBD(tmp_path, lines, end=b'')
+    assert readRanges(fbd_file, s0t13.fbdByteRanges(fbd_file, 10)) == lines
+
+def test_header_only(tmp_path):
+    fbd_file = writeFBD(tmp_path, [], end=b'')
+    assert s0t13.fbdByteRanges(fbd_file, 10) == []
+
+def test_joinFBDParts(tmp_path):
+    config = {  'temp_csvs_dir_path':   str(tmp_path) + '/',
+                'fbd_data_columns':     ['LogRecNo', 'Provider_Id'],
+                'fbd_partition':        {'join_threads': 2}}
+    part_path = str(tmp_path) + '/county_fbd/parts/'
+    os.makedirs(part_path)
+    parts = {   'fbd_df_01001_000000002000.csv':    b'3,c\n',
+                'fbd_df_01001_000000000021.csv':    b'1,a\n2,b\n',
+                'fbd_df_01003_000000000021.csv':    b'4,d\n',
+                # left by a worker that was stopped before it finished
+                'fbd_df_01001_000000004000.tmp12.3.csv':    b'9,z\n',
+                'fbd_df_01001_000000004000.csv.bak':        b'9,z\n'}
+    for part_name, data in parts.items():
+        with open(part_path + part_name, 'wb') as my_file:
+            my_file.write(data)
+
+    assert s0t13.joinFBDParts(['01001', '01003', '01005'], config,
+                                time.localtime())
+    joined = {}
+    for c in ['01001', '01003', '01005']:
+        with open(str(tmp_path) + '/county_fbd/fbd_df_%s.csv' % c, 'rb') as f:
+            joined[c] = f.read()
+    assert joined == {  '01001':    b'LogRecNo,Provider_Id\n1,a\n2,b\n3,c\n',
+                        '01003':    b'LogRecNo,Provider_Id\n4,d\n',
+                        '01005':    b'LogRecNo,Provider_Id\n'}
+    assert not os.path.exists(part_path + 'fbd_df_01001_000000004000.tmp12.3.csv')
@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+# step 1 imports NBM2_functions, which needs the database libraries
+pytest.importorskip('sqlalchemy')
+pytest.importorskip('geopandas')
+
+from NBM2_process_config import config
+import step1_functions as s1f
+
+# run from the modules directory with:  python -m pytest test_step1_functions.py
+
+
+def speeds_vectorized(dfgroup, val_arr, column_list, speed_column):
+    # the per group routine speedTiers replaced, kept as the reference
+    pop_mat=np.array(dfgroup['pop'].repeat(len(val_arr))).\
+                reshape((len(dfgroup),len(val_arr)))
+    speed_mat=np.array(dfgroup[speed_column].repeat(len(val_arr))).\
+                reshape((len(dfgroup),len(val_arr)))
+    result = pd.Series(list(np.sum(np.multiply(speed_mat>=val_arr,pop_mat),\
+                        axis=0)),index=column_list)
+    return result
+
+def fbdFrame(rows, seed=0):
+    generator = np.random.default_rng(seed)
+    speeds = np.concatenate([config['d_val_arr'], config['u_val_arr'],
+                            [0., 0.1, 0.15, 3.9, 50., 2000.]])
+    return pd.DataFrame({
+        'HocoNum':              generator.integers(1, 40, rows),
+        'TechCode':             generator.choice([10, 40, 50, 70], rows),
+        'pop':                  generator.integers(0, 500, rows),
+        'max_download_speed':   generator.choice(speeds, rows),
+        'max_upload_speed':     generator.choice(speeds, rows)})
+
+def oldTiers(df, group_columns, speed_column, val_arr, column_list):
+    return df.groupby(group_columns)[['pop', speed_column]].\
+            apply(speeds_vectorized, val_arr=np.array(val_arr),
+                column_list=column_list, speed_column=speed_column)
+
+
+@pytest.mark.parametrize('group_columns', [['HocoNum','TechCode'],
+                                            ['HocoNum']])
+@pytest.mark.parametrize('speed_column, val_arr, column_list', [
+    ('max_download_speed', config['d_val_arr'], config['d_column_list']),
+    ('max_upload_speed', config['u_val_arr'], config['u_column_list'])])
+def test_speedTiers_matches_speeds_vectorized(group_columns, speed_column,
+                                                val_arr, column_list):
+    df = fbdFrame(5000)
+    result = s1f.speedTiers(df, group_columns, speed_column, val_arr,
+                            column_list)
+    expected = oldTiers(df, group_columns, speed_column, val_arr, column_list)
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+    assert result.dtypes.unique().tolist() == [np.int64]
+
+def test_speedTiers_float_population():
+    df = fbdFrame(500, seed=1)
+    df['pop'] = df['pop'] / 3.
+    result = s1f.speedTiers(df, ['HocoNum'], 'max_download_speed',
+                            config['d_val_arr'], config['d_column_list'])
+    expected = oldTiers(df, ['HocoNum'], 'max_download_speed',
+                        config['d_val_arr'], config['d_column_list'])
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+
+def test_speedTiers_missing_values():
+    df = fbdFrame(500, seed=2)
+    df.loc[::7, 'max_download_speed'] = np.nan
+    df.loc[::11, 'HocoNum'] = np.nan
+    result = s1f.speedTiers(df, ['HocoNum'], 'max_download_speed',
+                            config['d_val_arr'], config['d_column_list'])
+    # a row without a speed or without a group is not counted
+    expected = oldTiers(df, ['HocoNum'], 'max_download_speed',
+                        config['d_val_arr'], config['d_column_list'])
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+    assert result['d_1'].sum() == \
+            df['pop'][df['HocoNum'].notna() &
+                    (df['max_download_speed'] >= config['d_val_arr'][0])].sum()
@@ -8,7 +8,7 @@ WHERE area >= 1
 ) AS a 
 LEFT JOIN 
 (
-SELECT "BLOCK_FIPS" AS block_fips, ST_AREA("GEOMETRY"::geography) AS area  
+SELECT "BLOCK_FIPS" AS block_fips, "GEODESIC_AREA" AS area  
 FROM {2}   
 ) AS b 
 ON a.block_fips = b.block_fips 
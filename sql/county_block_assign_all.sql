@@ -1,15 +1,15 @@
-INSERT INTO {0} 
-SELECT block_fips, county_fips, 999 AS area_pct 
+INSERT INTO {0} (block_fips, county_fips, area_pct, state_fips) 
+SELECT block_fips, county_fips, 999 AS area_pct, state_fips 
 FROM 
 (
-    SELECT x.block_fips, county_fips, row_number() OVER (PARTITION BY block_fips ORDER BY st_distance(x.geom::geography, y.geom::geography)) AS row_numb 
+    SELECT x.block_fips, county_fips, x.state_fips, row_number() OVER (PARTITION BY block_fips ORDER BY st_distance(x.geom::geography, y.geom::geography)) AS row_numb 
     FROM 
-    (	SELECT a.block_fips, substr(a.block_fips, 1, 2) AS state_fips, "GEOMETRY" AS geom 
+    (	SELECT a.block_fips, a.state_fips, "GEOMETRY" AS geom 
         FROM 
         (
-            SELECT "BLOCK_FIPS" AS block_fips, "GEOMETRY" 
+            SELECT "BLOCK_FIPS" AS block_fips, "STATE_FIPS" AS state_fips, "GEOMETRY" 
             FROM {1} 
-            WHERE substr("BLOCK_FIPS", 1, 5) IN ({3}) 
+            WHERE "COUNTY_FIPS" IN ({3}) 
         ) AS a 
         LEFT JOIN 
         (
@@ -4,18 +4,22 @@ CREATE TABLE {0}
 block_fips varchar(15), 
 county_fips varchar(5), 
 area numeric, 
-geom geometry(multipolygon, 4326) 
-); COMMIT; 
+geom geometry(multipolygon, 4326), 
+state_fips varchar(2) 
+) PARTITION BY LIST (state_fips); COMMIT; 
+{4} 
 
-INSERT INTO {0} 
+INSERT INTO {0} (block_fips, county_fips, area, geom, state_fips) 
 SELECT a."BLOCK_FIPS" AS block_fips, b."GEOID" AS county_fips, 
-(CASE WHEN ST_WITHIN(a."GEOMETRY", b."GEOMETRY") THEN ST_AREA(a."GEOMETRY"::geography) 
+(CASE WHEN ST_WITHIN(a."GEOMETRY", b."GEOMETRY") THEN a."GEODESIC_AREA" 
     ELSE NULL 
  END) AS area,  
 (CASE WHEN ST_WITHIN(a."GEOMETRY", b."GEOMETRY") THEN a."GEOMETRY" 
+    WHEN a."GEOMETRY_VALID" AND b."GEOMETRY_VALID" THEN 
+        ST_MULTI(ST_COLLECTIONEXTRACT(ST_INTERSECTION(a."GEOMETRY", b."GEOMETRY"), 3)) 
     ELSE ST_MULTI(ST_BUFFER(ST_INTERSECTION(a."GEOMETRY", b."GEOMETRY"), 0.0)) 
-END) AS geom  
+END) AS geom, a."STATE_FIPS" AS state_fips  
 FROM {2} AS a, {1} AS b   
-WHERE ST_INTERSECTS(a."GEOMETRY", b."GEOMETRY") and SUBSTR(a."BLOCK_FIPS", 1, 5) IN ({3}); COMMIT; 
+WHERE ST_INTERSECTS(a."GEOMETRY", b."GEOMETRY") and a."COUNTY_FIPS" IN ({3}); COMMIT; 
 
-UPDATE {0} SET area = ST_AREA(geom::geography) WHERE area IS NULL; COMMIT;  
\ No newline at end of file
+UPDATE {0} SET area = ST_AREA(geom::geography) WHERE area IS NULL; COMMIT;  
@@ -1,15 +1,19 @@
 DROP TABLE IF EXISTS {0}; COMMIT; 
 CREATE TABLE {0} 
 (
-block_fips varchar(15) primary key, 
+block_fips varchar(15), 
 county_fips varchar(5), 
-area_pct numeric 
-); COMMIT; 
+area_pct numeric, 
+state_fips varchar(2), 
+primary key (block_fips, state_fips) 
+) PARTITION BY LIST (state_fips); COMMIT; 
+{4} 
 
-INSERT INTO {0} 
+INSERT INTO {0} (block_fips, county_fips, area_pct, state_fips) 
 SELECT "BLOCK_FIPS" AS block_fips, 
 {3} AS county_fips, 
-1 AS area_pct 
+1 AS area_pct, 
+"STATE_FIPS" AS state_fips 
 FROM {1} 
-WHERE substr("BLOCK_FIPS", 1, 5) NOT IN ({2}); 
-COMMIT; 
\ No newline at end of file
+WHERE "COUNTY_FIPS" NOT IN ({2}); 
+COMMIT; 
@@ -1,14 +1,14 @@
-INSERT INTO {0} 
-SELECT a.block_fips, county_fips, round((a.area/b.area)::numeric, 4) AS area_pct 
+INSERT INTO {0} (block_fips, county_fips, area_pct, state_fips) 
+SELECT a.block_fips, county_fips, round((a.area/b.area)::numeric, 4) AS area_pct, a.state_fips 
 FROM 
 (
-   SELECT block_fips, county_fips, area, row_number() OVER (PARTITION BY block_fips ORDER BY area DESC) AS row_numb 
+   SELECT block_fips, county_fips, area, state_fips, row_number() OVER (PARTITION BY block_fips ORDER BY area DESC) AS row_numb 
    FROM {1} 
    WHERE area >= 1  
 ) AS a 
 LEFT JOIN 
 (
-   SELECT "BLOCK_FIPS" AS block_fips, st_area("GEOMETRY"::geography) AS area 
+   SELECT "BLOCK_FIPS" AS block_fips, "GEODESIC_AREA" AS area 
    FROM {2}   
 ) AS b 
 ON a.block_fips = b.block_fips 
@@ -0,0 +1,7 @@
+DROP TABLE IF EXISTS {0}; COMMIT; 
+CREATE TABLE {0} AS 
+SELECT {2}, ST_Subdivide("GEOMETRY", {3}) AS geom 
+FROM {1}; COMMIT; 
+CREATE INDEX ON {0} USING gist(geom); COMMIT; 
+CREATE INDEX ON {0} ("GEOID"); COMMIT; 
+ANALYZE {0}; COMMIT; 
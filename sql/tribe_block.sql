@@ -5,8 +5,10 @@ CREATE TABLE {0}
     tribal_id   varchar(5),
     aianhhcc    varchar(2),
     area        numeric,
-    geom        geometry(multipolygon, {2})
-); COMMIT; 
+    geom        geometry(multipolygon, {2}),
+    state_fips  varchar(2),
+    county_fips varchar(5)
+) PARTITION BY LIST (state_fips); COMMIT; {3} 
 DROP TABLE IF EXISTS {1}; COMMIT; 
 CREATE TABLE {1}
 (
@@ -15,7 +15,7 @@ LEFT JOIN
 ON a.block_fips = b.block_fips 
 LEFT JOIN 
 (
-    SELECT "BLOCK_FIPS" AS block_fips, ST_AREA("GEOMETRY"::geography) AS area 
+    SELECT "BLOCK_FIPS" AS block_fips, "GEODESIC_AREA" AS area 
     FROM {2}  
 ) AS c 
 ON a.block_fips = c.block_fips 